@@ -0,0 +1,32 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from accounts.models import User
+from accounts.stats import rebuild_stats
+
+
+class Command(BaseCommand):
+    help = 'Recompute every UserStats row from game, battle and achievement history (see accounts/stats.py)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=5000, help='Users per round of queries')
+        parser.add_argument('--start-after', type=int, default=0, help='Skip users with an id up to this one')
+
+    def handle(self, *args, **options):
+        chunk_size = options['chunk_size']
+        last_id = options['start_after']
+        remaining = User.objects.filter(id__gt=last_id).count()
+        done = 0
+        started = time.perf_counter()
+        while True:
+            ids = list(User.objects.filter(id__gt=last_id).order_by('id').values_list('id', flat=True)[:chunk_size])
+            if not ids:
+                break
+            done += rebuild_stats(ids[0], ids[-1])
+            last_id = ids[-1]
+            self.stdout.write(
+                f"{done}/{remaining} users ({done * 100 // max(remaining, 1)}%), last user {last_id}, "
+                f"{time.perf_counter() - started:.1f}s"
+            )
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt stats for {done} users"))
@@ -0,0 +1,28 @@
+# Generated by Django 5.2.7 on 2026-10-19 05:12
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UserStats',
+            fields=[
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='stats', serialize=False, to=settings.AUTH_USER_MODEL)),
+                ('quizzes_completed', models.IntegerField(default=0)),
+                ('questions_answered', models.IntegerField(default=0)),
+                ('correct_answers', models.IntegerField(default=0)),
+                ('multiplayer_games', models.IntegerField(default=0)),
+                ('code_battles', models.IntegerField(default=0)),
+                ('achievements', models.IntegerField(default=0)),
+                ('current_streak', models.IntegerField(default=0)),
+            ],
+        ),
+    ]
@@ -9,3 +9,22 @@ class User(AbstractUser):
 
     def __str__(self):
         return self.username
+
+
+class UserStats(models.Model):
+    """Per-user profile counters, kept up to date as games end (see accounts/stats.py)."""
+    user = models.OneToOneField(User, on_delete=models.CASCADE, primary_key=True, related_name='stats')
+    quizzes_completed = models.IntegerField(default=0)
+    questions_answered = models.IntegerField(default=0)
+    correct_answers = models.IntegerField(default=0)
+    multiplayer_games = models.IntegerField(default=0)
+    code_battles = models.IntegerField(default=0)
+    achievements = models.IntegerField(default=0)
+    current_streak = models.IntegerField(default=0)
+
+    @property
+    def accuracy(self):
+        return round(self.correct_answers * 100 / self.questions_answered) if self.questions_answered else 0
+
+    def __str__(self):
+        return f"{self.user_id} stats"
@@ -0,0 +1,177 @@
+"""
+The ``UserStats`` projection behind the profile page.
+
+Rather than counting sessions, battles and achievements on every profile
+view, each user has one ``UserStats`` row that is adjusted with ``F()``
+updates in the same transaction as the event that changes it:
+
+* ``record_game`` when a ``GameSession`` is completed,
+* ``record_battle`` when a coding battle ends (or is reaped),
+* the ``Achievement`` and ``Streak`` signal handlers below.
+
+A user without a row yet gets one computed from their history the first
+time it is needed. ``rebuild_stats`` recomputes rows for a range of users
+with one grouped query per source (``manage.py rebuild_user_stats``).
+
+``user_count`` is the total number of users, cached and adjusted as users
+are created and deleted.
+"""
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Case, Count, F, Max, Q, Sum, Value, When
+from django.db.models.signals import post_delete, post_save
+
+from gamification.models import Achievement, Streak
+
+from .models import User, UserStats
+
+STAT_FIELDS = (
+    'quizzes_completed', 'questions_answered', 'correct_answers', 'multiplayer_games',
+    'code_battles', 'achievements', 'current_streak',
+)
+USER_COUNT_KEY = 'accounts:user_count'
+
+
+def rebuild_stats(low, high, batch_size=1000):
+    """Recompute the rows of users ``low``..``high`` from their history. Returns the number of rows written."""
+    from codebattle.models import Battle
+    from quizzes.models import GameSession
+
+    user_ids = User.objects.filter(id__gte=low, id__lte=high).values_list('id', flat=True)
+    stats = {user_id: dict.fromkeys(STAT_FIELDS, 0) for user_id in user_ids}
+    if not stats:
+        return 0
+    in_range = {'user_id__gte': low, 'user_id__lte': high}
+
+    sessions = GameSession.objects.filter(completed_at__isnull=False, **in_range).values('user_id').annotate(
+        quizzes_completed=Count('id'),
+        questions_answered=Sum('total_questions'),
+        correct_answers=Sum('score'),
+        multiplayer_games=Count('id', filter=Q(mode='multiplayer')),
+    ).order_by()
+    for row in sessions:
+        if row['user_id'] in stats:
+            stats[row['user_id']].update(
+                (name, row[name] or 0)
+                for name in ('quizzes_completed', 'questions_answered', 'correct_answers', 'multiplayer_games')
+            )
+    for player in ('player1_id', 'player2_id'):
+        battles = Battle.objects.filter(
+            status='completed', **{f'{player}__gte': low, f'{player}__lte': high}
+        ).values(player).annotate(total=Count('id')).order_by()
+        for row in battles:
+            if row[player] in stats:
+                stats[row[player]]['code_battles'] += row['total']
+    for row in Achievement.objects.filter(**in_range).values('user_id').annotate(total=Count('id')).order_by():
+        if row['user_id'] in stats:
+            stats[row['user_id']]['achievements'] = row['total']
+    for row in Streak.objects.filter(**in_range).values('user_id').annotate(best=Max('current_streak')).order_by():
+        if row['user_id'] in stats:
+            stats[row['user_id']]['current_streak'] = row['best']
+
+    UserStats.objects.bulk_create(
+        [UserStats(user_id=user_id, **values) for user_id, values in stats.items()],
+        batch_size=batch_size, update_conflicts=True, unique_fields=['user'], update_fields=list(STAT_FIELDS),
+    )
+    return len(stats)
+
+
+def get_user_stats(user_id):
+    """The user's ``UserStats`` row (one query), built from history if missing."""
+    stats = UserStats.objects.filter(user_id=user_id).first()
+    if stats is None:
+        rebuild_stats(user_id, user_id)
+        stats = UserStats.objects.get(user_id=user_id)
+    return stats
+
+
+def _bump(user_id, **deltas):
+    deltas = {name: amount for name, amount in deltas.items() if amount}
+    if not deltas or not user_id:
+        return
+    with transaction.atomic():
+        updated = UserStats.objects.filter(user_id=user_id).update(
+            **{name: F(name) + amount for name, amount in deltas.items()}
+        )
+        if not updated:
+            # No row yet: the history already includes this event
+            rebuild_stats(user_id, user_id)
+
+
+def record_game(session):
+    """Count a completed ``GameSession`` (call right after saving it)."""
+    _bump(
+        session.user_id,
+        quizzes_completed=1,
+        questions_answered=session.total_questions,
+        correct_answers=session.score,
+        multiplayer_games=int(session.mode == 'multiplayer'),
+    )
+
+
+def record_battle(battle):
+    """Count a completed coding battle for both players."""
+    for user_id in {battle.player1_id, battle.player2_id}:
+        _bump(user_id, code_battles=1)
+
+
+def set_streaks(streaks):
+    """Copy ``{user_id: current_streak}`` written without ``save()`` into existing rows, in one query."""
+    if streaks:
+        UserStats.objects.filter(user_id__in=streaks).update(current_streak=Case(
+            *[When(user_id=user_id, then=Value(streak)) for user_id, streak in streaks.items()],
+            default=F('current_streak'),
+        ))
+
+
+def add_achievements(counts):
+    """Count achievements inserted in bulk (no signals), given ``{user_id: number}``."""
+    by_amount = {}
+    for user_id, amount in counts.items():
+        by_amount.setdefault(amount, []).append(user_id)
+    for amount, user_ids in by_amount.items():
+        UserStats.objects.filter(user_id__in=user_ids).update(achievements=F('achievements') + amount)
+
+
+def user_count():
+    """Total number of users, cached."""
+    return cache.get_or_set(USER_COUNT_KEY, User.objects.count, getattr(settings, 'USER_COUNT_TTL', 300))
+
+
+def _adjust_user_count(delta):
+    try:
+        cache.incr(USER_COUNT_KEY, delta)
+    except ValueError:
+        pass  # not cached; the next read counts
+
+
+def _user_saved(sender, instance, created, **kwargs):
+    if created:
+        _adjust_user_count(1)
+
+
+def _user_deleted(sender, instance, **kwargs):
+    _adjust_user_count(-1)
+
+
+def _achievement_saved(sender, instance, created, **kwargs):
+    if created:
+        _bump(instance.user_id, achievements=1)
+
+
+def _achievement_deleted(sender, instance, **kwargs):
+    UserStats.objects.filter(user_id=instance.user_id).update(achievements=F('achievements') - 1)
+
+
+def _streak_saved(sender, instance, **kwargs):
+    UserStats.objects.filter(user_id=instance.user_id).exclude(current_streak=instance.current_streak).update(
+        current_streak=instance.current_streak
+    )
+
+
+post_save.connect(_user_saved, sender=User)
+post_delete.connect(_user_deleted, sender=User)
+post_save.connect(_achievement_saved, sender=Achievement)
+post_delete.connect(_achievement_deleted, sender=Achievement)
+post_save.connect(_streak_saved, sender=Streak)
@@ -1,3 +1,79 @@
+from io import StringIO
+
+from django.core.cache import cache
+from django.core.management import call_command
 from django.test import TestCase
+from django.urls import reverse
+from django.utils import timezone
+
+from codebattle.models import Battle
+from gamification.models import Achievement, Badge, Streak
+from quizzes.models import GameSession, Quiz, Topic
+
+from .models import User, UserStats
+from .stats import USER_COUNT_KEY, get_user_stats, record_battle, record_game, user_count
+
+
+class UserStatsTestCase(TestCase):
+    def setUp(self):
+        cache.delete(USER_COUNT_KEY)
+        self.user = User.objects.create_user(username='alice', password='pw')
+        self.other = User.objects.create_user(username='bob', password='pw')
+        self.quiz = Quiz.objects.create(title='Q', topic=Topic.objects.create(name='T'), created_by=self.user)
+
+    def complete(self, score, total, mode='single'):
+        session = GameSession.objects.create(
+            user=self.user, quiz=self.quiz, score=score, total_questions=total, mode=mode, completed_at=timezone.now()
+        )
+        record_game(session)
+        return session
+
+    def test_first_read_builds_from_history_then_events_update_the_row(self):
+        GameSession.objects.create(
+            user=self.user, quiz=self.quiz, score=3, total_questions=4, mode='single', completed_at=timezone.now()
+        )
+        stats = get_user_stats(self.user.id)
+        self.assertEqual((stats.quizzes_completed, stats.accuracy), (1, 75))
+
+        self.complete(1, 4, mode='multiplayer')
+        battle = Battle.objects.create(player1=self.user, player2=self.other, status='completed')
+        record_battle(battle)
+        Achievement.objects.create(user=self.user, badge=Badge.objects.create(name='B', description='', criteria={}))
+        Streak.objects.create(user=self.user, current_streak=4)
+
+        stats.refresh_from_db()
+        self.assertEqual(
+            (stats.quizzes_completed, stats.accuracy, stats.multiplayer_games, stats.code_battles,
+             stats.achievements, stats.current_streak),
+            (2, 50, 1, 1, 1, 4),
+        )
+        self.assertEqual(get_user_stats(self.other.id).code_battles, 1)
+
+    def test_rebuild_command_matches_incremental_updates(self):
+        get_user_stats(self.user.id)
+        self.complete(5, 5)
+        self.complete(2, 5)
+        incremental = UserStats.objects.values().get(user=self.user)
+        UserStats.objects.all().delete()
+        call_command('rebuild_user_stats', chunk_size=1, stdout=StringIO())
+        self.assertEqual(UserStats.objects.values().get(user=self.user), incremental)
+        self.assertEqual(UserStats.objects.count(), 2)
+
+    def test_user_count_is_cached_and_adjusted(self):
+        self.assertEqual(user_count(), 2)
+        User.objects.create_user(username='carol', password='pw')
+        with self.assertNumQueries(0):
+            self.assertEqual(user_count(), 3)
+        self.other.delete()
+        self.assertEqual(user_count(), 2)
 
-# Create your tests here.
+    def test_profile_reads_one_stats_row(self):
+        self.complete(4, 5)
+        self.client.force_login(self.user)
+        self.client.get(reverse('profile'))
+        # session + user, stats row, latest achievements, recent games (leaderboard and count are cached)
+        with self.assertNumQueries(5):
+            response = self.client.get(reverse('profile'))
+        self.assertEqual(response.context['total_quizzes'], 1)
+        self.assertEqual(response.context['accuracy'], 80)
+        self.assertEqual(response.context['total_users'], 2)
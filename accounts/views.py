@@ -55,69 +55,53 @@ class CustomLogoutView(LogoutView):
         messages.info(request, 'You have been logged out.')
         return redirect('home')
 
-def profile_page(request):
-    """HTML profile page view"""
-    from gamification.models import Achievement, Streak
+def profile_context(user):
+    """Everything the profile template shows: one stats row plus the latest achievements and games."""
+    from gamification.models import Achievement
+    from gamification.leaderboard import get_leaderboard
     from quizzes.models import GameSession
-    from codebattle.models import Battle
-    from django.db.models import Q
-    
-    if not request.user.is_authenticated:
-        return redirect('login')
-    
-    user = request.user
-    
-    achievements = Achievement.objects.filter(user=user).select_related('badge').order_by('-earned_at')
-    
+    from .stats import get_user_stats, user_count
+
+    stats = get_user_stats(user.id)
+
+    achievements = Achievement.objects.filter(user=user).select_related('badge').order_by('-earned_at')[:4]
+
     xp_per_level = 100
     progress_percentage = min((user.xp % xp_per_level) * 100 / xp_per_level, 100)
     remaining_percentage = 100 - progress_percentage
     xp_to_next_level = xp_per_level - (user.xp % xp_per_level)
-    
-    streak_obj, _ = Streak.objects.get_or_create(user=user)
-    streak = streak_obj.current_streak
-    
-    recent_sessions = GameSession.objects.filter(
+
+    recent_sessions = list(GameSession.objects.filter(
         user=user, completed_at__isnull=False
-    ).select_related('quiz', 'quiz__topic').order_by('-completed_at')[:10]
-    
+    ).select_related('quiz', 'quiz__topic').order_by('-completed_at')[:10])
+
     for session in recent_sessions:
         session.percentage = round((session.score / session.total_questions * 100)) if session.total_questions > 0 else 0
-    
-    total_quizzes = recent_sessions.count()
-    total_answers = sum(s.total_questions for s in recent_sessions)
-    correct_answers = sum(s.score for s in recent_sessions)
-    accuracy = round((correct_answers / total_answers * 100)) if total_answers else 0
-    
-    code_battles = Battle.objects.filter(
-        Q(player1=user) | Q(player2=user),
-        status='completed'
-    ).count()
-    
-    multiplayer_games = GameSession.objects.filter(
-        user=user,
-        mode="multiplayer",
-        completed_at__isnull=False
-    ).count()
-    
-    global_rank = User.objects.filter(total_score__gt=user.total_score).count() + 1
-    total_users = User.objects.count()
-    
-    return render(request, 'accounts/profile.html', {
+
+    return {
         'user': user,
         'achievements': achievements,
+        'achievement_count': stats.achievements,
         'progress_percentage': progress_percentage,
         'remaining_percentage': remaining_percentage,
         'xp_to_next_level': xp_to_next_level,
-        'streak': streak,
+        'streak': stats.current_streak,
         'recent_sessions': recent_sessions,
-        'total_quizzes': total_quizzes,
-        'accuracy': accuracy,
-        'code_battles': code_battles,
-        'multiplayer_games': multiplayer_games,
-        'global_rank': global_rank,
-        'total_users': total_users,
-    })
+        'total_quizzes': stats.quizzes_completed,
+        'accuracy': stats.accuracy,
+        'code_battles': stats.code_battles,
+        'multiplayer_games': stats.multiplayer_games,
+        'global_rank': get_leaderboard().rank(user.id),
+        'total_users': user_count(),
+    }
+
+
+def profile_page(request):
+    """HTML profile page view"""
+    if not request.user.is_authenticated:
+        return redirect('login')
+
+    return render(request, 'accounts/profile.html', profile_context(request.user))
 
 
 class ProfileView(generics.RetrieveUpdateAPIView):
@@ -126,64 +110,4 @@ class ProfileView(generics.RetrieveUpdateAPIView):
     renderer_classes = [TemplateHTMLRenderer]  # <-- IMPORTANT
 
     def get(self, request, *args, **kwargs):
-        from gamification.models import Achievement, Streak
-        from quizzes.models import GameSession
-        from codebattle.models import Battle
-        from django.db.models import Q
-
-        user = request.user
-
-        achievements = Achievement.objects.filter(user=user).order_by('-earned_at')
-
-        xp_per_level = 100
-        progress_percentage = min((user.xp % xp_per_level) * 100 / xp_per_level, 100)
-        remaining_percentage = 100 - progress_percentage
-        xp_to_next_level = xp_per_level - (user.xp % xp_per_level)
-
-        streak_obj, _ = Streak.objects.get_or_create(user=user)
-        streak = streak_obj.current_streak
-
-        recent_sessions = GameSession.objects.filter(
-            user=user, completed_at__isnull=False
-        ).select_related('quiz', 'quiz__topic').order_by('-completed_at')[:10]
-
-        for session in recent_sessions:
-            session.percentage = round((session.score / session.total_questions * 100)) if session.total_questions > 0 else 0
-
-        total_quizzes = recent_sessions.count()
-        total_answers = sum(s.total_questions for s in recent_sessions)
-        correct_answers = sum(s.score for s in recent_sessions)
-        accuracy = round((correct_answers / total_answers * 100)) if total_answers else 0
-
-        code_battles = Battle.objects.filter(
-            Q(player1=user) | Q(player2=user),
-            status='completed'
-        ).count()
-
-        multiplayer_games = GameSession.objects.filter(
-            user=user,
-            mode="multiplayer",
-            completed_at__isnull=False
-        ).count()
-
-        global_rank = User.objects.filter(total_score__gt=user.total_score).count() + 1
-        total_users = User.objects.count()
-
-        return Response(
-            {
-                "user": user,
-                "achievements": achievements,
-                "progress_percentage": progress_percentage,
-                "remaining_percentage": remaining_percentage,
-                "xp_to_next_level": xp_to_next_level,
-                "streak": streak,
-                "recent_sessions": recent_sessions,
-                "total_quizzes": total_quizzes,
-                "accuracy": accuracy,
-                "code_battles": code_battles,
-                "multiplayer_games": multiplayer_games,
-                "global_rank": global_rank,
-                "total_users": total_users,
-            },
-            template_name="accounts/profile.html" 
-        )
\ No newline at end of file
+        return Response(profile_context(request.user), template_name="accounts/profile.html")
@@ -3,14 +3,24 @@ import json
 import asyncio
 from .models import Battle, Submission, Challenge
 from .services import Judge0Service
+from .finishes import finish_ledger
+from .matchmaking import get_matchmaking
+from .scoring import add_score, battle_scores, claim_question
+from .snapshots import battle_challenge, dynamic_snapshot, static_snapshot
+from gamification.jobs import run_soon
 from channels.db import database_sync_to_async
 from django.utils import timezone
 from asgiref.sync import sync_to_async
 from django.contrib.auth.models import User
 from datetime import date
+from smartquizarena.deadlines import clock_sync_reply, deadline_after, round_deadline_event, round_timers
+from smartquizarena.encoding import EncodedEventsMixin
+from smartquizarena.presence import get_presence_hub
+from smartquizarena.reaper import ensure_reaper
 
-class CodeBattleConsumer(AsyncWebsocketConsumer):
+class CodeBattleConsumer(EncodedEventsMixin, AsyncWebsocketConsumer):
     async def connect(self):
+        ensure_reaper()
         self.battle_code = self.scope['url_route']['kwargs'].get('battle_code')
         self.battle_id = None
         if self.battle_code:
@@ -34,6 +44,9 @@ class CodeBattleConsumer(AsyncWebsocketConsumer):
 
         await self.accept()
 
+        if self.battle_id and self.user.is_authenticated:
+            get_presence_hub().update(self.battle_group_name, self.user.username, online=True)
+
         if self.battle_id:
             # Send initial battle state with players
             battle_data = await self.get_battle_data(self.battle_id)
@@ -42,67 +55,64 @@ class CodeBattleConsumer(AsyncWebsocketConsumer):
                 players.append({'username': battle_data['player1']})
             if battle_data['player2']:
                 players.append({'username': battle_data['player2']})
-            await self.send(json.dumps({
+            await self.send_event({
                 "type": "initial_state",
-                "battle": battle_data,
+                **await self.battle_fields(self.battle_id, battle_data),
                 "players": players
-            }))
+            })
+            # Late joiners (e.g. after a reload) resync to the pending deadline
+            deadline = round_timers.deadline_for(self.battle_group_name)
+            if deadline and battle_data.get('current_challenge'):
+                await self.send_event(round_deadline_event(
+                    deadline,
+                    battle_data['current_challenge']['time_limit'],
+                    challenge_index=battle_data['current_challenge_index']
+                ))
         else:
             # Lobby connection
-            await self.send(json.dumps({
+            await self.send_event({
                 "type": "connected",
                 "message": "Connected to Coding Challenge Lobby"
-            }))
+            })
 
     async def disconnect(self, close_code):
-        # stop typing broadcast when leaving
-        if self.battle_id:
-            await self.channel_layer.group_send(
-                self.battle_group_name,
-                {
-                    "type": "stop_typing",
-                    "username": self.scope["user"].username
-                }
-            )
+        # Going offline also clears typing
+        if self.battle_id and self.scope["user"].is_authenticated:
+            get_presence_hub().leave(self.battle_group_name, self.scope["user"].username)
+        elif self.scope["user"].is_authenticated:
+            get_matchmaking().leave(self.scope["user"].id)
 
         await self.channel_layer.group_discard(
             self.battle_group_name,
             self.channel_name
         )
 
-    async def receive(self, text_data):
+    async def receive(self, text_data=None, bytes_data=None):
         try:
-            data = json.loads(text_data)
-        except json.JSONDecodeError:
-            await self.send(json.dumps({"type": "error", "message": "Invalid JSON"}))
+            data = self.decode_message(text_data, bytes_data)
+        except ValueError:
+            await self.send_event({"type": "error", "message": "Invalid JSON"})
             return
 
         user = self.scope["user"]
         if not user.is_authenticated:
-            await self.send(json.dumps({"type": "error", "message": "Authentication required"}))
+            await self.send_event({"type": "error", "message": "Authentication required"})
             return
 
         msg_type = data.get("type")
 
+        if msg_type == "clock_sync":
+            await self.send_event(clock_sync_reply(data.get("client_time")))
+            return
+
         # SAFE TYPING SYNC (NO CHEATING)
+        # Keystrokes are coalesced by the presence hub, not forwarded one by one
         if msg_type == "typing":
-            await self.channel_layer.group_send(
-                self.battle_group_name,
-                {
-                    "type": "typing",
-                    "username": user.username
-                }
-            )
+            get_presence_hub().typing(self.battle_group_name, user.username)
             return
 
         if msg_type == "stop_typing":
-            await self.channel_layer.group_send(
-                self.battle_group_name,
-                {
-                    "type": "stop_typing",
-                    "username": user.username
-                }
-            )
+            get_presence_hub().stop_typing(self.battle_group_name, user.username)
             return
 
         if self.battle_id:
@@ -118,13 +128,7 @@ class CodeBattleConsumer(AsyncWebsocketConsumer):
         if msg_type == "set_ready":
             await self.handle_set_ready(user, data)
         elif msg_type == "tab_switch_warning":
-            await self.channel_layer.group_send(
-                self.battle_group_name,
-                {
-                    "type": "tab_warning",
-                    "username": user.username
-                }
-            )
+            get_presence_hub().tab_warning(self.battle_group_name, user.username)
         else:
             # Lobby messages
             if msg_type == "get_challenges":
@@ -133,6 +137,11 @@ class CodeBattleConsumer(AsyncWebsocketConsumer):
                 await self.handle_create_battle(user, data)
             elif msg_type == "join_battle":
                 await self.handle_join_battle(user, data)
+            elif msg_type == "find_match":
+                await self.handle_find_match(user, data)
+            elif msg_type == "cancel_match":
+                get_matchmaking().leave(user.id)
+                await self.send_event({"type": "match_cancelled"})
             elif msg_type == "join_battle_by_code":
                 await self.handle_join_battle_by_code(user, data)
             elif msg_type == "leave_battle":
@@ -142,10 +151,10 @@ class CodeBattleConsumer(AsyncWebsocketConsumer):
 
     async def handle_get_challenges(self, user, data):
         challenges = await self.get_challenges()
-        await self.send(json.dumps({
+        await self.send_event({
             "type": "challenges_list",
             "challenges": challenges
-        }))
+        })
 
     async def handle_create_battle(self, user, data):
         num_questions = data.get('num_questions', 5)
@@ -154,7 +163,7 @@ class CodeBattleConsumer(AsyncWebsocketConsumer):
         # Get random challenges based on level
         challenges = await self.get_challenges_by_level(level, num_questions)
         if not challenges:
-            await self.send(json.dumps({"type": "error", "message": "No challenges available for this level"}))
+            await self.send_event({"type": "error", "message": "No challenges available for this level"})
             return
 
         # Create battle with challenges
@@ -171,48 +180,37 @@ class CodeBattleConsumer(AsyncWebsocketConsumer):
             self.channel_name
         )
 
-        # Get battle data
-        battle_data = await self.get_battle_data(battle.id)
-
-        await self.send(json.dumps({
+        await self.send_event({
             "type": "battle_joined",
-            "battle": battle_data
-        }))
+            **await self.battle_fields(battle.id)
+        })
 
     async def handle_join_battle(self, user, data):
         challenge_id = data.get('challenge_id')
         if not challenge_id:
-            await self.send(json.dumps({"type": "error", "message": "Challenge ID required"}))
+            await self.send_event({"type": "error", "message": "Challenge ID required"})
             return
 
-        battle = await self.join_or_create_battle(user, challenge_id)
-        if battle:
-            # Switch to battle room
-            await self.channel_layer.group_discard(
-                self.battle_group_name,
-                self.channel_name
-            )
-            self.battle_group_name = f'battle_{battle.id}'
-            await self.channel_layer.group_add(
-                self.battle_group_name,
-                self.channel_name
-            )
-
-            # Get fresh battle data after potential update
-            battle_data = await self.get_battle_data(battle.id)
-
-            await self.send(json.dumps({
-                "type": "battle_joined",
-                "battle": battle_data
-            }))
+        # Queue for an opponent at this challenge's level and language
+        challenge = await self.get_challenge(challenge_id)
+        if challenge is None:
+            await self.send_event({"type": "error", "message": "Challenge not found"})
+            return
+        await self.handle_find_match(user, {'level': challenge.difficulty, 'language': challenge.language})
 
-            # Battle will start when explicitly triggered (not automatically when both players join)
-            # Players need to wait in the room until ready
+    async def handle_find_match(self, user, data):
+        level = data.get('level', 'medium')
+        language = data.get('language', 'python')
+        # Matched players (including this one) hear about it through the lobby's match_found event
+        rating = await self.get_rating(user.id)
+        pair = await get_matchmaking().join(level, language, user.id, user.username, rating=rating)
+        if pair is None:
+            await self.send_event({"type": "match_queued", "level": level, "language": language})
 
     async def handle_join_battle_by_code(self, user, data):
         battle_code = data.get('battle_code')
         if not battle_code:
-            await self.send(json.dumps({"type": "error", "message": "Battle code required"}))
+            await self.send_event({"type": "error", "message": "Battle code required"})
             return
 
         battle = await self.join_battle_by_code(user, battle_code)
@@ -231,10 +229,10 @@ class CodeBattleConsumer(AsyncWebsocketConsumer):
             # Get fresh battle data after potential update
             battle_data = await self.get_battle_data(battle.id)
 
-            await self.send(json.dumps({
+            await self.send_event({
                 "type": "battle_joined",
-                "battle": battle_data
-            }))
+                **await self.battle_fields(battle.id, battle_data)
+            })
 
             # Prepare players list
             players = []
@@ -263,34 +261,23 @@ class CodeBattleConsumer(AsyncWebsocketConsumer):
                 }
             )
         else:
-            await self.send(json.dumps({
+            await self.send_event({
                 "type": "error",
                 "message": "Could not join battle. Battle may be full or not exist."
-            }))
+            })
 
     async def handle_set_ready(self, user, data):
         ready = data.get('ready', True)
-        await self.set_player_ready(self.battle_id, user, ready)
+        ready_flags = await self.set_player_ready(self.battle_id, user, ready)
 
-        # Get updated battle data
-        battle_data = await self.get_battle_data(self.battle_id)
-
-        # Broadcast ready status update
-        await self.channel_layer.group_send(
-            self.battle_group_name,
-            {
-                'type': 'ready_status_update',
-                'battle': battle_data,
-                'player': user.username,
-                'ready': ready
-            }
-        )
+        # Opponents learn about it through the (coalesced) presence event
+        get_presence_hub().update(self.battle_group_name, user.username, ready=ready)
 
-        await self.send(json.dumps({
+        await self.send_event({
             "type": "ready_updated",
             "ready": ready,
-            "battle": battle_data
-        }))
+            **ready_flags
+        })
 
     async def handle_leave_battle(self, user, data):
         # Leave current battle
@@ -304,9 +291,9 @@ class CodeBattleConsumer(AsyncWebsocketConsumer):
             self.battle_group_name,
             self.channel_name
         )
-        await self.send(json.dumps({
+        await self.send_event({
             "type": "left_battle"
-        }))
+        })
 
         # Broadcast to the battle group that player left
         if battle_code:
@@ -320,7 +307,7 @@ class CodeBattleConsumer(AsyncWebsocketConsumer):
                 if battle.player2 and battle.player2 != user:
                     players.append({'username': battle.player2.username})
 
-                await self.channel_layer.group_send(
+                await self.broadcast(
                     battle_group,
                     {
                         'type': 'player_left',
@@ -332,7 +319,7 @@ class CodeBattleConsumer(AsyncWebsocketConsumer):
     async def handle_load_challenge(self, user, data):
         challenge_id = data.get('challenge_id')
         if not challenge_id:
-            await self.send(json.dumps({"type": "error", "message": "Challenge ID required"}))
+            await self.send_event({"type": "error", "message": "Challenge ID required"})
             return
 
         challenge = await self.get_challenge(challenge_id)
@@ -346,25 +333,25 @@ class CodeBattleConsumer(AsyncWebsocketConsumer):
                 'difficulty': challenge.difficulty,
                 'time_limit': challenge.time_limit
             }
-            await self.send(json.dumps({
+            await self.send_event({
                 "type": "challenge_loaded",
                 "challenge": challenge_data
-            }))
+            })
         else:
-            await self.send(json.dumps({
+            await self.send_event({
                 "type": "error",
                 "message": "Challenge not found"
-            }))
+            })
 
     async def handle_run_code(self, user, data):
         code = data.get('code')
         language = data.get('language')
         if not code or not language:
-            await self.send(json.dumps({"type": "error", "message": "Code and language required"}))
+            await self.send_event({"type": "error", "message": "Code and language required"})
             return
 
         # Broadcast to opponent that player is running code
-        await self.channel_layer.group_send(
+        await self.broadcast(
             self.battle_group_name,
             {
                 'type': 'opponent_running_code',
@@ -373,26 +360,25 @@ class CodeBattleConsumer(AsyncWebsocketConsumer):
         )
 
         # Get sample input from current challenge
-        battle = await self.get_battle(self.battle_id)
-        challenges = await sync_to_async(lambda b: list(b.challenges.all()))(battle)
-        
+        battle_data = await self.get_battle_data(self.battle_id)
+        current_challenge = battle_data['current_challenge']
+
         # Check if current challenge index is valid
-        if battle.current_challenge_index >= len(challenges):
-            await self.send(json.dumps({
+        if current_challenge is None:
+            await self.send_event({
                 "type": "error", 
                 "message": "All challenges have been completed. Battle is ending."
-            }))
+            })
             return
-        
-        current_challenge = challenges[battle.current_challenge_index]
-        sample_io = current_challenge.sample_io
+
+        sample_io = current_challenge['sample_io']
         stdin = self.extract_sample_input(sample_io) if sample_io else ''
 
         # Execute with Judge0 using the new run_code method
         judge_service = Judge0Service()
         result = await sync_to_async(judge_service.run_code)(code, language, stdin)
 
-        await self.send(json.dumps({
+        await self.send_event({
             "type": "code_result",
             "result": {
                 "output": result['output'],
@@ -400,7 +386,7 @@ class CodeBattleConsumer(AsyncWebsocketConsumer):
                 "time": result['time'],
                 "memory": result['memory']
             }
-        }))
+        })
 
     async def handle_submit_code(self, user, data):
         code = data.get('code')
@@ -411,20 +397,18 @@ class CodeBattleConsumer(AsyncWebsocketConsumer):
             
         language = data.get('language')
         if code is None or not language:
-            await self.send(json.dumps({"type": "error", "message": "Code and language required"}))
+            await self.send_event({"type": "error", "message": "Code and language required"})
             return
 
-        # Get battle and current challenge
-        battle = await self.get_battle(self.battle_id)
-        
+        # Get current challenge
         try:
             current_challenge, test_cases = await self.get_current_challenge_and_test_cases(self.battle_id)
         except ValueError as e:
             # No more challenges available
-            await self.send(json.dumps({
+            await self.send_event({
                 "type": "error", 
                 "message": f"All challenges have been completed. Battle is ending."
-            }))
+            })
             return
 
         # Execute with Judge0
@@ -453,6 +437,7 @@ class CodeBattleConsumer(AsyncWebsocketConsumer):
 
         # Create submission with results
         submission = await self.create_submission_with_results(user, self.battle_id, current_challenge, code, language, status, result)
+        await self.record_finish(self.battle_id, current_challenge['position'], user, status)
 
         # Calculate score (passed tests * 10 - execution time bonus)
         score = result['passed'] * 10
@@ -465,23 +450,23 @@ class CodeBattleConsumer(AsyncWebsocketConsumer):
         await self.update_battle_scores(self.battle_id, user, score)
 
         # Get updated battle data
-        battle_data = await self.get_battle_data_with_scores(self.battle_id)
+        battle_data = await self.get_battle_data(self.battle_id)
 
         # Prepare result summary
         result_summary = f"{result['passed']}/{result['total']} tests passed - {status}"
 
         # Send to submitter
-        await self.send(json.dumps({
+        await self.send_event({
             "type": "submission_result",
             "result": result_summary,
             "status": status,
             "passed": result['passed'],
             "total": result['total'],
             "details": result['details']
-        }))
+        })
 
         # Broadcast to group (opponent sees submission)
-        await self.channel_layer.group_send(
+        await self.broadcast(
             self.battle_group_name,
             {
                 'type': 'opponent_submission',
@@ -494,7 +479,7 @@ class CodeBattleConsumer(AsyncWebsocketConsumer):
         )
 
         # Broadcast score update
-        await self.channel_layer.group_send(
+        await self.broadcast(
             self.battle_group_name,
             {
                 'type': 'battle_update',
@@ -512,7 +497,7 @@ class CodeBattleConsumer(AsyncWebsocketConsumer):
             if battle_updated:
                 # This player is the first to solve this question!
                 print(f"✅ Broadcasting question_winner event for {user.username}")
-                await self.channel_layer.group_send(
+                await self.broadcast(
                     self.battle_group_name,
                     {
                         'type': 'question_winner',
@@ -524,6 +509,7 @@ class CodeBattleConsumer(AsyncWebsocketConsumer):
                 
                 # Schedule automatic progression to next question after 5 seconds
                 print(f"🚀 Scheduling auto-progression in 5 seconds...")
+                round_timers.cancel(self.battle_group_name)
                 asyncio.create_task(self.auto_progress_question(self.battle_id))
             else:
                 print(f"❌ User {user.username} is not the first winner")
@@ -533,14 +519,15 @@ class CodeBattleConsumer(AsyncWebsocketConsumer):
             should_progress = await self.check_if_all_players_finished(self.battle_id, battle_data['current_challenge_index'])
             if should_progress:
                 print(f"⌛ All players finished (or timed out). Scheduling auto-progression...")
+                round_timers.cancel(self.battle_group_name)
                 asyncio.create_task(self.auto_progress_question(self.battle_id, battle_data['current_challenge_index']))
 
         
     async def handle_start_battle(self, user, data):
         # Only the host (player1) can start the battle
-        battle = await self.get_battle(self.battle_id)
-        if battle.player1 != user:
-            await self.send(json.dumps({"type": "error", "message": "Only the host can start the battle"}))
+        battle_data = await self.get_battle_data(self.battle_id)
+        if battle_data['player1'] != user.username:
+            await self.send_event({"type": "error", "message": "Only the host can start the battle"})
             return
 
         await self.start_battle(self.battle_id)
@@ -555,10 +542,36 @@ class CodeBattleConsumer(AsyncWebsocketConsumer):
                 'battle': battle_data
             }
         )
+        await self.schedule_challenge_deadline(battle_data)
+
+    async def schedule_challenge_deadline(self, battle_data):
+        """
+        Announce the current challenge's absolute deadline once and arm the
+        single expiry task for it. Clients render the countdown locally.
+        """
+        challenge = battle_data.get('current_challenge')
+        if not challenge:
+            return
+        group_name = f"battle_{battle_data['id']}"
+        index = battle_data['current_challenge_index']
+        duration = challenge['time_limit']
+        deadline = deadline_after(duration)
+        round_timers.schedule(group_name, deadline, self.expire_challenge, battle_data['id'], index)
+        await self.broadcast(
+            group_name,
+            round_deadline_event(deadline, duration, challenge_index=index)
+        )
+
+    async def expire_challenge(self, battle_id, challenge_index):
+        """Move on when nobody solved the challenge before its deadline."""
+        battle_data = await self.get_battle_data(battle_id)
+        if battle_data['status'] != 'in_progress' or battle_data['current_challenge_index'] != challenge_index:
+            return
+        await self.auto_progress_question(battle_id, challenge_index)
 
     async def handle_end_battle(self, user, data):
         # End battle and compute results
-        battle_data = await self.get_battle_data_with_scores(self.battle_id)
+        battle_data = await self.get_battle_data(self.battle_id)
         scores = battle_data['scores']
 
         # Determine winner
@@ -573,120 +586,48 @@ class CodeBattleConsumer(AsyncWebsocketConsumer):
             winner = 'tie'
 
         # Update battle
-        await self.end_battle(self.battle_id, winner)
+        job_id = await self.end_battle(self.battle_id, winner)
 
         results = {
             'winner': winner,
             'scores': scores
         }
 
-        await self.channel_layer.group_send(
+        await self.broadcast(
             self.battle_group_name,
             {
-                'type': 'battle_ended',
+                'type': 'ended',
                 'results': results
             }
         )
-
-    async def battle_update(self, event):
-        await self.send(json.dumps({
-            'type': 'battle_update',
-            'scores': event['scores']
-        }))
+        run_soon(job_id)
 
     async def battle_started(self, event):
-        await self.send(json.dumps({
+        await self.send_event({
             'type': 'battle_started',
-            'battle': event['battle']
-        }))
-
-    async def player_left(self, event):
-        await self.send(json.dumps({
-            'type': 'player_left',
-            'username': event['username'],
-            'players': event.get('players', [])
-        }))
-
-    async def battle_ended(self, event):
-        await self.send(json.dumps({
-            'type': 'ended',
-            'results': event['results']
-        }))
+            **self.state_field('battle', event['battle'])
+        })
 
     async def player_joined(self, event):
-        await self.send(json.dumps({
+        await self.send_event({
             'type': 'player_joined',
             'username': event['player'],
-            'battle': event['battle'],
+            **self.state_field('battle', event['battle']),
             'players': event.get('players', [])
-        }))
+        })
 
     async def battle_data_update(self, event):
-        await self.send(json.dumps({
+        await self.send_event({
             'type': 'battle_data_update',
-            'battle': event['battle'],
+            **self.state_field('battle', event['battle']),
             'players': event.get('players', [])
-        }))
-
-    async def ready_status_update(self, event):
-        await self.send(json.dumps({
-            'type': 'ready_status_update',
-            'battle': event['battle'],
-            'player': event['player'],
-            'ready': event['ready']
-        }))
-
-    async def opponent_submission(self, event):
-        await self.send(json.dumps({
-            'type': 'opponent_submission',
-            'username': event['username'],
-            'result': event['result'],
-            'passed': event['passed'],
-            'total': event['total'],
-            'scores': event['scores']
-        }))
+        })
 
     async def next_challenge(self, event):
-        await self.send(json.dumps({
+        await self.send_event({
             'type': 'next_challenge',
-            'battle': event['battle']
-        }))
-
-    async def opponent_running_code(self, event):
-        await self.send(json.dumps({
-            'type': 'opponent_running_code',
-            'username': event['username']
-        }))
-
-    async def question_winner(self, event):
-        await self.send(json.dumps({
-            'type': 'question_winner',
-            'username': event['username'],
-            'challenge_index': event['challenge_index'],
-            'scores': event['scores']
-        }))
-
-    # =======================================================
-    # ⚡️ TYPING BROADCAST HANDLERS (NO CODE LEAKING)
-    # =======================================================
-    async def typing(self, event):
-        await self.send(json.dumps({
-            "type": "typing",
-            "username": event["username"]
-        }))
-
-    async def stop_typing(self, event):
-        await self.send(json.dumps({
-            "type": "stop_typing",
-            "username": event["username"]
-        }))
-
-    async def tab_warning(self, event):
-        await self.send(json.dumps({
-            "type": "tab_warning",
-            "username": event["username"]
-        }))
-    # =======================================================
+            **self.state_field('battle', event['battle'])
+        })
 
     @database_sync_to_async
     def get_battle(self, battle_id):
@@ -694,42 +635,21 @@ class CodeBattleConsumer(AsyncWebsocketConsumer):
 
     @database_sync_to_async
     def get_battle_data(self, battle_id):
-        battle = Battle.objects.get(id=battle_id)
-        challenges = list(battle.challenges.all().values('id', 'title', 'description', 'problem_statement', 'sample_io', 'difficulty', 'time_limit'))
-        current_challenge = challenges[battle.current_challenge_index] if challenges and battle.current_challenge_index < len(challenges) else None
-        return {
-            'id': battle.id,
-            'player1': battle.player1.username,
-            'player2': battle.player2.username if battle.player2 else None,
-            'player1_ready': battle.player1_ready,
-            'player2_ready': battle.player2_ready if battle.player2 else False,
-            'challenges': challenges,
-            'current_challenge': current_challenge,
-            'current_challenge_index': battle.current_challenge_index,
-            'status': battle.status,
-            'battle_code': battle.battle_code,
-            'scores': battle.scores or {},
-            'started_at': battle.started_at.isoformat() if battle.started_at else None,
-        }
+        """Dynamic battle state (players, status, scores, current challenge) from the snapshot cache."""
+        return dynamic_snapshot(battle_id)
 
     @database_sync_to_async
-    def get_battle_data_by_code(self, battle_code):
-        battle = Battle.objects.get(battle_code=battle_code.upper())
-        challenges = list(battle.challenges.all().values('id', 'title', 'description', 'problem_statement', 'sample_io', 'difficulty', 'time_limit'))
-        current_challenge = challenges[battle.current_challenge_index] if challenges and battle.current_challenge_index < len(challenges) else None
+    def get_battle_static(self, battle_id):
+        """Battle code, level and challenge list; these do not change during play."""
+        return static_snapshot(battle_id)
+
+    async def battle_fields(self, battle_id, battle_data=None):
+        """Full battle state for a client that just joined: the static part is only sent here."""
+        if battle_data is None:
+            battle_data = await self.get_battle_data(battle_id)
         return {
-            'id': battle.id,
-            'player1': battle.player1.username,
-            'player2': battle.player2.username if battle.player2 else None,
-            'player1_ready': battle.player1_ready,
-            'player2_ready': battle.player2_ready if battle.player2 else False,
-            'challenges': challenges,
-            'current_challenge': current_challenge,
-            'current_challenge_index': battle.current_challenge_index,
-            'status': battle.status,
-            'battle_code': battle.battle_code,
-            'scores': battle.scores or {},
-            'started_at': battle.started_at.isoformat() if battle.started_at else None,
+            **self.state_field("battle", battle_data),
+            "battle_static": await self.get_battle_static(battle_id),
         }
 
     @database_sync_to_async
@@ -790,50 +710,7 @@ class CodeBattleConsumer(AsyncWebsocketConsumer):
             num_questions=num_questions,
             level=level
         )
-        battle.challenges.set(challenges)
-        battle.save()
-        return battle
-
-    @database_sync_to_async
-    def join_or_create_battle(self, user, challenge_id):
-        challenge = Challenge.objects.get(id=challenge_id)
-
-        # Try to find an open battle for this challenge (only 2 players max)
-        battle = Battle.objects.filter(
-            challenge=challenge,
-            status='waiting',
-            player2__isnull=True
-        ).exclude(player1=user).first()
-
-        if battle:
-            # Join existing battle as player2
-            battle.player2 = user
-            battle.save()
-        else:
-            # Check if user is already in a waiting battle for this challenge
-            existing_battle = Battle.objects.filter(
-                challenge=challenge,
-                status='waiting',
-                player1=user
-            ).first()
-
-            if existing_battle:
-                # User is already waiting in a battle they created
-                battle = existing_battle
-            else:
-                # Create new battle as player1 with a unique battle code
-                import random
-                import string
-                battle_code = ''.join(random.choices(string.ascii_uppercase + string.digits, k=6))
-                while Battle.objects.filter(battle_code=battle_code).exists():
-                    battle_code = ''.join(random.choices(string.ascii_uppercase + string.digits, k=6))
-
-                battle = Battle.objects.create(
-                    player1=user,
-                    challenge=challenge,
-                    battle_code=battle_code
-                )
-
+        battle.set_challenges(challenges)
         return battle
 
     @database_sync_to_async
@@ -875,7 +752,7 @@ class CodeBattleConsumer(AsyncWebsocketConsumer):
     def create_submission_with_results(self, user, battle_id, challenge, code, language, status, result):
         submission = Submission.objects.create(
             user=user,
-            challenge=challenge,
+            challenge_id=challenge['id'],
             code=code,
             language=language,
             status=status,
@@ -885,29 +762,7 @@ class CodeBattleConsumer(AsyncWebsocketConsumer):
 
     @database_sync_to_async
     def update_battle_scores(self, battle_id, user, score):
-        battle = Battle.objects.get(id=battle_id)
-        if not battle.scores:
-            battle.scores = {}
-        battle.scores[user.username] = battle.scores.get(user.username, 0) + score
-        battle.save()
-
-    @database_sync_to_async
-    def get_battle_data_with_scores(self, battle_id):
-        battle = Battle.objects.get(id=battle_id)
-        challenges = list(battle.challenges.all().values('id', 'title', 'description', 'problem_statement', 'sample_io', 'difficulty', 'time_limit'))
-        current_challenge = challenges[battle.current_challenge_index] if challenges and battle.current_challenge_index < len(challenges) else None
-        data = {
-            'id': battle.id,
-            'player1': battle.player1.username,
-            'player2': battle.player2.username if battle.player2 else None,
-            'challenges': challenges,
-            'current_challenge': current_challenge,
-            'current_challenge_index': battle.current_challenge_index,
-            'status': battle.status,
-            'battle_code': battle.battle_code,
-            'scores': battle.scores or {}
-        }
-        return data
+        add_score(battle_id, user, score)
 
     @database_sync_to_async
     def check_user_authorization(self, battle, user):
@@ -920,6 +775,11 @@ class CodeBattleConsumer(AsyncWebsocketConsumer):
         except Challenge.DoesNotExist:
             return None
 
+    @database_sync_to_async
+    def get_rating(self, user_id):
+        from gamification.ratings import get_rating
+        return get_rating(user_id, 'codebattle')
+
     @database_sync_to_async
     def get_user(self, user_id):
         return User.objects.get(id=user_id)
@@ -940,59 +800,47 @@ class CodeBattleConsumer(AsyncWebsocketConsumer):
 
     @database_sync_to_async
     def end_battle(self, battle_id, winner):
-        battle = Battle.objects.get(id=battle_id)
+        battle = Battle.objects.select_related('player1', 'player2').get(id=battle_id)
         battle.status = 'completed'
         battle.completed_at = timezone.now()
+        # Keep the final scores on the battle for the results page and history
+        battle.scores = battle_scores(battle)
         if winner != 'tie':
             battle.winner = battle.player1 if winner == battle.player1.username else battle.player2
-        battle.save()
-
-        # Update user progress and streaks for both players
-        if battle.player1:
-            score1 = battle.scores.get(battle.player1.username, 0) if battle.scores else 0
-            self.update_user_progress(battle.player1.id, score1)
-            self.update_streak(battle.player1.id)
-
-        if battle.player2:
-            score2 = battle.scores.get(battle.player2.username, 0) if battle.scores else 0
-            self.update_user_progress(battle.player2.id, score2)
-            self.update_streak(battle.player2.id)
-
-    @database_sync_to_async
-    def update_user_progress(self, user_id, score):
-        from gamification.models import UserProgress
-        progress, created = UserProgress.objects.get_or_create(user_id=user_id)
-        progress.quizzes_completed += 1
-        progress.total_score += score
-        progress.average_score = progress.total_score / progress.quizzes_completed
-        progress.xp += score * 10
-        progress.level = progress.total_score // 100 + 1
-        progress.save()
-
-    @database_sync_to_async
-    def update_streak(self, user_id):
-        from gamification.models import Streak
-        from datetime import date
-        streak, created = Streak.objects.get_or_create(user_id=user_id)
-        if streak.last_activity != date.today():
-            streak.current_streak += 1
-            if streak.current_streak > streak.longest_streak:
-                streak.longest_streak = streak.current_streak
-        streak.save()
+        from django.db import transaction
+        from accounts.stats import record_battle
+        from gamification.jobs import enqueue
+        from gamification.progress import GameResult
+        from .snapshots import invalidate_battle
+        job_id = None
+        with transaction.atomic():
+            # Both players (and the question timer) can end the same battle, and the
+            # reaper may already have closed it; only the call that completes it counts
+            ended = Battle.objects.filter(pk=battle_id).exclude(status='completed').update(
+                status='completed', completed_at=battle.completed_at, scores=battle.scores, winner=battle.winner,
+            )
+            if ended:
+                record_battle(battle)
+                # Progress, streaks and badges are applied by the post-game queue
+                job_id = enqueue(f'battle:{battle_id}', [
+                    GameResult(player.id, battle.scores.get(player.username, 0), 'codebattle')
+                    for player in (battle.player1, battle.player2)
+                    if player
+                ])
+        invalidate_battle(battle_id)
+        finish_ledger.forget(battle_id)
+        return job_id
 
     @database_sync_to_async
     def get_current_challenge_and_test_cases(self, battle_id):
-        battle = Battle.objects.get(id=battle_id)
-        challenges = battle.challenges.all()
-        total_challenges = challenges.count()
-        
+        index = dynamic_snapshot(battle_id)['current_challenge_index']
+        current_challenge = battle_challenge(battle_id, index)
+
         # Check if current_challenge_index is within valid bounds
-        if battle.current_challenge_index >= total_challenges:
-            raise ValueError(f"Battle has no more challenges. Current index: {battle.current_challenge_index}, Total: {total_challenges}")
-        
-        current_challenge = challenges[battle.current_challenge_index]
-        test_cases = current_challenge.test_cases
-        return current_challenge, test_cases
+        if current_challenge is None:
+            raise ValueError(f"Battle has no more challenges. Current index: {index}")
+
+        return current_challenge, current_challenge['test_cases']
 
     def extract_sample_input(self, sample_io):
         # Parse sample_io like "Input: hello world Output: 3" to extract input
@@ -1006,11 +854,13 @@ class CodeBattleConsumer(AsyncWebsocketConsumer):
         battle = Battle.objects.get(id=battle_id)
         if battle.player1 == user:
             battle.player1_ready = ready
+            battle.save(update_fields=['player1_ready'])
         elif battle.player2 == user:
             battle.player2_ready = ready
+            battle.save(update_fields=['player2_ready'])
         else:
             raise ValueError("User is not a player in this battle")
-        battle.save()
+        return {'player1_ready': battle.player1_ready, 'player2_ready': battle.player2_ready}
 
     @database_sync_to_async
     def check_and_set_question_winner(self, battle_id, challenge_index, user):
@@ -1018,22 +868,7 @@ class CodeBattleConsumer(AsyncWebsocketConsumer):
         Check if this is the first person to solve a question.
         Returns True if this player is the first winner, False otherwise.
         """
-        battle = Battle.objects.get(id=battle_id)
-        
-        # Initialize question_winners if it doesn't exist
-        if not battle.question_winners:
-            battle.question_winners = {}
-        
-        # Check if this question already has a winner
-        challenge_key = str(challenge_index)
-        if challenge_key in battle.question_winners:
-            # Question already solved by someone
-            return False
-        
-        # This is the first person to solve it!
-        battle.question_winners[challenge_key] = user.username
-        battle.save()
-        return True
+        return claim_question(battle_id, challenge_index, user)
 
     async def auto_progress_question(self, battle_id, expected_index=None):
         """
@@ -1056,9 +891,11 @@ class CodeBattleConsumer(AsyncWebsocketConsumer):
                     'battle': battle_data
                 }
             )
+            await self.schedule_challenge_deadline(battle_data)
         else:
             # All questions completed, end the battle
-            battle_data = await self.get_battle_data_with_scores(battle_id)
+            round_timers.cancel(f'battle_{battle_id}')
+            battle_data = await self.get_battle_data(battle_id)
             scores = battle_data['scores']
             
             # Determine winner
@@ -1073,7 +910,7 @@ class CodeBattleConsumer(AsyncWebsocketConsumer):
                 winner = 'tie'
             
             # Update battle status
-            await self.end_battle(battle_id, winner)
+            job_id = await self.end_battle(battle_id, winner)
             
             # Create leaderboard array sorted by score
             leaderboard = []
@@ -1097,13 +934,14 @@ class CodeBattleConsumer(AsyncWebsocketConsumer):
             }
             
             # Broadcast battle ended event
-            await self.channel_layer.group_send(
+            await self.broadcast(
                 f'battle_{battle_id}',
                 {
-                    'type': 'battle_ended',
+                    'type': 'ended',
                     'results': results
                 }
             )
+            run_soon(job_id)
 
     @database_sync_to_async
     def advance_to_next_question(self, battle_id, expected_index=None):
@@ -1118,14 +956,14 @@ class CodeBattleConsumer(AsyncWebsocketConsumer):
         if expected_index is not None and battle.current_challenge_index != expected_index:
             print(f"Skipping advance: Current index {battle.current_challenge_index} != Expected {expected_index}")
             # verify if we are still within bounds or finished
-            total_questions = battle.challenges.count()
+            total_questions = len(static_snapshot(battle_id)['challenges'])
             return battle.current_challenge_index < total_questions
 
-        total_questions = battle.challenges.count()
+        total_questions = len(static_snapshot(battle_id)['challenges'])
         
         # Increment current challenge index
         battle.current_challenge_index += 1
-        battle.save()
+        battle.save(update_fields=['current_challenge_index'])
         
         # Check if there are more questions
         return battle.current_challenge_index < total_questions
@@ -1136,27 +974,16 @@ class CodeBattleConsumer(AsyncWebsocketConsumer):
         Check if all players in the battle have either solved the question (accepted)
         or timed out (time_limit) for the current challenge.
         """
-        battle = Battle.objects.get(id=battle_id)
-        challenges = battle.challenges.all()
-        if challenge_index >= len(challenges):
+        if battle_challenge(battle_id, challenge_index) is None:
             return True # Already done
-            
-        current_challenge = challenges[challenge_index]
-        
-        players = [battle.player1]
-        if battle.player2:
-            players.append(battle.player2)
-            
-        finished_count = 0
-        for player in players:
-            # Check if player has a finishing submission for this challenge
-            has_finished = Submission.objects.filter(
-                user=player, 
-                challenge=current_challenge,
-                status__in=['accepted', 'time_limit']
-            ).exists()
-            
-            if has_finished:
-                finished_count += 1
-                
-        return finished_count == len(players)
+
+        battle = Battle.objects.only('player1', 'player2').get(id=battle_id)
+        players = [battle.player1_id]
+        if battle.player2_id:
+            players.append(battle.player2_id)
+
+        return finish_ledger.all_finished(battle_id, challenge_index, players)
+
+    @database_sync_to_async
+    def record_finish(self, battle_id, challenge_index, user, status):
+        finish_ledger.record(battle_id, challenge_index, user.id, status)
@@ -0,0 +1,78 @@
+"""
+Per-battle ledger of who has finished each challenge.
+
+A player finishes a challenge by solving it or by running out of time. Each
+finish is stored once as a ``ChallengeFinish`` row (scoped to the battle, so
+submissions from earlier battles on the same challenge never count) and
+mirrored in memory, so "has everyone finished?" is a set lookup.
+
+Finishes are never undone. The set for a challenge is read from the rows the
+first time a worker touches it and kept up to date by ``record``, so with one
+worker (the in-memory channel layer) every later check is answered from
+memory. When ``CHANNEL_LAYER_BACKEND`` is "redis" the other player may have
+finished on another worker, so an incomplete set is read again.
+"""
+from collections import OrderedDict
+
+from django.conf import settings
+
+from .models import ChallengeFinish
+
+FINISH_STATUSES = ('accepted', 'time_limit')
+
+
+class FinishLedger:
+    def __init__(self, capacity=10000, shared=None):
+        self.capacity = capacity
+        self._shared = shared
+        self._finished = OrderedDict()  # (battle_id, challenge_index) -> {user_id}
+
+    @property
+    def shared(self):
+        """Whether battles may be served by more than one worker."""
+        if self._shared is not None:
+            return self._shared
+        return getattr(settings, 'CHANNEL_LAYER_BACKEND', 'memory') == 'redis'
+
+    def _load(self, key):
+        battle_id, challenge_index = key
+        finished = set(ChallengeFinish.objects.filter(
+            battle_id=battle_id, challenge_index=challenge_index
+        ).values_list('user_id', flat=True))
+        self._finished[key] = finished
+        self._finished.move_to_end(key)
+        while len(self._finished) > self.capacity:
+            self._finished.popitem(last=False)
+        return finished
+
+    def _get(self, key):
+        finished = self._finished.get(key)
+        if finished is None:
+            return self._load(key)
+        self._finished.move_to_end(key)
+        return finished
+
+    def record(self, battle_id, challenge_index, user_id, status):
+        """Store a finish; later finishes of the same player are ignored."""
+        if status not in FINISH_STATUSES:
+            return
+        ChallengeFinish.objects.bulk_create(
+            [ChallengeFinish(battle_id=battle_id, challenge_index=challenge_index, user_id=user_id, status=status)],
+            ignore_conflicts=True,
+        )
+        self._get((battle_id, challenge_index)).add(user_id)
+
+    def all_finished(self, battle_id, challenge_index, player_ids):
+        key = (battle_id, challenge_index)
+        finished = self._get(key)
+        if not finished.issuperset(player_ids) and self.shared:
+            finished = self._load(key)
+        return finished.issuperset(player_ids)
+
+    def forget(self, battle_id):
+        """Drop a finished battle from memory (its rows stay)."""
+        for key in [key for key in self._finished if key[0] == battle_id]:
+            del self._finished[key]
+
+
+finish_ledger = FinishLedger()
@@ -0,0 +1,63 @@
+import random
+import time
+
+from django.core.management.base import BaseCommand
+
+from codebattle.matchmaking import MatchmakingQueue
+
+LEVELS = ('easy', 'medium', 'hard')
+LANGUAGES = ('python', 'javascript', 'java', 'cpp')
+
+
+class Command(BaseCommand):
+    help = 'Measure matchmaking throughput with thousands of players already queued'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--players', type=int, default=20000, help='Players left waiting before measuring')
+        parser.add_argument('--band', type=int, default=50, help='Initial rating band')
+        parser.add_argument('--seed', type=int, default=1)
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        band = options['band']
+        players = options['players']
+        queues = [(level, language) for level in LEVELS for language in LANGUAGES]
+        now = [0.0]
+        queue = MatchmakingQueue(band=band, growth=25, max_band=1000, clock=lambda: now[0])
+
+        # Ratings more than a band apart, so everyone stays queued
+        ratings = [i * (band + 1) for i in range(players)]
+        rng.shuffle(ratings)
+        start = time.perf_counter()
+        for user_id, rating in enumerate(ratings):
+            queue.enqueue(*queues[user_id % len(queues)], user_id, f'player_{user_id}', rating)
+        elapsed = time.perf_counter() - start
+        self.stdout.write(f"queue {players} players: {elapsed * 1e3:.1f} ms ({players / elapsed:,.0f}/s)")
+
+        # Newcomers that each pair with a waiting player
+        arrivals = rng.sample(range(players), min(players, 5000))
+        start = time.perf_counter()
+        matched = sum(
+            queue.enqueue(*queues[user_id % len(queues)], players + n, f'newcomer_{n}', ratings[user_id] + 1) is not None
+            for n, user_id in enumerate(arrivals)
+        )
+        elapsed = time.perf_counter() - start
+        self.stdout.write(
+            f"pair {len(arrivals)} newcomers against {players} waiting: {elapsed * 1e3:.1f} ms "
+            f"({len(arrivals) / elapsed:,.0f}/s), {matched} matched"
+        )
+
+        start = time.perf_counter()
+        cancelled = sum(queue.cancel(user_id) for user_id in range(0, players, 10))
+        elapsed = time.perf_counter() - start
+        self.stdout.write(f"cancel {cancelled} players: {elapsed * 1e3:.1f} ms")
+
+        for waited in (1, 10, 40):
+            now[0] = float(waited)
+            waiting = len(queue)
+            start = time.perf_counter()
+            pairs = queue.sweep()
+            elapsed = time.perf_counter() - start
+            self.stdout.write(
+                f"sweep after {waited:>2}s: {waiting} waiting, {len(pairs)} pairs in {elapsed * 1e3:.1f} ms"
+            )
@@ -0,0 +1,248 @@
+"""
+In-memory matchmaking for code battles.
+
+Players wait in one queue per (level, language). Each queue is kept sorted by
+rating, so pairing a newcomer is a binary search for the closest waiting
+rating. Two players match when their ratings are within the acceptable
+window of both; a player's window starts at ``band`` and grows by
+``growth`` rating points per second of waiting (up to ``max_band``), so
+nobody waits forever for a perfect match. ``sweep`` pairs players whose
+windows have grown to cover each other.
+
+With ``band=None`` ratings are ignored and queues are first come, first
+served.
+
+The queues are plain Python structures touched only from the event loop
+thread, and ``enqueue``/``sweep`` never await, so pairing is atomic: a
+waiting player can be handed to exactly one opponent. With several workers
+each process matches the players connected to it.
+
+Every pairing creates a waiting battle and is announced to the
+``codebattle_lobby`` group as a ``match_found`` event; clients pick out
+their own username and go to the battle room.
+"""
+import asyncio
+import itertools
+import logging
+import time
+from bisect import bisect_left, insort
+
+from channels.db import database_sync_to_async
+from channels.layers import get_channel_layer
+from django.conf import settings
+from django.core.signals import setting_changed
+
+from smartquizarena.encoding import encode_broadcast
+
+from .models import Battle, Challenge
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_RATING = 1500
+LOBBY_GROUP = 'codebattle_lobby'
+
+
+class Ticket:
+    __slots__ = ('user_id', 'username', 'rating', 'enqueued_at', 'seq', 'queue')
+
+    def __init__(self, user_id, username, rating, enqueued_at, seq, queue):
+        self.user_id = user_id
+        self.username = username
+        self.rating = rating
+        self.enqueued_at = enqueued_at
+        self.seq = seq
+        self.queue = queue
+
+    def sort_key(self):
+        return (self.rating, self.seq)
+
+
+class MatchmakingQueue:
+    def __init__(self, band=200, growth=25, max_band=1000, clock=time.monotonic):
+        self.band = band
+        self.growth = growth
+        self.max_band = max_band
+        self.clock = clock
+        self._queues = {}    # (level, language) -> [(rating, seq, ticket)] sorted, or [ticket] FIFO without bands
+        self._tickets = {}   # user_id -> Ticket
+        self._seq = itertools.count()
+
+    def __len__(self):
+        return len(self._tickets)
+
+    def window(self, ticket, now=None):
+        """Rating difference ``ticket`` accepts after waiting until ``now``."""
+        waited = (now if now is not None else self.clock()) - ticket.enqueued_at
+        return min(self.band + self.growth * waited, self.max_band)
+
+    def enqueue(self, level, language, user_id, username, rating=None):
+        """
+        Queue a player, or pair them at once.
+
+        Returns ``(opponent, ticket)`` when a match was made (the opponent
+        waited longer), otherwise None. Queuing again moves the player to the
+        new queue.
+        """
+        self.cancel(user_id)
+        key = (level, language)
+        queue = self._queues.setdefault(key, [])
+        ticket = Ticket(user_id, username, rating if rating is not None else DEFAULT_RATING,
+                        self.clock(), next(self._seq), key)
+        if self.band is None:
+            if queue:
+                opponent = queue.pop(0)
+                del self._tickets[opponent.user_id]
+                return opponent, ticket
+            queue.append(ticket)
+            self._tickets[user_id] = ticket
+            return None
+
+        # A newcomer's window is the narrowest, so anyone inside it accepts them too
+        position = bisect_left(queue, ticket.sort_key())
+        best = None
+        for neighbour in (position - 1, position):
+            if 0 <= neighbour < len(queue):
+                candidate = queue[neighbour][2]
+                distance = abs(candidate.rating - ticket.rating)
+                if distance <= self.band and (best is None or distance < best[0]):
+                    best = (distance, neighbour)
+        if best is not None:
+            opponent = queue.pop(best[1])[2]
+            del self._tickets[opponent.user_id]
+            return opponent, ticket
+        insort(queue, (ticket.rating, ticket.seq, ticket))
+        self._tickets[user_id] = ticket
+        return None
+
+    def cancel(self, user_id):
+        """Take a player out of the queue. Returns True if they were waiting."""
+        ticket = self._tickets.pop(user_id, None)
+        if ticket is None:
+            return False
+        queue = self._queues[ticket.queue]
+        if self.band is None:
+            queue.remove(ticket)
+        else:
+            del queue[bisect_left(queue, ticket.sort_key())]
+        if not queue:
+            del self._queues[ticket.queue]
+        return True
+
+    def sweep(self):
+        """Pair neighbours whose grown windows now cover each other. Returns the pairs."""
+        if self.band is None:
+            return []
+        now = self.clock()
+        pairs = []
+        for key in list(self._queues):
+            queue = self._queues[key]
+            remaining = []
+            index = 0
+            while index < len(queue):
+                ticket = queue[index][2]
+                if index + 1 < len(queue):
+                    neighbour = queue[index + 1][2]
+                    distance = neighbour.rating - ticket.rating
+                    if distance <= self.window(ticket, now) and distance <= self.window(neighbour, now):
+                        # Longest-waiting player first, as in ``enqueue``
+                        pair = sorted((ticket, neighbour), key=lambda t: t.enqueued_at)
+                        pairs.append(tuple(pair))
+                        del self._tickets[ticket.user_id], self._tickets[neighbour.user_id]
+                        index += 2
+                        continue
+                remaining.append(queue[index])
+                index += 1
+            if remaining:
+                self._queues[key] = remaining
+            else:
+                del self._queues[key]
+        return pairs
+
+
+@database_sync_to_async
+def create_matched_battle(level, language, player1_id, player2_id, num_questions=5):
+    challenges = Challenge.objects.filter(difficulty=level, language=language)
+    if not challenges.exists():
+        challenges = Challenge.objects.filter(difficulty=level)
+    battle = Battle.objects.create(
+        player1_id=player1_id, player2_id=player2_id, level=level, num_questions=num_questions
+    )
+    battle.set_challenges(challenges.order_by('?')[:num_questions])
+    return battle
+
+
+async def start_matched_battle(opponent, ticket):
+    """Create the battle for a pair and announce it in the lobby."""
+    level, language = ticket.queue
+    battle = await create_matched_battle(level, language, opponent.user_id, ticket.user_id)
+    await get_channel_layer().group_send(LOBBY_GROUP, encode_broadcast({
+        'type': 'match_found',
+        'battle_code': battle.battle_code,
+        'level': level,
+        'language': language,
+        'players': [opponent.username, ticket.username],
+    }))
+
+
+class MatchmakingService:
+    """
+    Runs a ``MatchmakingQueue`` for the lobby consumers.
+
+    ``on_match(opponent, ticket)`` is awaited for every pair. While anyone
+    is waiting a background task sweeps the queues every ``sweep_interval``
+    seconds.
+    """
+
+    def __init__(self, queue, on_match=start_matched_battle, sweep_interval=1.0):
+        self.queue = queue
+        self.on_match = on_match
+        self.sweep_interval = sweep_interval
+        self._sweeper = None
+
+    async def join(self, level, language, user_id, username, rating=None):
+        pair = self.queue.enqueue(level, language, user_id, username, rating)
+        if pair is not None:
+            await self.on_match(*pair)
+        elif self._sweeper is None or self._sweeper.done():
+            self._sweeper = asyncio.create_task(self._sweep_loop())
+        return pair
+
+    def leave(self, user_id):
+        return self.queue.cancel(user_id)
+
+    async def _sweep_loop(self):
+        while len(self.queue):
+            await asyncio.sleep(self.sweep_interval)
+            for pair in self.queue.sweep():
+                try:
+                    await self.on_match(*pair)
+                except Exception:
+                    logger.exception("Could not start a battle for %s and %s", pair[0].username, pair[1].username)
+
+
+_service = None
+
+
+def get_matchmaking():
+    """Return the process-wide matchmaking service configured in settings."""
+    global _service
+    if _service is None:
+        band = getattr(settings, "MATCHMAKING_RATING_BAND", 200)
+        _service = MatchmakingService(
+            MatchmakingQueue(
+                band=band or None,
+                growth=getattr(settings, "MATCHMAKING_BAND_GROWTH", 25),
+                max_band=getattr(settings, "MATCHMAKING_MAX_BAND", 1000),
+            ),
+            sweep_interval=getattr(settings, "MATCHMAKING_SWEEP_INTERVAL", 1.0),
+        )
+    return _service
+
+
+def _reset_service(setting, **kwargs):
+    global _service
+    if setting.startswith("MATCHMAKING_"):
+        _service = None
+
+
+setting_changed.connect(_reset_service)
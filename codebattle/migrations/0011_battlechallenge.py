@@ -0,0 +1,57 @@
+# Turns Battle.challenges into an ordered M2M. The existing join table is kept
+# (BattleChallenge points at it) and gains a position column.
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def number_positions(apps, schema_editor):
+    """Existing battles keep the order their challenges were added in."""
+    BattleChallenge = apps.get_model('codebattle', 'BattleChallenge')
+    position = {}
+    links = list(BattleChallenge.objects.order_by('battle_id', 'id'))
+    for link in links:
+        link.position = position.get(link.battle_id, 0)
+        position[link.battle_id] = link.position + 1
+    BattleChallenge.objects.bulk_update(links, ['position'], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('codebattle', '0010_update_time_limit_to_300'),
+    ]
+
+    operations = [
+        migrations.SeparateDatabaseAndState(
+            state_operations=[
+                migrations.CreateModel(
+                    name='BattleChallenge',
+                    fields=[
+                        ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                        ('battle', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='battle_challenges', to='codebattle.battle')),
+                        ('challenge', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='codebattle.challenge')),
+                    ],
+                    options={
+                        'db_table': 'codebattle_battle_challenges',
+                        'ordering': ['position'],
+                        'unique_together': {('battle', 'challenge')},
+                    },
+                ),
+                migrations.AlterField(
+                    model_name='battle',
+                    name='challenges',
+                    field=models.ManyToManyField(blank=True, through='codebattle.BattleChallenge', to='codebattle.challenge'),
+                ),
+            ],
+        ),
+        migrations.AddField(
+            model_name='battlechallenge',
+            name='position',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(number_positions, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='battlechallenge',
+            constraint=models.UniqueConstraint(fields=('battle', 'position'), name='unique_battle_challenge_position'),
+        ),
+    ]
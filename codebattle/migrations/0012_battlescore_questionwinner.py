@@ -0,0 +1,60 @@
+# Generated by Django 5.2.7 on 2026-10-19 04:48
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+def copy_live_scores(apps, schema_editor):
+    """Battles still being played move their JSON scores and winners into rows."""
+    Battle = apps.get_model('codebattle', 'Battle')
+    BattleScore = apps.get_model('codebattle', 'BattleScore')
+    QuestionWinner = apps.get_model('codebattle', 'QuestionWinner')
+    scores, winners = [], []
+    for battle in Battle.objects.exclude(status='completed').select_related('player1', 'player2'):
+        players = {player.username: player for player in (battle.player1, battle.player2) if player}
+        for username, score in (battle.scores or {}).items():
+            if username in players:
+                scores.append(BattleScore(battle=battle, user=players[username], score=score))
+        for index, username in (battle.question_winners or {}).items():
+            if username in players:
+                winners.append(QuestionWinner(battle=battle, challenge_index=int(index), user=players[username]))
+    BattleScore.objects.bulk_create(scores, batch_size=500, ignore_conflicts=True)
+    QuestionWinner.objects.bulk_create(winners, batch_size=500, ignore_conflicts=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('codebattle', '0011_battlechallenge'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BattleScore',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('score', models.IntegerField(default=0)),
+                ('battle', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='score_rows', to='codebattle.battle')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('battle', 'user'), name='unique_battle_score')],
+            },
+        ),
+        migrations.CreateModel(
+            name='QuestionWinner',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('challenge_index', models.IntegerField()),
+                ('solved_at', models.DateTimeField(auto_now_add=True)),
+                ('battle', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='question_wins', to='codebattle.battle')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('battle', 'challenge_index'), name='unique_question_winner')],
+            },
+        ),
+        migrations.RunPython(copy_live_scores, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,43 @@
+# Generated by Django 5.2.7 on 2026-10-19 04:49
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('codebattle', '0012_battlescore_questionwinner'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ChallengeFinish',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('challenge_index', models.IntegerField()),
+                ('status', models.CharField(max_length=20)),
+                ('finished_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='submission',
+            index=models.Index(fields=['user', 'challenge', 'status'], name='submission_user_chal_status'),
+        ),
+        migrations.AddField(
+            model_name='challengefinish',
+            name='battle',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='finishes', to='codebattle.battle'),
+        ),
+        migrations.AddField(
+            model_name='challengefinish',
+            name='user',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddConstraint(
+            model_name='challengefinish',
+            constraint=models.UniqueConstraint(fields=('battle', 'challenge_index', 'user'), name='unique_challenge_finish'),
+        ),
+    ]
@@ -1,4 +1,6 @@
 from django.db import models
+from django.db.models.signals import m2m_changed, post_delete
+from smartquizarena.codes import get_code_allocator, save_with_code
 from accounts.models import User
 
 class Challenge(models.Model):
@@ -41,13 +43,18 @@ class Submission(models.Model):
     submitted_at = models.DateTimeField(auto_now_add=True)
     judge0_token = models.CharField(max_length=100, blank=True, null=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', 'challenge', 'status'], name='submission_user_chal_status'),
+        ]
+
     def __str__(self):
         return f"{self.user.username} - {self.challenge.title}"
 
 class Battle(models.Model):
     player1 = models.ForeignKey(User, on_delete=models.CASCADE, related_name='battles_as_player1')
     player2 = models.ForeignKey(User, on_delete=models.CASCADE, related_name='battles_as_player2', blank=True, null=True)
-    challenges = models.ManyToManyField(Challenge, blank=True)  # Multiple challenges for the battle
+    challenges = models.ManyToManyField(Challenge, through='BattleChallenge', blank=True)  # Ordered by BattleChallenge.position
     winner = models.ForeignKey(User, on_delete=models.SET_NULL, blank=True, null=True, related_name='won_battles')
     started_at = models.DateTimeField(auto_now_add=True)
     completed_at = models.DateTimeField(blank=True, null=True)
@@ -57,7 +64,7 @@ class Battle(models.Model):
         ('completed', 'Completed'),
     ], default='waiting')
     battle_code = models.CharField(max_length=6, unique=True, blank=True, null=True)
-    scores = models.JSONField(blank=True, null=True)  # Store scores as dict {username: score}
+    scores = models.JSONField(blank=True, null=True)  # Final scores {username: score}, written when the battle ends; live scores are BattleScore rows
     num_questions = models.IntegerField(default=5)  # Number of challenges in the battle
     level = models.CharField(max_length=20, choices=[
         ('easy', 'Easy'),
@@ -67,20 +74,97 @@ class Battle(models.Model):
     current_challenge_index = models.IntegerField(default=0)  # Track current challenge in battle
     player1_ready = models.BooleanField(default=False)
     player2_ready = models.BooleanField(default=False)
-    question_winners = models.JSONField(blank=True, null=True)  # Track who solved each question first {challenge_index: username}
+    question_winners = models.JSONField(blank=True, null=True)  # Legacy; first solvers are QuestionWinner rows now
 
     def __str__(self):
         player2_name = self.player2.username if self.player2 else "Waiting"
         return f"{self.player1.username} vs {player2_name}"
 
     def save(self, *args, **kwargs):
-        if not self.battle_code:
-            import random
-            import string
-            # Generate a unique 6-character code
-            while True:
-                code = ''.join(random.choices(string.ascii_uppercase + string.digits, k=6))
-                if not Battle.objects.filter(battle_code=code).exists():
-                    self.battle_code = code
-                    break
-        super().save(*args, **kwargs)
+        # New battles get a code from the allocator (see smartquizarena/codes.py)
+        save_with_code(self, 'battle_code', 'battles', lambda: super(Battle, self).save(*args, **kwargs))
+
+    def set_challenges(self, challenges):
+        """Replace the battle's challenges; their order becomes the play order."""
+        challenges = list(challenges)
+        self.challenges.clear()
+        BattleChallenge.objects.bulk_create([
+            BattleChallenge(battle=self, challenge=challenge, position=position)
+            for position, challenge in enumerate(challenges)
+        ])
+        # bulk_create does not send m2m_changed; cached snapshots listen for it
+        m2m_changed.send(
+            sender=BattleChallenge, instance=self, action='post_add', reverse=False,
+            model=Challenge, pk_set={challenge.pk for challenge in challenges}, using=self._state.db,
+        )
+
+class BattleChallenge(models.Model):
+    """A challenge's place in a battle; ``position`` matches ``current_challenge_index``."""
+    battle = models.ForeignKey(Battle, on_delete=models.CASCADE, related_name='battle_challenges')
+    challenge = models.ForeignKey(Challenge, on_delete=models.CASCADE)
+    position = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        db_table = 'codebattle_battle_challenges'  # the table of the former auto-created M2M
+        ordering = ['position']
+        unique_together = [('battle', 'challenge')]
+        constraints = [
+            models.UniqueConstraint(fields=['battle', 'position'], name='unique_battle_challenge_position'),
+        ]
+
+    def __str__(self):
+        return f"{self.battle_id} #{self.position}: {self.challenge_id}"
+
+class BattleScore(models.Model):
+    """A player's running score in a battle, only ever changed with F() updates."""
+    battle = models.ForeignKey(Battle, on_delete=models.CASCADE, related_name='score_rows')
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    score = models.IntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['battle', 'user'], name='unique_battle_score'),
+        ]
+
+    def __str__(self):
+        return f"{self.user.username}: {self.score}"
+
+class QuestionWinner(models.Model):
+    """First player to solve a battle's challenge; the unique row decides races."""
+    battle = models.ForeignKey(Battle, on_delete=models.CASCADE, related_name='question_wins')
+    challenge_index = models.IntegerField()
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    solved_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['battle', 'challenge_index'], name='unique_question_winner'),
+        ]
+
+    def __str__(self):
+        return f"{self.battle_id} #{self.challenge_index}: {self.user.username}"
+
+class ChallengeFinish(models.Model):
+    """A player is done with a battle's challenge (solved it or ran out of time)."""
+    battle = models.ForeignKey(Battle, on_delete=models.CASCADE, related_name='finishes')
+    challenge_index = models.IntegerField()
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    status = models.CharField(max_length=20)
+    finished_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['battle', 'challenge_index', 'user'], name='unique_challenge_finish'),
+        ]
+
+    def __str__(self):
+        return f"{self.battle_id} #{self.challenge_index}: {self.user_id} {self.status}"
+
+
+def _recycle_battle_code(sender, instance, **kwargs):
+    # Finished battles keep their code for the results page until they are deleted
+    if instance.battle_code:
+        get_code_allocator('battles').release(instance.battle_code)
+
+
+post_delete.connect(_recycle_battle_code, sender=Battle)
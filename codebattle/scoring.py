@@ -0,0 +1,51 @@
+"""
+Race-free battle scoring.
+
+Both players submit at the same time, so nothing here reads a value and
+writes it back. Scores are ``BattleScore`` rows bumped with a single
+``UPDATE ... SET score = score + n``, and the first solver of a challenge
+is whoever manages to insert the ``QuestionWinner`` row for it; the unique
+(battle, challenge_index) constraint rejects everyone else.
+
+``Battle.scores`` keeps the final scores once a battle ends (and the scores
+of battles played before these tables existed).
+"""
+from django.db import IntegrityError, transaction
+from django.db.models import F
+
+from .models import BattleScore, QuestionWinner
+from .snapshots import invalidate_battle
+
+
+def add_score(battle_id, user, points):
+    """Add ``points`` to ``user``'s score in a battle."""
+    updated = BattleScore.objects.filter(battle_id=battle_id, user=user).update(score=F('score') + points)
+    if not updated:
+        try:
+            with transaction.atomic():
+                BattleScore.objects.create(battle_id=battle_id, user=user, score=points)
+        except IntegrityError:
+            # The other submission created the row first
+            BattleScore.objects.filter(battle_id=battle_id, user=user).update(score=F('score') + points)
+    invalidate_battle(battle_id)
+
+
+def claim_question(battle_id, challenge_index, user):
+    """Record ``user`` as the first solver. Returns True for exactly one caller."""
+    try:
+        with transaction.atomic():
+            QuestionWinner.objects.create(battle_id=battle_id, challenge_index=challenge_index, user=user)
+    except IntegrityError:
+        return False
+    return True
+
+
+def scores_from_rows(battle, rows):
+    """``{username: score}`` from a battle's score rows, falling back to ``Battle.scores``."""
+    scores = {row.user.username: row.score for row in rows}
+    return scores or dict(battle.scores or {})
+
+
+def battle_scores(battle):
+    rows = BattleScore.objects.filter(battle=battle).select_related('user').only('score', 'user__username')
+    return scores_from_rows(battle, rows)
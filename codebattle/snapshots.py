@@ -0,0 +1,182 @@
+"""
+Cached battle snapshots for ``CodeBattleConsumer``.
+
+A battle is split in two parts:
+
+* the static part (code, level and the challenge list) is fixed once the
+  battle is created; it is sent to a client once, when it joins.
+* the dynamic part (players, ready flags, status, current challenge and
+  scores) changes during play and is what every later event carries, so
+  delta clients (see ``smartquizarena/encoding.py``) only receive what moved.
+
+Both parts are rebuilt with a single ``select_related``/``prefetch_related``
+query on a miss. The static part is always kept in the Django cache. The
+dynamic part is only cached when that cache is shared by every process (see
+``CACHE_DIR``): the default in-memory cache is per process, and another worker
+or the ``reap_stale`` command would change a battle without dropping this
+worker's copy. Saving a battle drops its dynamic part (as does
+``scoring.add_score``); changing its challenges (or deleting it) drops both.
+
+``battle_challenge`` resolves one challenge (with its test cases) by its
+``BattleChallenge.position``. Positions do not move once a battle is set up,
+so the result is cached for the battle's life.
+"""
+from django.conf import settings
+from django.core.cache import cache, caches
+from django.core.cache.backends.locmem import LocMemCache
+from django.db.models import Prefetch
+from django.db.models.signals import m2m_changed, post_delete, post_save
+
+from .models import Battle, BattleChallenge, BattleScore, Challenge
+
+CHALLENGE_FIELDS = ('id', 'title', 'description', 'problem_statement', 'sample_io', 'difficulty', 'time_limit', 'language')
+CHALLENGE_TTL = 24 * 3600
+
+
+def _key(battle_id, part):
+    return f"codebattle:snapshot:{part}:{battle_id}"
+
+
+def _ttl():
+    return getattr(settings, "BATTLE_SNAPSHOT_TTL", 300)
+
+
+def _challenge_data(challenge):
+    return {field: getattr(challenge, field) for field in CHALLENGE_FIELDS}
+
+
+def _build_static(battle_id):
+    links = BattleChallenge.objects.select_related('challenge').only(
+        'battle', 'position', *[f'challenge__{field}' for field in CHALLENGE_FIELDS]
+    )
+    battle = Battle.objects.only('id', 'battle_code', 'level', 'num_questions').prefetch_related(
+        Prefetch('battle_challenges', queryset=links)
+    ).get(id=battle_id)
+    return {
+        'id': battle.id,
+        'battle_code': battle.battle_code,
+        'level': battle.level,
+        'num_questions': battle.num_questions,
+        'challenges': [
+            _challenge_data(link.challenge)
+            for link in battle.battle_challenges.all()
+        ],
+    }
+
+
+def _build_dynamic(battle_id):
+    from .scoring import scores_from_rows
+
+    score_rows = BattleScore.objects.select_related('user').only('battle', 'score', 'user__username')
+    battle = Battle.objects.select_related('player1', 'player2').prefetch_related(
+        Prefetch('score_rows', queryset=score_rows)
+    ).get(id=battle_id)
+    return {
+        'id': battle.id,
+        'player1': battle.player1.username,
+        'player2': battle.player2.username if battle.player2 else None,
+        'player1_ready': battle.player1_ready,
+        'player2_ready': battle.player2_ready if battle.player2 else False,
+        'current_challenge_index': battle.current_challenge_index,
+        'status': battle.status,
+        'scores': scores_from_rows(battle, battle.score_rows.all()),
+        'started_at': battle.started_at.isoformat() if battle.started_at else None,
+    }
+
+
+def _cached(battle_id, part, build):
+    key = _key(battle_id, part)
+    value = cache.get(key)
+    if value is None:
+        value = build(battle_id)
+        cache.set(key, value, _ttl())
+    return value
+
+
+def _shared_cache():
+    return not isinstance(caches['default'], LocMemCache)
+
+
+def static_snapshot(battle_id):
+    """The parts of a battle that do not change during play."""
+    return _cached(battle_id, 'static', _build_static)
+
+
+def dynamic_snapshot(battle_id):
+    """The parts of a battle that change during play, with the current challenge."""
+    if _shared_cache():
+        state = dict(_cached(battle_id, 'dynamic', _build_dynamic))
+    else:
+        state = _build_dynamic(battle_id)
+    challenges = static_snapshot(battle_id)['challenges']
+    index = state['current_challenge_index']
+    state['current_challenge'] = challenges[index] if index < len(challenges) else None
+    return state
+
+
+def battle_snapshot(battle_id):
+    """Static and dynamic parts merged (the old ``get_battle_data`` shape)."""
+    return {**static_snapshot(battle_id), **dynamic_snapshot(battle_id)}
+
+
+def battle_challenge(battle_id, position):
+    """The challenge at ``position`` in a battle with its test cases, or None past the last one."""
+    key = _key(battle_id, f'challenge:{position}')
+    challenge = cache.get(key)
+    if challenge is None:
+        link = BattleChallenge.objects.select_related('challenge').filter(
+            battle_id=battle_id, position=position
+        ).first()
+        if link is None:
+            return None
+        challenge = {**_challenge_data(link.challenge), 'position': position, 'test_cases': link.challenge.test_cases}
+        cache.set(key, challenge, CHALLENGE_TTL)
+    return challenge
+
+
+def invalidate_battle(battle_id, static=False):
+    keys = [_key(battle_id, 'dynamic')]
+    if static:
+        keys.append(_key(battle_id, 'static'))
+    cache.delete_many(keys)
+
+
+def _battle_saved(sender, instance, created=False, **kwargs):
+    invalidate_battle(instance.pk, static=created)
+
+
+def _battle_deleted(sender, instance, **kwargs):
+    invalidate_battle(instance.pk, static=True)
+
+
+def _link_deleted(sender, instance, **kwargs):
+    cache.delete(_key(instance.battle_id, f'challenge:{instance.position}'))
+    invalidate_battle(instance.battle_id, static=True)
+
+
+def _challenge_saved(sender, instance, created=False, **kwargs):
+    if created:
+        return
+    for battle_id, position in BattleChallenge.objects.filter(challenge=instance).values_list('battle_id', 'position'):
+        cache.delete(_key(battle_id, f'challenge:{position}'))
+        invalidate_battle(battle_id, static=True)
+
+
+def _challenges_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    # "clear" is handled before the links are gone so reverse lookups still work
+    if action not in ('post_add', 'post_remove', 'pre_clear'):
+        return
+    if not reverse:
+        invalidate_battle(instance.pk, static=True)
+    elif pk_set:
+        for battle_id in pk_set:
+            invalidate_battle(battle_id, static=True)
+    else:
+        _challenge_saved(sender, instance)
+
+
+post_save.connect(_battle_saved, sender=Battle)
+post_delete.connect(_battle_deleted, sender=Battle)
+post_save.connect(_challenge_saved, sender=Challenge)
+post_delete.connect(_link_deleted, sender=BattleChallenge)
+m2m_changed.connect(_challenges_changed, sender=BattleChallenge)
@@ -1,11 +1,21 @@
-from django.test import TestCase, TransactionTestCase
+from django.core.cache import cache
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
 from accounts.models import User
-from .models import Battle, Challenge, Submission
+from .models import Battle, BattleScore, Challenge, QuestionWinner, Submission
+from .finishes import FinishLedger
+from .matchmaking import MatchmakingQueue
+from .scoring import add_score, claim_question
 from gamification.models import UserProgress, Streak
+from channels.layers import get_channel_layer
 from channels.testing import WebsocketCommunicator
 from .consumers import CodeBattleConsumer
+from .snapshots import battle_challenge, battle_snapshot, dynamic_snapshot
 from asgiref.sync import sync_to_async
 import json
+import tempfile
+import threading
+import time
+from django.db import OperationalError, connection
 
 
 class CodeBattleConsumerTestCase(TransactionTestCase):
@@ -16,6 +26,7 @@ class CodeBattleConsumerTestCase(TransactionTestCase):
             title='Test Challenge',
             description='Test Description',
             problem_statement='Test Problem',
+            test_cases=[{'input': '1', 'output': '1'}],
             sample_io='Input: 1\nOutput: 1',
             difficulty='easy',
             time_limit=1.0
@@ -23,23 +34,34 @@ class CodeBattleConsumerTestCase(TransactionTestCase):
         self.battle = Battle.objects.create(
             player1=self.user1,
             player2=self.user2,
-            status='completed',
-            scores={'user1': 50, 'user2': 70}
+            status='in_progress'
         )
-        self.battle.challenges.add(self.challenge)
+        self.battle.set_challenges([self.challenge])
+        add_score(self.battle.id, self.user1, 50)
+        add_score(self.battle.id, self.user2, 70)
         self.progress1 = UserProgress.objects.create(user=self.user1, total_score=0, quizzes_completed=0, xp=0, level=1)
         self.progress2 = UserProgress.objects.create(user=self.user2, total_score=0, quizzes_completed=0, xp=0, level=1)
         self.streak1 = Streak.objects.create(user=self.user1, current_streak=0, longest_streak=0)
         self.streak2 = Streak.objects.create(user=self.user2, current_streak=0, longest_streak=0)
 
+    @override_settings(POSTGAME_INLINE=False)
     async def test_end_battle_updates_progress_and_streak(self):
-        # Simulate end battle event
+        # Simulate end battle event; the results are queued, then a worker applies them
+        from gamification.jobs import run_pending
+        from gamification.ratings import get_rating
         consumer = CodeBattleConsumer()
+        consumer.channel_layer = get_channel_layer()
         consumer.battle_id = self.battle.id
+        consumer.battle_group_name = f'battle_{self.battle.id}'
         consumer.user = self.user1
 
         # Call the handle_end_battle method
         await consumer.handle_end_battle(self.user1, {})
+        battle = await sync_to_async(Battle.objects.get)(id=self.battle.id)
+        self.assertEqual(battle.status, 'completed')
+        self.assertEqual(battle.winner_id, self.user2.id)
+        self.assertEqual(battle.scores, {'user1': 50, 'user2': 70})
+        await sync_to_async(run_pending)()
 
         # Refresh from database
         progress1 = await sync_to_async(UserProgress.objects.get)(user=self.user1)
@@ -64,3 +86,207 @@ class CodeBattleConsumerTestCase(TransactionTestCase):
 
         self.assertEqual(streak2.current_streak, 1)
         self.assertEqual(streak2.longest_streak, 1)
+
+        # Check ratings: the winner gains what the loser drops
+        rating1 = await sync_to_async(get_rating)(self.user1.id, 'codebattle')
+        rating2 = await sync_to_async(get_rating)(self.user2.id, 'codebattle')
+        self.assertLess(rating1, 1500)
+        self.assertGreater(rating2, 1500)
+        self.assertAlmostEqual(rating1 + rating2, 3000, places=6)
+
+    @override_settings(POSTGAME_INLINE=False)
+    async def test_battle_is_only_ended_once(self):
+        from accounts.models import UserStats
+        from gamification.models import PostGameJob
+        consumer = CodeBattleConsumer()
+        consumer.channel_layer = get_channel_layer()
+        consumer.battle_id = self.battle.id
+        consumer.battle_group_name = f'battle_{self.battle.id}'
+
+        # Both players (or a player and the question timer) send the end
+        await consumer.handle_end_battle(self.user1, {})
+        await consumer.handle_end_battle(self.user2, {})
+        stats = await sync_to_async(UserStats.objects.get)(user=self.user1)
+        self.assertEqual(stats.code_battles, 1)
+        self.assertEqual(await sync_to_async(PostGameJob.objects.count)(), 1)
+
+        # A battle the reaper closed stays closed without scores or a job
+        reaped = await sync_to_async(Battle.objects.create)(player1=self.user1, player2=self.user2, status='completed')
+        self.assertIsNone(await consumer.end_battle(reaped.id, 'user1'))
+        reaped = await sync_to_async(Battle.objects.get)(id=reaped.id)
+        self.assertIsNone(reaped.scores)
+        self.assertIsNone(reaped.winner_id)
+        self.assertEqual(await sync_to_async(PostGameJob.objects.count)(), 1)
+
+
+class BattleSnapshotTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user1 = User.objects.create_user(username='user1', password='pass')
+        self.user2 = User.objects.create_user(username='user2', password='pass')
+        self.challenges = [
+            Challenge.objects.create(
+                title=f'Challenge {i}', description='', problem_statement='', test_cases=[],
+                difficulty='easy', time_limit=60
+            )
+            for i in range(2)
+        ]
+        self.battle = Battle.objects.create(player1=self.user1)
+        self.battle.set_challenges(self.challenges)
+
+    def test_snapshot_is_cached_until_the_battle_changes(self):
+        with tempfile.TemporaryDirectory() as path, self.settings(CACHES={
+            'default': {'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache', 'LOCATION': path},
+        }):
+            # Battle + prefetched challenges for the static part, battle + prefetched scores for the dynamic part
+            with self.assertNumQueries(4):
+                snapshot = battle_snapshot(self.battle.id)
+            self.assertEqual(len(snapshot['challenges']), 2)
+            self.assertIsNone(snapshot['player2'])
+            with self.assertNumQueries(0):
+                battle_snapshot(self.battle.id)
+
+            self.battle.player2 = self.user2
+            self.battle.current_challenge_index = 1
+            self.battle.save()
+            with self.assertNumQueries(2):
+                state = dynamic_snapshot(self.battle.id)
+            self.assertEqual(state['player2'], 'user2')
+            self.assertEqual(state['current_challenge']['title'], self.challenges[1].title)
+            self.assertNotIn('challenges', state)
+
+    def test_per_process_cache_keeps_only_the_static_part(self):
+        battle_snapshot(self.battle.id)
+        # Changed elsewhere (another worker, reap_stale) without invalidating this process
+        Battle.objects.filter(pk=self.battle.pk).update(status='completed')
+        with self.assertNumQueries(2):
+            state = dynamic_snapshot(self.battle.id)
+        self.assertEqual(state['status'], 'completed')
+        self.assertEqual(state['current_challenge']['title'], self.challenges[0].title)
+
+    def test_changing_challenges_drops_the_static_part(self):
+        battle_snapshot(self.battle.id)
+        self.battle.challenges.remove(self.challenges[1])
+        self.assertEqual(len(battle_snapshot(self.battle.id)['challenges']), 1)
+
+    def test_current_challenge_follows_position(self):
+        self.battle.set_challenges(reversed(self.challenges))
+        self.assertEqual([c['title'] for c in battle_snapshot(self.battle.id)['challenges']], ['Challenge 1', 'Challenge 0'])
+        with self.assertNumQueries(1):
+            self.assertEqual(battle_challenge(self.battle.id, 0)['id'], self.challenges[1].id)
+        with self.assertNumQueries(0):
+            self.assertEqual(battle_challenge(self.battle.id, 0)['test_cases'], [])
+        self.assertIsNone(battle_challenge(self.battle.id, 2))
+
+
+class ScoringConcurrencyTestCase(TransactionTestCase):
+    def setUp(self):
+        cache.clear()
+        self.user1 = User.objects.create_user(username='user1', password='pass')
+        self.user2 = User.objects.create_user(username='user2', password='pass')
+        self.battle = Battle.objects.create(player1=self.user1, player2=self.user2, status='in_progress')
+
+    def run_threads(self, target, args_list):
+        barrier = threading.Barrier(len(args_list))
+        results = []
+
+        def worker(*args):
+            barrier.wait()
+            try:
+                for attempt in range(100):
+                    try:
+                        results.append(target(*args))
+                        break
+                    except OperationalError:
+                        # SQLite's shared in-memory test database fails on lock
+                        # contention instead of waiting; the statement was not applied
+                        time.sleep(0.01)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=worker, args=args) for args in args_list]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return results
+
+    def test_concurrent_submissions_keep_every_point(self):
+        users = [self.user1, self.user2] * 10
+        self.run_threads(add_score, [(self.battle.id, user, 5) for user in users])
+        scores = dict(BattleScore.objects.filter(battle=self.battle).values_list('user__username', 'score'))
+        self.assertEqual(scores, {'user1': 50, 'user2': 50})
+        self.assertEqual(dynamic_snapshot(self.battle.id)['scores'], scores)
+
+    def test_only_one_first_solver(self):
+        users = [self.user1, self.user2] * 4
+        results = self.run_threads(claim_question, [(self.battle.id, 0, user) for user in users])
+        self.assertEqual(results.count(True), 1)
+        self.assertEqual(QuestionWinner.objects.filter(battle=self.battle, challenge_index=0).count(), 1)
+
+
+class FinishLedgerTestCase(TestCase):
+    def setUp(self):
+        self.user1 = User.objects.create_user(username='user1', password='pass')
+        self.user2 = User.objects.create_user(username='user2', password='pass')
+        self.old_battle = Battle.objects.create(player1=self.user1, player2=self.user2, status='completed')
+        self.battle = Battle.objects.create(player1=self.user1, player2=self.user2, status='in_progress')
+        self.players = [self.user1.id, self.user2.id]
+        self.ledger = FinishLedger()
+
+    def test_finishes_are_scoped_to_the_battle(self):
+        self.ledger.record(self.old_battle.id, 0, self.user2.id, 'accepted')
+        self.ledger.record(self.battle.id, 0, self.user1.id, 'time_limit')
+        self.ledger.record(self.battle.id, 0, self.user2.id, 'wrong_answer')
+        # With one worker the set seeded by record() is authoritative
+        with self.assertNumQueries(0):
+            self.assertFalse(self.ledger.all_finished(self.battle.id, 0, self.players))
+
+        self.ledger.record(self.battle.id, 0, self.user2.id, 'accepted')
+        with self.assertNumQueries(0):
+            self.assertTrue(self.ledger.all_finished(self.battle.id, 0, self.players))
+
+    def test_finishes_from_other_workers_are_picked_up(self):
+        self.ledger = FinishLedger(shared=True)
+        other_worker = FinishLedger(shared=True)
+        self.ledger.record(self.battle.id, 1, self.user1.id, 'accepted')
+        self.assertFalse(self.ledger.all_finished(self.battle.id, 1, self.players))
+        other_worker.record(self.battle.id, 1, self.user2.id, 'time_limit')
+        self.assertTrue(self.ledger.all_finished(self.battle.id, 1, self.players))
+
+
+class MatchmakingQueueTestCase(SimpleTestCase):
+    def setUp(self):
+        self.now = 0.0
+        self.queue = MatchmakingQueue(band=100, growth=50, max_band=400, clock=lambda: self.now)
+
+    def test_newcomer_pairs_with_the_closest_rating(self):
+        self.assertIsNone(self.queue.enqueue('easy', 'python', 1, 'a', 1000))
+        self.assertIsNone(self.queue.enqueue('easy', 'python', 2, 'b', 1300))
+        self.assertIsNone(self.queue.enqueue('easy', 'java', 3, 'c', 1290))
+        opponent, ticket = self.queue.enqueue('easy', 'python', 4, 'd', 1250)
+        self.assertEqual((opponent.username, ticket.username), ('b', 'd'))
+        self.assertEqual(len(self.queue), 2)
+
+    def test_windows_widen_while_waiting(self):
+        self.queue.enqueue('easy', 'python', 1, 'a', 1000)
+        self.queue.enqueue('easy', 'python', 2, 'b', 1250)
+        self.assertEqual(self.queue.sweep(), [])
+        self.now = 3.0  # both windows are now 250
+        pairs = self.queue.sweep()
+        self.assertEqual([(a.username, b.username) for a, b in pairs], [('a', 'b')])
+        self.assertEqual(len(self.queue), 0)
+
+    def test_cancel_and_requeue(self):
+        self.queue.enqueue('easy', 'python', 1, 'a', 1000)
+        self.queue.enqueue('hard', 'python', 1, 'a', 1000)
+        self.assertIsNone(self.queue.enqueue('easy', 'python', 2, 'b', 1000))
+        self.assertTrue(self.queue.cancel(2))
+        self.assertFalse(self.queue.cancel(2))
+        self.assertEqual(self.queue.enqueue('hard', 'python', 3, 'c', 1050)[0].username, 'a')
+
+    def test_without_bands_queues_are_fifo(self):
+        queue = MatchmakingQueue(band=None)
+        queue.enqueue('easy', 'python', 1, 'a', 100)
+        opponent, _ = queue.enqueue('easy', 'python', 2, 'b', 2000)
+        self.assertEqual(opponent.username, 'a')
@@ -42,7 +42,7 @@ def code_editor(request):
             return redirect(f'/codebattle/results/?battle_code={battle_code}')
 
         # Fetch challenges and current challenge
-        challenges = list(battle.challenges.all().values('id', 'title', 'description', 'problem_statement', 'sample_io', 'difficulty', 'time_limit', 'language'))
+        challenges = list(Challenge.objects.filter(battlechallenge__battle=battle).order_by('battlechallenge__position').values('id', 'title', 'description', 'problem_statement', 'sample_io', 'difficulty', 'time_limit', 'language'))
         current_challenge = challenges[battle.current_challenge_index] if challenges and battle.current_challenge_index < len(challenges) else None
 
         # Prepare battle data for JavaScript
@@ -199,8 +199,7 @@ class CreateBattleView(APIView):
         # Select random challenges
         from .models import Challenge
         challenges = Challenge.objects.filter(difficulty=level).order_by('?')[:num_questions]
-        battle.challenges.set(challenges)
-        battle.save()
+        battle.set_challenges(challenges)
 
         serializer = BattleSerializer(battle)
         return Response(serializer.data, status=status.HTTP_201_CREATED)
@@ -220,10 +219,6 @@ class SubmissionCreateView(generics.CreateAPIView):
         # Award achievements for code battle completion
         AchievementService.award_achievement_on_codebattle_completion(self.request.user, submission, self.request)
 
-        # Award achievements for code battle completion
-        if 'passed' in result.lower():
-            AchievementService.award_achievement_on_codebattle_completion(self.request.user, submission)
-
 
 @login_required
 def battle_results(request):
@@ -4,3 +4,7 @@ from django.apps import AppConfig
 class GamificationConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'gamification'
+
+    def ready(self):
+        # Keeps the leaderboard in step with User.total_score, and badges with streaks
+        from . import leaderboard, rules  # noqa: F401
@@ -0,0 +1,126 @@
+"""
+Durable queue for post-game accounting.
+
+When a multiplayer quiz or coding battle ends, the consumer only stores its
+results as a ``PostGameJob`` row (``enqueue``), counts them towards this
+worker's windowed leaderboards and broadcasts the final scores. Progress,
+streaks, profile stats, badges and skill ratings (gamification/ratings.py)
+are applied later by ``run_job``, in one transaction with marking the job
+done:
+
+* every job has an idempotency key (``room:<id>:<start>``, ``battle:<id>``),
+  so a game that is finished twice is only counted once;
+* a failing job is retried with exponential backoff up to
+  ``POSTGAME_MAX_ATTEMPTS`` times, then left as ``failed`` with its error;
+* a job claimed by a worker that died is picked up again once its
+  ``POSTGAME_LEASE`` expires.
+
+With ``POSTGAME_INLINE`` (the default) the ASGI worker runs each job right
+after the broadcast (``run_soon``). Either way ``manage.py
+run_postgame_worker`` drains whatever is due, retries included.
+"""
+import asyncio
+import logging
+from datetime import timedelta
+
+from channels.db import database_sync_to_async
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from .models import PostGameJob
+from .progress import GameResult, record_results, record_windows
+from .ratings import RATED_MODES, rate_match
+
+logger = logging.getLogger(__name__)
+
+# Keeps inline tasks referenced until they finish
+_inline_tasks = set()
+
+
+def _setting(name, default):
+    return getattr(settings, name, default)
+
+
+def enqueue(key, results):
+    """
+    Store ``results`` (``GameResult`` tuples) under ``key`` and count them
+    towards the windowed leaderboards. Returns the job id, or None if
+    ``key`` was already queued.
+    """
+    results = [result for result in results if result.user_id]
+    try:
+        with transaction.atomic():
+            job = PostGameJob.objects.create(key=key, results=[list(result) for result in results])
+    except IntegrityError:
+        return None
+    # The caller may still roll back (e.g. the battle update it is part of)
+    transaction.on_commit(lambda: record_windows(results))
+    return job.id
+
+
+def _due(now):
+    return Q(status='pending', run_after__lte=now) | Q(status='running', locked_until__lt=now)
+
+
+def _claim(ids, now):
+    return PostGameJob.objects.filter(_due(now), pk__in=ids).update(
+        status='running', attempts=F('attempts') + 1, locked_until=now + timedelta(seconds=_setting('POSTGAME_LEASE', 60)),
+    )
+
+
+def run_job(job_id, now=None):
+    """Claim and apply one job. Returns False if it is not due or another worker has it."""
+    now = now or timezone.now()
+    if not _claim([job_id], now):
+        return False
+    _execute(PostGameJob.objects.get(pk=job_id))
+    return True
+
+
+def run_pending(batch_size=50, now=None):
+    """Claim up to ``batch_size`` due jobs and apply them. Returns how many were run."""
+    now = now or timezone.now()
+    with transaction.atomic():
+        ids = list(PostGameJob.objects.select_for_update(skip_locked=True).filter(_due(now)).order_by(
+            'run_after'
+        ).values_list('pk', flat=True)[:batch_size])
+        if ids:
+            _claim(ids, now)
+    for job in PostGameJob.objects.filter(pk__in=ids).order_by('run_after'):
+        _execute(job)
+    return len(ids)
+
+
+def _execute(job):
+    try:
+        with transaction.atomic():
+            results = [GameResult(*fields) for fields in job.results]
+            record_results(results, windows=False)
+            if results and results[0].mode in RATED_MODES:
+                rate_match(results[0].mode, [(result.user_id, result.score or 0) for result in results])
+            PostGameJob.objects.filter(pk=job.pk).update(status='done', finished_at=timezone.now(), last_error='')
+    except Exception as exc:
+        logger.exception("Post-game job %s failed (attempt %s)", job.key, job.attempts)
+        if job.attempts >= _setting('POSTGAME_MAX_ATTEMPTS', 5):
+            PostGameJob.objects.filter(pk=job.pk).update(status='failed', last_error=repr(exc))
+        else:
+            PostGameJob.objects.filter(pk=job.pk).update(
+                status='pending', run_after=timezone.now() + timedelta(seconds=2 ** job.attempts), last_error=repr(exc),
+            )
+
+
+def purge_finished(older_than):
+    """Delete jobs that finished before ``older_than``. Returns how many."""
+    return PostGameJob.objects.filter(status='done', finished_at__lt=older_than).delete()[0]
+
+
+def run_soon(job_id):
+    """Run ``job_id`` in the background of the running event loop if ``POSTGAME_INLINE`` is set."""
+    if job_id is None or not _setting('POSTGAME_INLINE', True):
+        return None
+    task = asyncio.get_running_loop().create_task(database_sync_to_async(run_job)(job_id))
+    _inline_tasks.add(task)
+    task.add_done_callback(_inline_tasks.discard)
+    return task
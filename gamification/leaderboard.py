@@ -0,0 +1,411 @@
+"""
+The global leaderboard (users ranked by ``User.total_score``).
+
+Instead of sorting every user on each request, scores are kept in an
+order-statistic structure that is updated on every ``User`` save:
+
+* ``InMemoryLeaderboard`` holds an indexable skip list of
+  ``(-score, user_id)`` keys in the worker process. It is filled from the
+  database on first use (one ``values_list`` scan) and refilled every
+  ``LEADERBOARD_RELOAD_INTERVAL`` seconds, since score changes made by other
+  processes (``run_postgame_worker``, other ASGI workers) never reach it.
+* ``RedisLeaderboard`` keeps the scores in a Redis sorted set shared by all
+  workers (``LEADERBOARD_REDIS_URL``).
+
+Both answer ``top``, ``page``, ``rank`` and ``around`` in O(log n) plus the
+size of the result. Ranks match the old ``total_score__gt`` count: users
+with equal scores share a rank.
+
+``leaderboard_rows`` turns entries into the dicts the leaderboard page and
+API render, with two queries whatever the page size; ``top_rows`` caches
+the top ten.
+"""
+import random
+import threading
+import time
+from collections import namedtuple
+
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.db.models.signals import post_delete, post_save
+
+from accounts.models import User
+from smartquizarena.cache import cached, invalidate
+
+LeaderboardEntry = namedtuple('LeaderboardEntry', 'rank user_id score')
+TOP_SIZE = 10
+# User fields shown on the leaderboard
+ROW_FIELDS = {'username', 'total_score', 'level', 'xp'}
+
+_MAX_LEVEL = 32
+
+
+class _Node:
+    __slots__ = ('key', 'next', 'span')
+
+    def __init__(self, key, level):
+        self.key = key
+        self.next = [None] * level
+        self.span = [0] * level  # bottom-level steps to next[i]
+
+
+class OrderStatisticSkipList:
+    """Sorted keys with O(log n) insert, remove, rank and positional lookup."""
+
+    def __init__(self, probability=0.25, rng=None):
+        self._head = _Node(None, _MAX_LEVEL)
+        self._level = 1
+        self._size = 0
+        self._probability = probability
+        self._random = rng or random.Random()
+
+    def __len__(self):
+        return self._size
+
+    def _random_level(self):
+        level = 1
+        while level < _MAX_LEVEL and self._random.random() < self._probability:
+            level += 1
+        return level
+
+    def _predecessors(self, key):
+        update = [self._head] * _MAX_LEVEL
+        ranks = [0] * _MAX_LEVEL
+        node, rank = self._head, 0
+        for level in reversed(range(self._level)):
+            while node.next[level] is not None and node.next[level].key < key:
+                rank += node.span[level]
+                node = node.next[level]
+            update[level], ranks[level] = node, rank
+        return update, ranks
+
+    def insert(self, key):
+        update, ranks = self._predecessors(key)
+        level = self._random_level()
+        if level > self._level:
+            for i in range(self._level, level):
+                update[i], ranks[i] = self._head, 0
+                self._head.span[i] = self._size
+            self._level = level
+        node = _Node(key, level)
+        for i in range(level):
+            node.next[i] = update[i].next[i]
+            update[i].next[i] = node
+            node.span[i] = update[i].span[i] - (ranks[0] - ranks[i])
+            update[i].span[i] = ranks[0] - ranks[i] + 1
+        for i in range(level, self._level):
+            update[i].span[i] += 1
+        self._size += 1
+
+    def remove(self, key):
+        """Remove ``key``; returns False if it was not there."""
+        update, _ = self._predecessors(key)
+        node = update[0].next[0]
+        if node is None or node.key != key:
+            return False
+        for i in range(self._level):
+            if update[i].next[i] is node:
+                update[i].span[i] += node.span[i] - 1
+                update[i].next[i] = node.next[i]
+            else:
+                update[i].span[i] -= 1
+        while self._level > 1 and self._head.next[self._level - 1] is None:
+            self._level -= 1
+        self._size -= 1
+        return True
+
+    def count_less(self, key):
+        """Number of keys strictly smaller than ``key``."""
+        return self._predecessors(key)[1][0]
+
+    def _node_at(self, index):
+        target = index + 1
+        node, traversed = self._head, 0
+        for level in reversed(range(self._level)):
+            while node.next[level] is not None and traversed + node.span[level] <= target:
+                traversed += node.span[level]
+                node = node.next[level]
+            if traversed == target:
+                return node
+        return None
+
+    def slice(self, start, stop):
+        """Keys at positions ``start`` (inclusive) to ``stop`` (exclusive)."""
+        if start >= self._size or stop <= start:
+            return []
+        node = self._node_at(max(start, 0))
+        keys = []
+        for _ in range(min(stop, self._size) - max(start, 0)):
+            keys.append(node.key)
+            node = node.next[0]
+        return keys
+
+
+def _ranked(pairs, start, first_rank):
+    """Attach shared ranks to ``(user_id, score)`` pairs found at position ``start`` onwards."""
+    entries = []
+    for offset, (user_id, score) in enumerate(pairs):
+        if entries and entries[-1].score == score:
+            rank = entries[-1].rank
+        else:
+            rank = first_rank if not entries else start + offset + 1
+        entries.append(LeaderboardEntry(rank, user_id, score))
+    return entries
+
+
+class InMemoryLeaderboard:
+    shared = False
+
+    def __init__(self, rng=None, max_age=None, clock=time.monotonic):
+        self._rng = rng
+        self._scores = {}
+        self._list = OrderStatisticSkipList(rng=rng)
+        self._lock = threading.Lock()
+        self.loaded = False
+        self.max_age = max_age
+        self.clock = clock
+        self._loaded_at = None
+
+    def __len__(self):
+        return len(self._scores)
+
+    def load(self, pairs):
+        """Replace the contents with ``(user_id, score)`` pairs."""
+        with self._lock:
+            self._scores = {}
+            self._list = OrderStatisticSkipList(rng=self._rng)
+            for user_id, score in pairs:
+                self._scores[user_id] = score
+                self._list.insert((-score, user_id))
+            self.loaded = True
+            self._loaded_at = self.clock()
+
+    def expired(self):
+        """Whether the contents are older than ``max_age`` and should be loaded again."""
+        return self.max_age is not None and self._loaded_at is not None and self.clock() - self._loaded_at > self.max_age
+
+    def update(self, user_id, score):
+        with self._lock:
+            old = self._scores.get(user_id)
+            if old == score:
+                return
+            if old is not None:
+                self._list.remove((-old, user_id))
+            self._scores[user_id] = score
+            self._list.insert((-score, user_id))
+
+    def remove(self, user_id):
+        with self._lock:
+            old = self._scores.pop(user_id, None)
+            if old is not None:
+                self._list.remove((-old, user_id))
+
+    def score(self, user_id):
+        return self._scores.get(user_id)
+
+    def rank(self, user_id):
+        """1-based rank of ``user_id`` (ties share a rank), or None if unknown."""
+        score = self._scores.get(user_id)
+        if score is None:
+            return None
+        with self._lock:
+            return self._list.count_less((-score, float('-inf'))) + 1
+
+    def page(self, offset, limit):
+        with self._lock:
+            keys = self._list.slice(offset, offset + limit)
+            if not keys:
+                return []
+            first_rank = self._list.count_less((keys[0][0], float('-inf'))) + 1
+        return _ranked([(user_id, -key) for key, user_id in keys], offset, first_rank)
+
+    def top(self, k):
+        return self.page(0, k)
+
+    def around(self, user_id, radius=5):
+        """Up to ``radius`` entries either side of ``user_id``, with the user in the middle."""
+        score = self._scores.get(user_id)
+        if score is None:
+            return []
+        with self._lock:
+            index = self._list.count_less((-score, user_id))
+        start = max(index - radius, 0)
+        return self.page(start, index + radius + 1 - start)
+
+
+class RedisLeaderboard:
+    """The same queries over a Redis sorted set (member: user id, score: total score)."""
+    shared = True
+
+    def __init__(self, client, key='leaderboard:global'):
+        self.client = client
+        self.key = key
+        self.loaded_key = f'{key}:loaded'
+
+    def __len__(self):
+        return self.client.zcard(self.key)
+
+    @property
+    def loaded(self):
+        return bool(self.client.exists(self.loaded_key))
+
+    def load(self, pairs, chunk_size=1000):
+        pipe = self.client.pipeline(transaction=False)
+        pipe.delete(self.key)
+        chunk = {}
+        for user_id, score in pairs:
+            chunk[user_id] = score
+            if len(chunk) >= chunk_size:
+                pipe.zadd(self.key, chunk)
+                chunk = {}
+        if chunk:
+            pipe.zadd(self.key, chunk)
+        pipe.set(self.loaded_key, 1)
+        pipe.execute()
+
+    def expired(self):
+        return False
+
+    def update(self, user_id, score):
+        self.client.zadd(self.key, {user_id: score})
+
+    def remove(self, user_id):
+        self.client.zrem(self.key, user_id)
+
+    def score(self, user_id):
+        score = self.client.zscore(self.key, user_id)
+        return int(score) if score is not None else None
+
+    def _count_above(self, score):
+        return self.client.zcount(self.key, f'({score}', '+inf')
+
+    def rank(self, user_id):
+        score = self.score(user_id)
+        if score is None:
+            return None
+        return self._count_above(score) + 1
+
+    def page(self, offset, limit):
+        if limit <= 0:
+            return []
+        rows = self.client.zrevrange(self.key, offset, offset + limit - 1, withscores=True)
+        if not rows:
+            return []
+        pairs = [(int(member), int(score)) for member, score in rows]
+        return _ranked(pairs, offset, self._count_above(pairs[0][1]) + 1)
+
+    def top(self, k):
+        return self.page(0, k)
+
+    def around(self, user_id, radius=5):
+        index = self.client.zrevrank(self.key, user_id)
+        if index is None:
+            return []
+        start = max(index - radius, 0)
+        return self.page(start, index + radius + 1 - start)
+
+
+def leaderboard_rows(entries):
+    """Leaderboard dicts (username, scores, level, xp, streak) for ``entries``, in order."""
+    from .models import Streak
+
+    ids = [entry.user_id for entry in entries]
+    users = User.objects.only('username', 'level', 'xp').in_bulk(ids)
+    streaks = dict(
+        Streak.objects.filter(user_id__in=ids).order_by('id').values_list('user_id', 'current_streak')
+    )
+    return [
+        {
+            'rank': entry.rank,
+            'username': users[entry.user_id].username,
+            'total_score': entry.score,
+            'level': users[entry.user_id].level,
+            'xp': users[entry.user_id].xp,
+            'current_streak': streaks.get(entry.user_id, 0),
+        }
+        for entry in entries
+        if entry.user_id in users
+    ]
+
+
+def top_rows():
+    """Rows for the top ``TOP_SIZE`` players, cached until a score changes (see smartquizarena/cache.py)."""
+    return cached('leaderboard:top', lambda: leaderboard_rows(get_leaderboard().top(TOP_SIZE)))
+
+
+_leaderboard = None
+_leaderboard_lock = threading.Lock()
+
+
+def _build():
+    url = getattr(settings, 'LEADERBOARD_REDIS_URL', '')
+    if url:
+        import redis
+
+        return RedisLeaderboard(redis.Redis.from_url(url))
+    return InMemoryLeaderboard(max_age=getattr(settings, 'LEADERBOARD_RELOAD_INTERVAL', 60) or None)
+
+
+def get_leaderboard():
+    """Return the process-wide leaderboard, filling it from the database on first use (and when expired)."""
+    global _leaderboard
+    with _leaderboard_lock:
+        if _leaderboard is None:
+            _leaderboard = _build()
+        leaderboard = _leaderboard
+    if not leaderboard.loaded or leaderboard.expired():
+        leaderboard.load(User.objects.values_list('id', 'total_score').iterator())
+    return leaderboard
+
+
+def _current():
+    # Where score changes go: a shared board always, an in-memory one once loaded
+    global _leaderboard
+    with _leaderboard_lock:
+        if _leaderboard is None and getattr(settings, 'LEADERBOARD_REDIS_URL', ''):
+            _leaderboard = _build()
+        leaderboard = _leaderboard
+    if leaderboard is not None and (leaderboard.shared or leaderboard.loaded):
+        return leaderboard
+    return None
+
+
+def reset_leaderboard():
+    """Forget the current leaderboard; the next ``get_leaderboard`` reloads it."""
+    global _leaderboard
+    with _leaderboard_lock:
+        _leaderboard = None
+
+
+def update_scores(pairs):
+    """Apply ``(user_id, total_score)`` pairs written without ``save()`` (e.g. ``F()`` updates)."""
+    leaderboard = _current()
+    if leaderboard is not None:
+        for user_id, score in pairs:
+            leaderboard.update(user_id, score)
+    invalidate('leaderboard:top')
+
+
+def _user_saved(sender, instance, update_fields=None, **kwargs):
+    leaderboard = _current()
+    if leaderboard is not None:
+        leaderboard.update(instance.pk, instance.total_score)
+    if update_fields is None or ROW_FIELDS.intersection(update_fields):
+        invalidate('leaderboard:top')
+
+
+def _user_deleted(sender, instance, **kwargs):
+    leaderboard = _current()
+    if leaderboard is not None:
+        leaderboard.remove(instance.pk)
+    invalidate('leaderboard:top')
+
+
+def _reset_on_setting(setting, **kwargs):
+    if setting.startswith('LEADERBOARD_'):
+        reset_leaderboard()
+
+
+post_save.connect(_user_saved, sender=User)
+post_delete.connect(_user_deleted, sender=User)
+setting_changed.connect(_reset_on_setting)
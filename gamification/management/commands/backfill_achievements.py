@@ -0,0 +1,92 @@
+import time
+from collections import Counter
+from pathlib import Path
+
+from django.core.management.base import BaseCommand
+from django.db.models import Count, Max
+
+from accounts.models import User
+from accounts.stats import add_achievements
+from codebattle.models import Submission
+from gamification.models import Achievement, Badge, BadgeCounters, Streak
+from gamification.rules import COUNTERS, BadgeIndex, session_counters
+from quizzes.models import GameSession
+
+
+class Command(BaseCommand):
+    help = 'Award missing badges to every user with grouped queries (see gamification/rules.py)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=5000, help='Users per round of queries')
+        parser.add_argument('--batch-size', type=int, default=1000, help='Rows per bulk insert')
+        parser.add_argument('--start-after', type=int, default=0, help='Skip users with an id up to this one')
+        parser.add_argument('--checkpoint', help='File recording the last finished user id; resumes from it if present')
+
+    def handle(self, *args, **options):
+        chunk_size, batch_size = options['chunk_size'], options['batch_size']
+        checkpoint = Path(options['checkpoint']) if options['checkpoint'] else None
+        last_id = options['start_after']
+        if checkpoint and checkpoint.exists():
+            last_id = max(last_id, int(checkpoint.read_text().strip() or 0))
+            self.stdout.write(f"Resuming after user {last_id}")
+
+        index = BadgeIndex(Badge.objects.all())
+        remaining = User.objects.filter(id__gt=last_id).count()
+        done = awarded = 0
+        started = time.perf_counter()
+        while True:
+            rows = User.objects.filter(id__gt=last_id).order_by('id').values_list('id', 'level', 'xp')[:chunk_size]
+            users = {user_id: {**dict.fromkeys(COUNTERS, 0), 'level': level, 'xp': xp} for user_id, level, xp in rows}
+            if not users:
+                break
+            low, high = min(users), max(users)
+            created = self.backfill_chunk(index, users, low, high, batch_size)
+            awarded += created
+            done += len(users)
+            last_id = high
+            if checkpoint:
+                checkpoint.write_text(str(last_id))
+            elapsed = time.perf_counter() - started
+            self.stdout.write(
+                f"{done}/{remaining} users ({done * 100 // max(remaining, 1)}%), "
+                f"{awarded} badges awarded, last user {last_id}, {elapsed:.1f}s"
+            )
+        self.stdout.write(self.style.SUCCESS(f"Backfill complete: {awarded} badges awarded to {done} users"))
+
+    def backfill_chunk(self, index, users, low, high, batch_size):
+        """Counters for users ``low``..``high`` with one GROUP BY per source, then insert the missing badges."""
+        in_chunk = {'user_id__gte': low, 'user_id__lte': high}
+        sessions = GameSession.objects.filter(completed_at__isnull=False, **in_chunk).values('user_id').annotate(
+            **session_counters()
+        ).order_by()
+        for row in sessions:
+            if row['user_id'] in users:
+                users[row['user_id']].update(
+                    (name, row[name]) for name in ('quizzes_completed', 'perfect_scores', 'high_scores')
+                )
+        battles = Submission.objects.filter(status='accepted', **in_chunk).values('user_id').annotate(
+            total=Count('id')
+        ).order_by()
+        for row in battles:
+            if row['user_id'] in users:
+                users[row['user_id']]['code_battles_completed'] = row['total']
+        streaks = Streak.objects.filter(**in_chunk).values('user_id').annotate(best=Max('current_streak')).order_by()
+        for row in streaks:
+            if row['user_id'] in users:
+                users[row['user_id']]['streak'] = row['best']
+
+        existing = set(Achievement.objects.filter(**in_chunk).values_list('user_id', 'badge_id'))
+        missing = [
+            Achievement(user_id=user_id, badge_id=badge_id)
+            for user_id, counters in users.items()
+            for badge_id in dict.fromkeys(index.all_reached(counters))
+            if (user_id, badge_id) not in existing
+        ]
+        Achievement.objects.bulk_create(missing, batch_size=batch_size, ignore_conflicts=True)
+        add_achievements(Counter(achievement.user_id for achievement in missing))
+        # Later events start from these counters instead of re-reading history
+        BadgeCounters.objects.bulk_create(
+            [BadgeCounters(user_id=user_id, **counters) for user_id, counters in users.items()],
+            batch_size=batch_size, update_conflicts=True, unique_fields=['user'], update_fields=list(COUNTERS),
+        )
+        return len(missing)
@@ -0,0 +1,57 @@
+import random
+import time
+
+from django.core.management.base import BaseCommand
+
+from gamification.windows import DAY, MODES, WINDOWS, InMemoryWindowedLeaderboards
+
+
+class Command(BaseCommand):
+    help = 'Measure the windowed leaderboards on synthetic game completions'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sessions', type=int, default=1_000_000, help='Completed games spread over the last 30 days')
+        parser.add_argument('--users', type=int, default=50_000)
+        parser.add_argument('--topics', type=int, default=20)
+        parser.add_argument('--seed', type=int, default=1)
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        sessions, users, topics = options['sessions'], options['users'], options['topics']
+        now = [30 * DAY]
+        boards = InMemoryWindowedLeaderboards(clock=lambda: now[0])
+
+        # Completions arrive in time order, as they would in production
+        times = sorted(rng.uniform(0, 30 * DAY) for _ in range(sessions))
+        start = time.perf_counter()
+        for at in times:
+            mode = rng.choice(MODES)
+            topic = rng.randint(1, topics) if mode != 'codebattle' else None
+            boards.record(rng.randint(1, users), rng.randint(1, 100), mode, topic, at)
+        elapsed = time.perf_counter() - start
+        self.stdout.write(f"record {sessions} completions: {elapsed:.1f} s ({sessions / elapsed:,.0f}/s)")
+
+        probes = [rng.randint(1, users) for _ in range(1000)]
+        for window in WINDOWS:
+            for scope in ('all', 'mode:single', 'topic:1'):
+                board = boards.board(window, scope)
+                start = time.perf_counter()
+                board.top(10)
+                board.page(len(board) // 2, 20)
+                for user_id in probes:
+                    board.rank(user_id)
+                    board.around(user_id, 5)
+                elapsed = time.perf_counter() - start
+                self.stdout.write(
+                    f"{window:>7} {scope:<12} {len(board):>6} players: top/page + 1000 rank/around in "
+                    f"{elapsed * 1e3:.1f} ms"
+                )
+
+        # Roll every window forward by a day: only the expired buckets are touched
+        now[0] += DAY
+        start = time.perf_counter()
+        for window in WINDOWS:
+            for scope in ['all'] + [f'mode:{mode}' for mode in MODES] + [f'topic:{t}' for t in range(1, topics + 1)]:
+                boards.board(window, scope)
+        elapsed = time.perf_counter() - start
+        self.stdout.write(f"roll all boards forward one day: {elapsed * 1e3:.1f} ms")
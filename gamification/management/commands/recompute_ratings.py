@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+
+from gamification.ratings import RATED_MODES, np, recompute
+
+
+class Command(BaseCommand):
+    help = 'Rebuild Glicko-2 skill ratings from finished battles and rooms (see gamification/ratings.py)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--mode', choices=RATED_MODES, action='append', help='Only this mode (repeatable)')
+        parser.add_argument('--period-days', type=int, default=1, help='Days per rating period')
+        parser.add_argument('--no-numpy', action='store_true', help='Use the pure Python update even if NumPy is installed')
+
+    def handle(self, *args, **options):
+        use_numpy = not options['no_numpy'] and np is not None
+        if not options['no_numpy'] and np is None:
+            self.stdout.write(self.style.WARNING("NumPy is not installed; using the pure Python update"))
+        path = 'NumPy' if use_numpy else 'pure Python'
+        for mode in options['mode'] or RATED_MODES:
+            rated = recompute(mode, period_days=options['period_days'], use_numpy=use_numpy)
+            self.stdout.write(f"Rated {rated} players in {mode} ({path} update)")
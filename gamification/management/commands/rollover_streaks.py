@@ -0,0 +1,10 @@
+from django.core.management.base import BaseCommand
+
+from gamification.streaks import rollover
+
+
+class Command(BaseCommand):
+    help = 'Reset streaks that were not extended yesterday (run nightly; see gamification/streaks.py)'
+
+    def handle(self, *args, **options):
+        self.stdout.write(f"Reset {rollover()} broken streaks")
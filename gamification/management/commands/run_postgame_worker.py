@@ -0,0 +1,57 @@
+import multiprocessing
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connections
+from django.utils import timezone
+
+from gamification.jobs import purge_finished, run_pending
+
+
+def _work(batch_size, poll_interval, keep_days, once):
+    last_purge = 0
+    while True:
+        ran = run_pending(batch_size)
+        if once and not ran:
+            return
+        if time.monotonic() - last_purge > 3600:
+            purge_finished(timezone.now() - timedelta(days=keep_days))
+            last_purge = time.monotonic()
+        if not ran:
+            time.sleep(poll_interval)
+
+
+class Command(BaseCommand):
+    help = 'Apply queued post-game progress, streak and badge updates (see gamification/jobs.py)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=1, help='Worker processes to start')
+        parser.add_argument('--batch-size', type=int, default=50, help='Jobs claimed per round')
+        parser.add_argument('--poll-interval', type=float, default=1.0, help='Seconds to wait when the queue is empty')
+        parser.add_argument('--keep-days', type=int, default=7, help='Delete finished jobs older than this')
+        parser.add_argument('--once', action='store_true', help='Exit once nothing is due')
+
+    def handle(self, *args, **options):
+        if not getattr(settings, 'LEADERBOARD_REDIS_URL', ''):
+            self.stdout.write(self.style.WARNING(
+                "LEADERBOARD_REDIS_URL is not set: web workers only see these score changes "
+                "when their leaderboard is reloaded (LEADERBOARD_RELOAD_INTERVAL)"
+            ))
+        job_args = (options['batch_size'], options['poll_interval'], options['keep_days'], options['once'])
+        if options['workers'] <= 1:
+            _work(*job_args)
+            return
+        # Each process opens its own database connection
+        connections.close_all()
+        processes = [multiprocessing.Process(target=_work, args=job_args) for _ in range(options['workers'])]
+        for process in processes:
+            process.start()
+        self.stdout.write(f"Started {len(processes)} post-game workers")
+        try:
+            for process in processes:
+                process.join()
+        except KeyboardInterrupt:
+            for process in processes:
+                process.terminate()
@@ -0,0 +1,30 @@
+# Generated by Django 5.2.7 on 2026-10-19 05:07
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('gamification', '0003_alter_userprogress_time_spent'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BadgeCounters',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('quizzes_completed', models.IntegerField(default=0)),
+                ('perfect_scores', models.IntegerField(default=0)),
+                ('high_scores', models.IntegerField(default=0)),
+                ('code_battles_completed', models.IntegerField(default=0)),
+                ('streak', models.IntegerField(default=0)),
+                ('level', models.IntegerField(default=1)),
+                ('xp', models.IntegerField(default=0)),
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='badge_counters', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+    ]
@@ -0,0 +1,45 @@
+# Generated by Django 5.2.7 on 2026-10-19 05:19
+
+from datetime import timedelta
+
+from django.db import migrations, models
+
+
+def seed_calendars(apps, schema_editor):
+    # A running streak means its user was active on each of its last days
+    Streak = apps.get_model('gamification', 'Streak')
+    batch = []
+    for streak in Streak.objects.filter(last_activity__isnull=False, current_streak__gt=0).iterator():
+        streak.activity_since = streak.last_activity - timedelta(days=streak.current_streak - 1)
+        streak.activity_days = ((1 << streak.current_streak) - 1).to_bytes((streak.current_streak + 7) // 8, 'little')
+        batch.append(streak)
+        if len(batch) >= 1000:
+            Streak.objects.bulk_update(batch, ['activity_since', 'activity_days'])
+            batch = []
+    Streak.objects.bulk_update(batch, ['activity_since', 'activity_days'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('gamification', '0005_postgamejob'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='streak',
+            name='activity_days',
+            field=models.BinaryField(default=bytes),
+        ),
+        migrations.AddField(
+            model_name='streak',
+            name='activity_since',
+            field=models.DateField(blank=True, null=True),
+        ),
+        migrations.AlterField(
+            model_name='streak',
+            name='last_activity',
+            field=models.DateField(blank=True, null=True),
+        ),
+        migrations.RunPython(seed_calendars, migrations.RunPython.noop),
+    ]
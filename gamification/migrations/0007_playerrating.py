@@ -0,0 +1,33 @@
+# Generated by Django 5.2.7 on 2026-10-19 05:23
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('gamification', '0006_streak_activity_calendar'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PlayerRating',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('mode', models.CharField(choices=[('codebattle', 'Code Battle'), ('multiplayer', 'Multiplayer')], max_length=20)),
+                ('rating', models.FloatField(default=1500.0)),
+                ('deviation', models.FloatField(default=350.0)),
+                ('volatility', models.FloatField(default=0.06)),
+                ('games', models.IntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='ratings', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['mode', 'rating'], name='rating_range_idx')],
+                'constraints': [models.UniqueConstraint(fields=('user', 'mode'), name='rating_user_mode_unique')],
+            },
+        ),
+    ]
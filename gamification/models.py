@@ -1,6 +1,7 @@
 from django.db import models
 from accounts.models import User
 from datetime import timedelta
+from django.utils import timezone
 
 class Badge(models.Model):
     name = models.CharField(max_length=100)
@@ -23,7 +24,10 @@ class Streak(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE)
     current_streak = models.IntegerField(default=0)
     longest_streak = models.IntegerField(default=0)
-    last_activity = models.DateField(auto_now=True)
+    last_activity = models.DateField(blank=True, null=True)
+    # Bitset of active days: bit i is activity_since + i days (see gamification/streaks.py)
+    activity_since = models.DateField(blank=True, null=True)
+    activity_days = models.BinaryField(default=bytes)
 
     def __str__(self):
         return f"{self.user.username} - Streak: {self.current_streak}"
@@ -39,3 +43,62 @@ class UserProgress(models.Model):
 
     def __str__(self):
         return f"{self.user.username} Progress"
+
+class BadgeCounters(models.Model):
+    """Per-user inputs to badge criteria, kept up to date by gamification/rules.py."""
+    user = models.OneToOneField(User, on_delete=models.CASCADE, related_name='badge_counters')
+    quizzes_completed = models.IntegerField(default=0)
+    perfect_scores = models.IntegerField(default=0)
+    high_scores = models.IntegerField(default=0)
+    code_battles_completed = models.IntegerField(default=0)
+    streak = models.IntegerField(default=0)
+    level = models.IntegerField(default=1)
+    xp = models.IntegerField(default=0)
+
+    def __str__(self):
+        return f"{self.user.username} badge counters"
+
+class PostGameJob(models.Model):
+    """Game results waiting to be applied by gamification/jobs.py."""
+    STATUS_CHOICES = [
+        ('pending', 'Pending'),
+        ('running', 'Running'),
+        ('done', 'Done'),
+        ('failed', 'Failed'),
+    ]
+    key = models.CharField(max_length=100, unique=True)  # idempotency key, e.g. "battle:42"
+    results = models.JSONField()  # list of GameResult field lists
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='pending')
+    attempts = models.IntegerField(default=0)
+    run_after = models.DateTimeField(default=timezone.now)
+    locked_until = models.DateTimeField(blank=True, null=True)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    finished_at = models.DateTimeField(blank=True, null=True)
+
+    class Meta:
+        indexes = [models.Index(fields=['status', 'run_after'], name='postgame_due_idx')]
+
+    def __str__(self):
+        return f"{self.key} ({self.status})"
+
+class PlayerRating(models.Model):
+    """A player's Glicko-2 rating in one mode, kept by gamification/ratings.py."""
+    MODE_CHOICES = [
+        ('codebattle', 'Code Battle'),
+        ('multiplayer', 'Multiplayer'),
+    ]
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='ratings')
+    mode = models.CharField(max_length=20, choices=MODE_CHOICES)
+    rating = models.FloatField(default=1500.0)
+    deviation = models.FloatField(default=350.0)
+    volatility = models.FloatField(default=0.06)
+    games = models.IntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        constraints = [models.UniqueConstraint(fields=['user', 'mode'], name='rating_user_mode_unique')]
+        indexes = [models.Index(fields=['mode', 'rating'], name='rating_range_idx')]
+
+    def __str__(self):
+        return f"{self.user.username} {self.mode}: {self.rating:.0f}"
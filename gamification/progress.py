@@ -0,0 +1,171 @@
+"""
+One place where finished games turn into progress.
+
+Quiz submissions, coding battles and multiplayer rooms all hand their
+results to ``record_results`` as ``GameResult`` tuples. The whole batch is
+applied in one transaction with a fixed number of queries, however many
+players there are:
+
+* ``UserProgress`` rows are created if missing and updated with ``F()``
+  expressions, one ``CASE`` per column keyed on the user;
+* ``User.total_score``/``xp``/``level`` go up for results marked
+  ``first_completion`` (the first time a user finishes a given quiz);
+* today is marked in each player's activity calendar, which moves their
+  streak (gamification/streaks.py); rows are locked, then bulk updated.
+
+Afterwards the new totals are pushed to the global and windowed
+leaderboards, the profile stats and the badge engine (one batched
+``record_many``). The in-memory parts (leaderboards, cached earned badges,
+response cache versions) are only updated once the surrounding transaction
+commits, so a post-game job that fails and is retried counts everything
+again.
+"""
+from collections import namedtuple
+from datetime import timedelta
+
+from django.db import transaction
+from django.db.models import Case, DurationField, F, FloatField, IntegerField, Value, When
+from django.db.models.functions import Cast
+from django.utils import timezone
+
+from accounts.models import User
+
+from .models import Streak, UserProgress
+from .streaks import STREAK_FIELDS, record_activity
+
+GameResult = namedtuple(
+    'GameResult', 'user_id score mode topic_id total_questions duration first_completion',
+    defaults=(None, None, None, False),
+)
+XP_PER_POINT = 10
+POINTS_PER_LEVEL = 100
+
+
+def session_result(session, first_completion=False):
+    """The ``GameResult`` of a completed quiz ``GameSession``."""
+    duration = session.completed_at - session.started_at if session.completed_at and session.started_at else None
+    return GameResult(
+        session.user_id, session.score, session.mode, session.quiz.topic_id,
+        session.total_questions, duration, first_completion,
+    )
+
+
+def _per_user(values, key='user_id', default=0, output_field=None):
+    # CASE WHEN user_id = ... THEN value ... END, for adding to a column
+    return Case(
+        *[When(**{key: user_id}, then=Value(value)) for user_id, value in values.items()],
+        default=Value(default),
+        output_field=output_field or IntegerField(),
+    )
+
+
+def _level(total):
+    return total / Value(POINTS_PER_LEVEL) + Value(1)
+
+
+def _apply_progress(games, points, durations):
+    UserProgress.objects.bulk_create([UserProgress(user_id=user_id) for user_id in games], ignore_conflicts=True)
+    total = F('total_score') + _per_user(points)
+    completed = F('quizzes_completed') + _per_user(games)
+    updates = {
+        'quizzes_completed': completed,
+        'total_score': total,
+        'average_score': Cast(total, FloatField()) / completed,
+        'xp': F('xp') + _per_user({user_id: score * XP_PER_POINT for user_id, score in points.items()}),
+        'level': _level(total),
+    }
+    if durations:
+        updates['time_spent'] = F('time_spent') + _per_user(
+            durations, default=timedelta(0), output_field=DurationField()
+        )
+    UserProgress.objects.filter(user_id__in=games).update(**updates)
+
+
+def _apply_scores(points):
+    total = F('total_score') + _per_user(points, key='id')
+    User.objects.filter(id__in=points).update(
+        total_score=total,
+        xp=F('xp') + _per_user({user_id: score * XP_PER_POINT for user_id, score in points.items()}, key='id'),
+        level=_level(total),
+    )
+
+
+def _apply_streaks(user_ids):
+    """Mark today active for ``user_ids``. Returns ``{user_id: current_streak}``."""
+    today = timezone.localdate()
+    rows = {}
+    for streak in Streak.objects.select_for_update().filter(user_id__in=user_ids).order_by('id'):
+        rows.setdefault(streak.user_id, streak)  # the oldest row wins, as elsewhere
+    created = [Streak(user_id=user_id) for user_id in user_ids if user_id not in rows]
+    for streak in created:
+        record_activity(streak, today)
+    Streak.objects.bulk_create(created)
+    changed = [streak for streak in rows.values() if record_activity(streak, today)]
+    if changed:
+        Streak.objects.bulk_update(changed, STREAK_FIELDS)
+    return {streak.user_id: streak.current_streak for streak in [*rows.values(), *created]}
+
+
+def record_windows(results):
+    """Count ``results`` towards the windowed leaderboards of this process."""
+    from .windows import record_completion
+
+    for result in results:
+        if result.user_id:
+            record_completion(result.user_id, result.score or 0, result.mode, result.topic_id)
+
+
+def record_results(results, windows=True):
+    """
+    Apply a batch of ``GameResult`` and fan out to leaderboards and badges.
+    ``windows=False`` leaves the windowed boards to the caller (see
+    gamification/jobs.py). Returns ``{user_id: [newly awarded Achievement, ...]}``.
+    """
+    from accounts.stats import set_streaks
+
+    from .leaderboard import update_scores
+    from .rules import get_achievement_engine
+
+    results = [result for result in results if result.user_id]
+    if not results:
+        return {}
+    games, points, durations, first_points, quiz_counters = {}, {}, {}, {}, {}
+    for result in results:
+        user_id, score = result.user_id, result.score or 0
+        games[user_id] = games.get(user_id, 0) + 1
+        points[user_id] = points.get(user_id, 0) + score
+        if result.duration:
+            durations[user_id] = durations.get(user_id, timedelta(0)) + result.duration
+        if result.first_completion:
+            first_points[user_id] = first_points.get(user_id, 0) + score
+        if result.total_questions is not None:
+            counters = quiz_counters.setdefault(user_id, dict.fromkeys(
+                ('quizzes_completed', 'perfect_scores', 'high_scores'), 0
+            ))
+            counters['quizzes_completed'] += 1
+            counters['perfect_scores'] += int(score == result.total_questions)
+            counters['high_scores'] += int(score >= result.total_questions * 0.9)
+
+    with transaction.atomic():
+        _apply_progress(games, points, durations)
+        if first_points:
+            _apply_scores(first_points)
+        streaks = _apply_streaks(list(games))
+        users = {user_id: (total, level, xp) for user_id, total, level, xp in User.objects.filter(
+            id__in=games
+        ).values_list('id', 'total_score', 'level', 'xp')}
+        set_streaks(streaks)
+
+    # In-memory boards and caches only follow once the batch (and any outer transaction) commits
+    scores = [(user_id, users[user_id][0]) for user_id in first_points if user_id in users]
+    transaction.on_commit(lambda: update_scores(scores))
+    if windows:
+        transaction.on_commit(lambda: record_windows(results))
+    return get_achievement_engine().record_many({
+        user_id: (
+            quiz_counters.get(user_id),
+            {'level': users[user_id][1], 'xp': users[user_id][2], 'streak': streaks.get(user_id, 0)},
+        )
+        for user_id in games
+        if user_id in users
+    })
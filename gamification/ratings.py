@@ -0,0 +1,285 @@
+"""
+Glicko-2 skill ratings per player and mode ("codebattle", "multiplayer").
+
+Ratings move with results against opponents rather than with the volume of
+play that ``total_score``/``xp`` reward:
+
+* ``rate_match`` updates the players of one finished game as soon as it is
+  applied (gamification/jobs.py). The game is its own rating period. A
+  multiplayer room counts as a win against every player who scored less and
+  a draw against every tie. A battle's higher score is its winner, as
+  ``CodeBattleConsumer`` decides it. Battles closed by the reaper have no
+  final scores and are never rated.
+* ``recompute`` rebuilds every rating of a mode from history
+  (``manage.py recompute_ratings``), one rating period per
+  ``period_days``. All players of a period are updated at once, with
+  NumPy arrays when it is installed and one player at a time otherwise.
+* ``rating_range`` lists the players of a mode within a rating band, using
+  the ``(mode, rating)`` index. Matchmaking queues players at their rating.
+
+The maths follows Glickman, "Example of the Glicko-2 system" (2013).
+"""
+import itertools
+import math
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from .models import PlayerRating
+
+try:
+    import numpy as np
+except ImportError:  # one player at a time
+    np = None
+
+DEFAULT_RATING = 1500.0
+DEFAULT_DEVIATION = 350.0
+DEFAULT_VOLATILITY = 0.06
+SCALE = 173.7178
+EPSILON = 0.000001
+RATED_MODES = ('codebattle', 'multiplayer')
+
+
+def _tau():
+    return getattr(settings, 'RATING_TAU', 0.5)
+
+
+def _g(phi):
+    return 1 / math.sqrt(1 + 3 * phi * phi / math.pi ** 2)
+
+
+def _volatility(phi, sigma, v, delta, tau):
+    # Illinois iteration for the new volatility (step 5 of the paper)
+    a = math.log(sigma * sigma)
+
+    def f(x):
+        ex = math.exp(x)
+        return ex * (delta * delta - phi * phi - v - ex) / (2 * (phi * phi + v + ex) ** 2) - (x - a) / (tau * tau)
+
+    A = a
+    if delta * delta > phi * phi + v:
+        B = math.log(delta * delta - phi * phi - v)
+    else:
+        k = 1
+        while f(a - k * tau) < 0:
+            k += 1
+        B = a - k * tau
+    fA, fB = f(A), f(B)
+    while abs(B - A) > EPSILON:
+        C = A + (A - B) * fA / (fB - fA)
+        fC = f(C)
+        if fC * fB <= 0:
+            A, fA = B, fB
+        else:
+            fA /= 2
+        B, fB = C, fC
+    return math.exp(A / 2)
+
+
+def glicko2(rating, deviation, volatility, results, tau=None):
+    """
+    One rating period for one player. ``results`` are
+    ``(opponent_rating, opponent_deviation, score)`` with score 1, 0.5 or 0.
+    Returns ``(rating, deviation, volatility)``.
+    """
+    tau = _tau() if tau is None else tau
+    mu, phi = (rating - DEFAULT_RATING) / SCALE, deviation / SCALE
+    if not results:
+        return rating, math.sqrt(phi * phi + volatility * volatility) * SCALE, volatility
+    v_inv = impact = 0.0
+    for opponent_rating, opponent_deviation, score in results:
+        g = _g(opponent_deviation / SCALE)
+        expected = 1 / (1 + math.exp(-g * (mu - (opponent_rating - DEFAULT_RATING) / SCALE)))
+        v_inv += g * g * expected * (1 - expected)
+        impact += g * (score - expected)
+    v = 1 / v_inv
+    sigma = _volatility(phi, volatility, v, v * impact, tau)
+    phi = 1 / math.sqrt(1 / (phi * phi + sigma * sigma) + v_inv)
+    return DEFAULT_RATING + SCALE * (mu + phi * phi * impact), phi * SCALE, sigma
+
+
+def _pairwise(standings):
+    """``(i, j, score of i)`` for every ordered pair of a game's ``(user_id, score)`` standings."""
+    return [
+        (user_id, other_id, 1.0 if score > other_score else 0.5 if score == other_score else 0.0)
+        for (user_id, score), (other_id, other_score) in itertools.permutations(standings, 2)
+        if user_id != other_id
+    ]
+
+
+def rate_match(mode, standings):
+    """Update the ratings of one finished game's ``(user_id, score)`` standings. Returns ``{user_id: rating}``."""
+    standings = [(user_id, score) for user_id, score in standings if user_id]
+    if mode not in RATED_MODES or len({user_id for user_id, _ in standings}) < 2:
+        return {}
+    user_ids = {user_id for user_id, _ in standings}
+    with transaction.atomic():
+        rows = {row.user_id: row for row in PlayerRating.objects.select_for_update().filter(mode=mode, user_id__in=user_ids)}
+        created = [PlayerRating(user_id=user_id, mode=mode) for user_id in user_ids if user_id not in rows]
+        for row in created:
+            rows[row.user_id] = row
+        before = {user_id: (row.rating, row.deviation) for user_id, row in rows.items()}
+        results = {}
+        for user_id, other_id, score in _pairwise(standings):
+            results.setdefault(user_id, []).append((*before[other_id], score))
+        for user_id, row in rows.items():
+            row.rating, row.deviation, row.volatility = glicko2(row.rating, row.deviation, row.volatility, results[user_id])
+            row.games += 1
+        PlayerRating.objects.bulk_create(created)
+        existing = [row for row in rows.values() if row.pk]
+        now = timezone.now()
+        for row in existing:
+            row.updated_at = now  # bulk_update skips pre_save, so auto_now would not
+        PlayerRating.objects.bulk_update(existing, ['rating', 'deviation', 'volatility', 'games', 'updated_at'])
+    return {user_id: row.rating for user_id, row in rows.items()}
+
+
+def get_rating(user_id, mode):
+    """``user_id``'s rating in ``mode`` (the default for unrated players)."""
+    rating = PlayerRating.objects.filter(user_id=user_id, mode=mode).values_list('rating', flat=True).first()
+    return DEFAULT_RATING if rating is None else rating
+
+
+def rating_range(mode, low, high, limit=50):
+    """Up to ``limit`` ratings of ``mode`` between ``low`` and ``high``, lowest first (a range scan of the index)."""
+    return PlayerRating.objects.filter(mode=mode, rating__gte=low, rating__lte=high).order_by('rating')[:limit]
+
+
+# Batch recomputation
+
+
+def _period_python(ratings, deviations, volatilities, games, tau):
+    results = {}
+    for i, j, score in games:
+        results.setdefault(i, []).append((ratings[j], deviations[j], score))
+    updated = [
+        glicko2(ratings[i], deviations[i], volatilities[i], results.get(i, ()), tau)
+        for i in range(len(ratings))
+    ]
+    return [list(column) for column in zip(*updated)] if updated else ([], [], [])
+
+
+def _period_numpy(ratings, deviations, volatilities, games, tau):
+    n = len(ratings)
+    mu = (np.asarray(ratings, dtype=float) - DEFAULT_RATING) / SCALE
+    phi = np.asarray(deviations, dtype=float) / SCALE
+    sigma = np.asarray(volatilities, dtype=float)
+    if len(games):
+        i, j, score = (np.asarray(column) for column in zip(*games))
+        i, j, score = i.astype(int), j.astype(int), score.astype(float)
+        g = 1 / np.sqrt(1 + 3 * phi[j] ** 2 / np.pi ** 2)
+        expected = 1 / (1 + np.exp(-g * (mu[i] - mu[j])))
+        v_inv = np.bincount(i, g * g * expected * (1 - expected), minlength=n)
+        impact = np.bincount(i, g * (score - expected), minlength=n)
+    else:
+        v_inv = impact = np.zeros(n)
+    played = v_inv > 0
+    new_sigma = sigma.copy()
+    if played.any():
+        p_phi, p_sigma = phi[played], sigma[played]
+        v = 1 / v_inv[played]
+        delta = v * impact[played]
+        a = np.log(p_sigma ** 2)
+
+        def f(x):
+            ex = np.exp(x)
+            return ex * (delta ** 2 - p_phi ** 2 - v - ex) / (2 * (p_phi ** 2 + v + ex) ** 2) - (x - a) / tau ** 2
+
+        A = a.copy()
+        big = delta ** 2 > p_phi ** 2 + v
+        B = np.where(big, np.log(np.where(big, delta ** 2 - p_phi ** 2 - v, 1)), a - tau)
+        k = np.ones_like(a)
+        while True:
+            low = ~big & (f(a - k * tau) < 0)
+            if not low.any():
+                break
+            k[low] += 1
+        B = np.where(big, B, a - k * tau)
+        fA, fB = f(A), f(B)
+        active = np.abs(B - A) > EPSILON
+        while active.any():
+            C = A + (A - B) * fA / np.where(active, fB - fA, 1)
+            fC = f(C)
+            swap = active & (fC * fB <= 0)
+            halve = active & ~swap
+            A = np.where(swap, B, A)
+            fA = np.where(swap, fB, np.where(halve, fA / 2, fA))
+            B = np.where(active, C, B)
+            fB = np.where(active, fC, fB)
+            active = np.abs(B - A) > EPSILON
+        new_sigma[played] = np.exp(A / 2)
+    new_phi = np.sqrt(phi ** 2 + new_sigma ** 2)
+    new_phi[played] = 1 / np.sqrt(1 / new_phi[played] ** 2 + v_inv[played])
+    new_mu = mu + np.where(played, new_phi ** 2 * impact, 0)
+    return list(DEFAULT_RATING + SCALE * new_mu), list(new_phi * SCALE), list(new_sigma)
+
+
+def match_history(mode):
+    """``(finished_at, [(user_id, score), ...])`` for every finished game of ``mode``, oldest first."""
+    if mode == 'codebattle':
+        from codebattle.models import Battle
+
+        # Reaped battles (smartquizarena/reaper.py) have no final scores and were never rated
+        battles = Battle.objects.filter(
+            status='completed', player2__isnull=False, completed_at__isnull=False, scores__isnull=False
+        ).order_by('completed_at', 'id').values_list('completed_at', 'player1_id', 'player2_id', 'winner_id')
+        for at, player1_id, player2_id, winner_id in battles.iterator():
+            yield at, [(player1_id, int(winner_id == player1_id)), (player2_id, int(winner_id == player2_id))]
+    elif mode == 'multiplayer':
+        from multiplayer.models import Player
+
+        players = Player.objects.filter(room__quiz_state='finished', room__started_at__isnull=False).order_by(
+            'room__started_at', 'room_id'
+        ).values_list('room_id', 'room__started_at', 'user_id', 'score')
+        for (_, at), rows in itertools.groupby(players.iterator(), key=lambda row: row[:2]):
+            standings = [(user_id, score) for _, _, user_id, score in rows]
+            if len(standings) > 1:
+                yield at, standings
+
+
+def recompute(mode, period_days=1, use_numpy=None, batch_size=1000):
+    """Rebuild every ``mode`` rating from ``match_history``. Returns the number of players rated."""
+    use_numpy = np is not None if use_numpy is None else use_numpy and np is not None
+    step = _period_numpy if use_numpy else _period_python
+    tau = _tau()
+    index, user_ids, games_played = {}, [], []
+    ratings, deviations, volatilities = [], [], []
+    period, games = None, []
+
+    def close_period():
+        nonlocal ratings, deviations, volatilities
+        if period is not None:
+            ratings, deviations, volatilities = step(ratings, deviations, volatilities, games, tau)
+
+    for at, standings in match_history(mode):
+        current = at.toordinal() // period_days
+        if current != period:
+            close_period()
+            period, games = current, []
+        for user_id, _ in standings:
+            if user_id not in index:
+                index[user_id] = len(user_ids)
+                user_ids.append(user_id)
+                games_played.append(0)
+                ratings.append(DEFAULT_RATING)
+                deviations.append(DEFAULT_DEVIATION)
+                volatilities.append(DEFAULT_VOLATILITY)
+            games_played[index[user_id]] += 1
+        games.extend((index[i], index[j], score) for i, j, score in _pairwise(standings))
+    close_period()
+
+    with transaction.atomic():
+        PlayerRating.objects.filter(mode=mode).exclude(user_id__in=user_ids).delete()
+        PlayerRating.objects.bulk_create(
+            [
+                PlayerRating(
+                    user_id=user_id, mode=mode, rating=float(ratings[i]), deviation=float(deviations[i]),
+                    volatility=float(volatilities[i]), games=games_played[i],
+                )
+                for i, user_id in enumerate(user_ids)
+            ],
+            batch_size=batch_size, update_conflicts=True, unique_fields=['user', 'mode'],
+            update_fields=['rating', 'deviation', 'volatility', 'games', 'updated_at'],
+        )
+    return len(user_ids)
@@ -0,0 +1,278 @@
+"""
+Event-driven badge awarding.
+
+Badge criteria are indexed by the counter they read, e.g.
+``{"quizzes_completed": 10}`` is filed under ``quizzes_completed`` with a
+threshold of 10 (``perfect_score``/``high_score`` flags mean "at least
+one"). A badge with several criteria is earned when any of them is met, as
+before.
+
+Each user's counters live in one ``BadgeCounters`` row. An event
+(``record``) applies increments and new values to that row and only looks at
+the badges filed under counters that went up, picking the thresholds that
+were crossed with a binary search. The first time a user is seen their
+counters are computed from their history and every badge is checked once.
+Live events must count exactly what that history does: for example
+``code_battles_completed`` is the number of accepted ``Submission`` rows, and
+it goes up whenever a submission becomes accepted (``_submission_saved``),
+whichever code path saved it.
+
+The badges a user already holds are loaded once into a per-process set, so
+an event that crosses no new threshold costs no badge queries at all.
+"""
+import threading
+import time
+from bisect import bisect_right
+from collections import OrderedDict
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, F, Q
+from django.db.models.signals import post_delete, post_init, post_save
+
+from accounts.models import User
+from smartquizarena.cache import invalidate_on
+
+from .models import Achievement, Badge, BadgeCounters, Streak
+
+# criteria key -> BadgeCounters field
+CRITERIA_COUNTERS = {
+    'quizzes_completed': 'quizzes_completed',
+    'perfect_score': 'perfect_scores',
+    'high_score': 'high_scores',
+    'streak': 'streak',
+    'level': 'level',
+    'xp': 'xp',
+    'code_battles_completed': 'code_battles_completed',
+}
+COUNTERS = tuple(CRITERIA_COUNTERS.values())
+
+
+def _threshold(value):
+    # True (a flag) means "at least once"
+    return 1 if value is True else int(value)
+
+
+class BadgeIndex:
+    """Badges filed by counter, sorted by threshold."""
+
+    def __init__(self, badges):
+        self.badges = {badge.pk: badge for badge in badges}
+        rules = {}
+        for badge in self.badges.values():
+            for key, value in (badge.criteria or {}).items():
+                counter = CRITERIA_COUNTERS.get(key)
+                if counter is not None and value not in (None, False):
+                    rules.setdefault(counter, []).append((_threshold(value), badge.pk))
+        self._thresholds = {}
+        self._badge_ids = {}
+        for counter, entries in rules.items():
+            entries.sort()
+            self._thresholds[counter] = [threshold for threshold, _ in entries]
+            self._badge_ids[counter] = [badge_id for _, badge_id in entries]
+
+    def reached(self, counter, old, new):
+        """Badges whose threshold on ``counter`` lies in ``(old, new]``."""
+        thresholds = self._thresholds.get(counter)
+        if not thresholds or new <= old:
+            return []
+        return self._badge_ids[counter][bisect_right(thresholds, old):bisect_right(thresholds, new)]
+
+    def all_reached(self, counters):
+        return [
+            badge_id
+            for counter in self._thresholds
+            for badge_id in self.reached(counter, float('-inf'), counters.get(counter, 0))
+        ]
+
+
+def session_counters():
+    """Aggregates over completed ``GameSession`` rows that feed the session counters."""
+    return {
+        'quizzes_completed': Count('id'),
+        'perfect_scores': Count('id', filter=Q(score=F('total_questions'))),
+        'high_scores': Count('id', filter=Q(score__gte=F('total_questions') * 0.9)),
+    }
+
+
+def seed_counters(user_id):
+    """A user's counters computed from their history (used once per user)."""
+    from codebattle.models import Submission
+    from quizzes.models import GameSession
+
+    sessions = GameSession.objects.filter(user_id=user_id, completed_at__isnull=False).aggregate(**session_counters())
+    user = User.objects.only('level', 'xp').get(pk=user_id)
+    streak = Streak.objects.filter(user_id=user_id).order_by('id').values_list('current_streak', flat=True).first()
+    return {
+        **sessions,
+        'code_battles_completed': Submission.objects.filter(user_id=user_id, status='accepted').count(),
+        'streak': streak or 0,
+        'level': user.level,
+        'xp': user.xp,
+    }
+
+
+class AchievementEngine:
+    def __init__(self, max_users=10000, index_ttl=300, clock=time.monotonic):
+        self.max_users = max_users
+        self.index_ttl = index_ttl
+        self.clock = clock
+        self._index = None
+        self._index_built = 0
+        self._earned = OrderedDict()  # user_id -> set of badge ids, LRU
+        self._lock = threading.Lock()
+
+    def index(self):
+        with self._lock:
+            if self._index is None or self.clock() - self._index_built > self.index_ttl:
+                self._index = BadgeIndex(Badge.objects.all())
+                self._index_built = self.clock()
+            return self._index
+
+    def invalidate_index(self):
+        with self._lock:
+            self._index = None
+
+    def earned(self, user_id):
+        with self._lock:
+            earned = self._earned.get(user_id)
+            if earned is not None:
+                self._earned.move_to_end(user_id)
+                return earned
+        earned = set(Achievement.objects.filter(user_id=user_id).values_list('badge_id', flat=True))
+        with self._lock:
+            self._earned[user_id] = earned
+            while len(self._earned) > self.max_users:
+                self._earned.popitem(last=False)
+        return earned
+
+    def forget(self, user_id):
+        with self._lock:
+            self._earned.pop(user_id, None)
+
+    def _mark_earned(self, user_id, badge_ids):
+        with self._lock:
+            earned = self._earned.get(user_id)
+            if earned is not None:
+                earned.update(badge_ids)
+
+    def _award(self, user_id, badge_ids):
+        index = self.index()
+        earned = self.earned(user_id)
+        awarded, held = [], []
+        for badge_id in dict.fromkeys(badge_ids):
+            if badge_id in earned or badge_id not in index.badges:
+                continue
+            achievement, created = Achievement.objects.get_or_create(user_id=user_id, badge=index.badges[badge_id])
+            held.append(badge_id)
+            if created:
+                awarded.append(achievement)
+        if held:
+            # Only cache rows that were committed: a rolled-back event must award them again
+            transaction.on_commit(lambda: self._mark_earned(user_id, held))
+        return awarded
+
+    def record(self, user_id, increments=None, values=None):
+        """
+        Apply an event to ``user_id``'s counters and award what it unlocks.
+
+        ``increments`` adds to counters, ``values`` sets them (only rises
+        are checked). Returns the newly created ``Achievement`` rows.
+        """
+        return self.record_many({user_id: (increments, values)}).get(user_id, [])
+
+    def record_many(self, events):
+        """
+        ``record`` for several users at once, given ``{user_id: (increments, values)}``:
+        one locking read and one bulk update. Returns ``{user_id: [Achievement, ...]}``.
+        """
+        seeded, changes = {}, {}
+        with transaction.atomic():
+            rows = {row.user_id: row for row in BadgeCounters.objects.select_for_update().filter(user_id__in=events)}
+            for user_id, (increments, values) in events.items():
+                counters = rows.get(user_id)
+                if counters is None:
+                    # First event for this user: start from their history and check every badge
+                    seeded[user_id] = BadgeCounters.objects.create(user_id=user_id, **seed_counters(user_id))
+                    continue
+                changed = {}
+                for name, amount in (increments or {}).items():
+                    if amount:
+                        changed[name] = (getattr(counters, name), getattr(counters, name) + amount)
+                for name, value in (values or {}).items():
+                    if value != getattr(counters, name):
+                        changed[name] = (getattr(counters, name), value)
+                for name, (_, new) in changed.items():
+                    setattr(counters, name, new)
+                if changed:
+                    changes[user_id] = changed
+            fields = {name for changed in changes.values() for name in changed}
+            if fields:
+                BadgeCounters.objects.bulk_update([rows[user_id] for user_id in changes], list(fields))
+        index = self.index()
+        awarded = {}
+        for user_id, row in seeded.items():
+            awarded[user_id] = self._award(user_id, index.all_reached({name: getattr(row, name) for name in COUNTERS}))
+        for user_id, changed in changes.items():
+            awarded[user_id] = self._award(user_id, [
+                badge_id for name, (old, new) in changed.items() for badge_id in index.reached(name, old, new)
+            ])
+        return awarded
+
+    def reevaluate(self, user_id):
+        """Recompute ``user_id``'s counters from their history and award anything missing."""
+        counters = seed_counters(user_id)
+        BadgeCounters.objects.update_or_create(user_id=user_id, defaults=counters)
+        self.forget(user_id)
+        return self._award(user_id, self.index().all_reached(counters))
+
+
+_engine = None
+
+
+def get_achievement_engine():
+    global _engine
+    if _engine is None:
+        _engine = AchievementEngine(
+            max_users=getattr(settings, 'ACHIEVEMENT_CACHE_USERS', 10000),
+            index_ttl=getattr(settings, 'BADGE_INDEX_TTL', 300),
+        )
+    return _engine
+
+
+def _badges_changed(sender, **kwargs):
+    if _engine is not None:
+        _engine.invalidate_index()
+
+
+def _achievement_deleted(sender, instance, **kwargs):
+    if _engine is not None:
+        _engine.forget(instance.user_id)
+
+
+def _streak_saved(sender, instance, **kwargs):
+    # Only users already tracked; the first event seeds the streak anyway
+    if BadgeCounters.objects.filter(user_id=instance.user_id).exclude(streak=instance.current_streak).exists():
+        get_achievement_engine().record(instance.user_id, values={'streak': instance.current_streak})
+
+
+def _submission_loaded(sender, instance, **kwargs):
+    instance._accepted_at_load = instance.status == 'accepted'
+
+
+def _submission_saved(sender, instance, created, **kwargs):
+    # Count the same thing seed_counters does: submissions that are accepted
+    accepted = instance.status == 'accepted'
+    newly_accepted = accepted and (created or not instance._accepted_at_load)
+    instance._accepted_at_load = accepted
+    if newly_accepted:
+        get_achievement_engine().record(instance.user_id, increments={'code_battles_completed': 1})
+
+
+invalidate_on('badges', Badge)
+post_save.connect(_badges_changed, sender=Badge)
+post_delete.connect(_badges_changed, sender=Badge)
+post_delete.connect(_achievement_deleted, sender=Achievement)
+post_save.connect(_streak_saved, sender=Streak)
+post_init.connect(_submission_loaded, sender='codebattle.Submission')
+post_save.connect(_submission_saved, sender='codebattle.Submission')
@@ -26,4 +26,4 @@ class LeaderboardSerializer(serializers.Serializer):
 class StreakSerializer(serializers.ModelSerializer):
     class Meta:
         model = Streak
-        fields = '__all__'
+        exclude = ('activity_since', 'activity_days')
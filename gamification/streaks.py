@@ -0,0 +1,107 @@
+"""
+Streaks computed from an activity calendar.
+
+Each ``Streak`` row carries a bitset of the days its user was active:
+``activity_days`` holds bit ``i`` for the day ``activity_since + i``, eight
+days a byte, so a year of history is 46 bytes.
+
+``record_activity`` marks a day and updates ``current_streak`` and
+``longest_streak`` incrementally. A day after the last active one costs
+O(1). Only a day recorded out of order (earlier than ``last_activity``)
+re-reads the calendar around it.
+
+Reads never decay a streak. Instead ``rollover`` (run nightly with
+``manage.py rollover_streaks``) resets every streak whose last active day
+is before yesterday, with one set-based UPDATE per table that mirrors the
+streak.
+"""
+from datetime import timedelta
+
+from django.db import transaction
+from django.utils import timezone
+
+from .models import BadgeCounters, Streak
+
+ONE_DAY = timedelta(days=1)
+STREAK_FIELDS = ['current_streak', 'longest_streak', 'last_activity', 'activity_since', 'activity_days']
+
+
+class ActivityCalendar:
+    """A set of days stored as a bitset starting at ``since``."""
+
+    def __init__(self, since=None, days=b''):
+        self.since = since
+        self.bits = int.from_bytes(bytes(days or b''), 'little')
+
+    def __bytes__(self):
+        return self.bits.to_bytes((self.bits.bit_length() + 7) // 8, 'little')
+
+    def __contains__(self, day):
+        return self.since is not None and day >= self.since and bool(self.bits >> (day - self.since).days & 1)
+
+    def mark(self, day):
+        """Mark ``day`` active. Returns False if it already was."""
+        if self.since is None:
+            self.since = day
+        elif day < self.since:
+            self.bits <<= (self.since - day).days
+            self.since = day
+        bit = 1 << (day - self.since).days
+        if self.bits & bit:
+            return False
+        self.bits |= bit
+        return True
+
+    def run_through(self, day):
+        """``(start, end)`` of the run of consecutive active days containing ``day``."""
+        start = end = day
+        while start - ONE_DAY in self:
+            start -= ONE_DAY
+        while end + ONE_DAY in self:
+            end += ONE_DAY
+        return start, end
+
+    def longest_run(self):
+        bits, length = self.bits, 0
+        while bits:
+            bits &= bits >> 1
+            length += 1
+        return length
+
+
+def record_activity(streak, day=None):
+    """Count ``day`` (default today) as active for ``streak``, unsaved. Returns False if it already was."""
+    day = day or timezone.localdate()
+    calendar = ActivityCalendar(streak.activity_since, streak.activity_days)
+    if not calendar.mark(day):
+        return False
+    last = streak.last_activity
+    if last is None or day > last:
+        streak.current_streak = streak.current_streak + 1 if last == day - ONE_DAY else 1
+        streak.last_activity = day
+        run = streak.current_streak
+    elif day == last:
+        # Active today from before the calendar existed
+        run = streak.current_streak = max(streak.current_streak, 1)
+    else:
+        # A late day may join runs together
+        start, end = calendar.run_through(day)
+        run = (end - start).days + 1
+        if end == last:
+            streak.current_streak = max(streak.current_streak, run)
+    streak.longest_streak = max(streak.longest_streak, run)
+    streak.activity_since, streak.activity_days = calendar.since, bytes(calendar)
+    return True
+
+
+def rollover(today=None):
+    """Reset streaks not extended yesterday or today. Returns how many were reset."""
+    from accounts.models import UserStats
+
+    today = today or timezone.localdate()
+    broken = Streak.objects.filter(current_streak__gt=0, last_activity__lt=today - ONE_DAY)
+    with transaction.atomic():
+        broken_users = broken.values('user_id')
+        UserStats.objects.filter(current_streak__gt=0, user_id__in=broken_users).update(current_streak=0)
+        BadgeCounters.objects.filter(streak__gt=0, user_id__in=broken_users).update(streak=0)
+        return broken.update(current_streak=0)
@@ -1,6 +1,19 @@
-from django.test import TestCase
+import random
+import threading
+import unittest
+from unittest import mock
+from django.test import SimpleTestCase, TestCase, override_settings
 from accounts.models import User
-from .models import UserProgress, Streak
+from .leaderboard import InMemoryLeaderboard, OrderStatisticSkipList, RedisLeaderboard, get_leaderboard, reset_leaderboard
+from .jobs import enqueue, run_job, run_pending
+from .models import Achievement, Badge, PlayerRating, PostGameJob, UserProgress, Streak
+from .progress import GameResult
+from .ratings import get_rating, glicko2, np, rating_range, recompute
+from .rules import AchievementEngine
+from .windows import (
+    DAY, HOUR, InMemoryWindowedLeaderboards, RedisWindowedLeaderboards, get_windowed_leaderboards,
+    reset_windowed_leaderboards,
+)
 from .serializers import LeaderboardSerializer
 from .views import LeaderboardView
 from rest_framework.test import APIRequestFactory
@@ -8,6 +21,11 @@ from rest_framework import status
 from django.urls import reverse
 from rest_framework.test import APITestCase
 
+try:
+    import fakeredis
+except ImportError:
+    fakeredis = None
+
 
 class UserProgressTestCase(TestCase):
     def setUp(self):
@@ -62,3 +80,542 @@ class LeaderboardViewTestCase(APITestCase):
         self.assertEqual(data[0]['total_score'], 200)
         self.assertEqual(data[1]['username'], 'user1')
         self.assertEqual(data[1]['total_score'], 100)
+
+
+class LeaderboardEngineTestCase(SimpleTestCase):
+    def expected_ranks(self, scores):
+        return {user_id: sum(other > score for other in scores.values()) + 1 for user_id, score in scores.items()}
+
+    def check_board(self, board, scores):
+        ranks = self.expected_ranks(scores)
+        ordered = sorted(scores.items(), key=lambda item: (-item[1], item[0]))
+        top = board.top(10)
+        self.assertEqual([entry.score for entry in top], [score for _, score in ordered[:10]])
+        self.assertEqual([entry.rank for entry in top], [ranks[entry.user_id] for entry in top])
+        for user_id in random.Random(3).sample(sorted(scores), 20):
+            self.assertEqual(board.rank(user_id), ranks[user_id])
+            window = board.around(user_id, 2)
+            self.assertIn(user_id, [entry.user_id for entry in window])
+            self.assertTrue(all(entry.rank == ranks[entry.user_id] for entry in window))
+
+    def test_skip_list_positions(self):
+        rng = random.Random(1)
+        skip_list, reference = OrderStatisticSkipList(rng=rng), []
+        for _ in range(2000):
+            key = rng.randrange(500)
+            if key in reference and rng.random() < 0.5:
+                self.assertTrue(skip_list.remove(key))
+                reference.remove(key)
+            else:
+                skip_list.insert(key)
+                reference.append(key)
+        reference.sort()
+        self.assertEqual(len(skip_list), len(reference))
+        self.assertEqual(skip_list.slice(0, len(reference)), reference)
+        self.assertEqual(skip_list.slice(100, 110), reference[100:110])
+        self.assertEqual(skip_list.count_less(250), sum(key < 250 for key in reference))
+        self.assertFalse(skip_list.remove(-1))
+
+    def test_in_memory_leaderboard_tracks_updates(self):
+        rng = random.Random(2)
+        scores = {user_id: rng.randrange(50) * 10 for user_id in range(1, 301)}
+        board = InMemoryLeaderboard(rng=rng)
+        board.load(scores.items())
+        for user_id in rng.sample(sorted(scores), 100):
+            scores[user_id] += rng.randrange(1, 5) * 10
+            board.update(user_id, scores[user_id])
+        board.remove(1)
+        del scores[1]
+        self.assertEqual(len(board), len(scores))
+        self.assertIsNone(board.rank(1))
+        self.check_board(board, scores)
+
+    @unittest.skipIf(fakeredis is None, "fakeredis is not installed")
+    def test_redis_leaderboard_matches(self):
+        rng = random.Random(4)
+        scores = {user_id: rng.randrange(50) * 10 for user_id in range(1, 301)}
+        board = RedisLeaderboard(fakeredis.FakeRedis())
+        board.load(scores.items())
+        board.update(7, 1000)
+        scores[7] = 1000
+        self.assertTrue(board.loaded)
+        self.assertEqual(board.top(1)[0].user_id, 7)
+        self.check_board(board, scores)
+
+
+class LeaderboardPageTestCase(TestCase):
+    def setUp(self):
+        reset_leaderboard()
+        self.addCleanup(reset_leaderboard)
+        for i in range(12):
+            User.objects.create_user(username=f'player{i}', password='pass', total_score=i * 10)
+
+    def test_page_and_rank_use_constant_queries(self):
+        self.client.get(reverse('leaderboard'))  # loads the board and caches the top rows
+        with self.assertNumQueries(0):
+            response = self.client.get(reverse('leaderboard'))
+        self.assertEqual(response.context['leaderboard'][0]['username'], 'player11')
+
+        user = User.objects.get(username='player3')
+        user.total_score = 500
+        user.save()
+        # The score change invalidates the cached rows
+        with self.assertNumQueries(2):
+            response = self.client.get(reverse('leaderboard'))
+        self.assertEqual(response.context['leaderboard'][0]['username'], 'player3')
+        self.client.force_login(user)
+        data = self.client.get(reverse('gamification_api:leaderboard-rank') + '?radius=1').json()
+        self.assertEqual(data['rank'], 1)
+        self.assertEqual(data['total_users'], 12)
+        self.assertEqual([row['username'] for row in data['around']], ['player3', 'player11'])
+
+    @override_settings(LEADERBOARD_RELOAD_INTERVAL=60)
+    def test_board_picks_up_other_processes_after_reload_interval(self):
+        board = get_leaderboard()
+        now = [0]
+        board.clock = lambda: now[0]
+        board.load(User.objects.values_list('id', 'total_score'))
+        user = User.objects.get(username='player3')
+        # A post-game worker process writes scores without this process's signals
+        User.objects.filter(pk=user.pk).update(total_score=500)
+        self.assertEqual(get_leaderboard().rank(user.pk), 9)
+        now[0] = 61
+        self.assertEqual(get_leaderboard().rank(user.pk), 1)
+
+
+class WindowedLeaderboardTestCase(SimpleTestCase):
+    def test_scores_roll_off_expired_buckets(self):
+        now = [10 * DAY]
+        boards = InMemoryWindowedLeaderboards(clock=lambda: now[0])
+        boards.record(1, 50, 'single', 3, at=now[0] - 2 * HOUR)
+        boards.record(2, 30, 'codebattle', at=now[0] - 3 * DAY)
+        boards.record(2, 40, 'codebattle', at=now[0])
+        boards.record(3, 10, 'multiplayer', 3, at=now[0] - 40 * DAY)  # outside every window
+
+        self.assertEqual([(e.user_id, e.score) for e in boards.board('daily').top(5)], [(1, 50), (2, 40)])
+        self.assertEqual([(e.user_id, e.score) for e in boards.board('weekly').top(5)], [(2, 70), (1, 50)])
+        self.assertEqual([e.user_id for e in boards.board('monthly', 'topic:3').top(5)], [1])
+        self.assertEqual([e.user_id for e in boards.board('weekly', 'mode:codebattle').top(5)], [2])
+
+        now[0] += 23 * HOUR
+        self.assertEqual([e.user_id for e in boards.board('daily').top(5)], [2])
+        now[0] += 6 * DAY
+        self.assertEqual([(e.user_id, e.score) for e in boards.board('weekly').top(5)], [(2, 40)])
+        self.assertEqual(boards.board('monthly').rank(1), 2)
+
+    @unittest.skipIf(fakeredis is None, "fakeredis is not installed")
+    def test_redis_windows_union_buckets(self):
+        now = [21000 * DAY]  # in the future: buckets expire in real time
+        boards = RedisWindowedLeaderboards(fakeredis.FakeRedis(), clock=lambda: now[0])
+        boards.record(1, 50, 'single', 3, at=now[0] - 2 * HOUR)
+        boards.record(2, 30, 'codebattle', at=now[0] - 3 * DAY)
+        boards.record(2, 40, 'codebattle', at=now[0])
+        self.assertEqual([(e.user_id, e.score) for e in boards.board('weekly').top(5)], [(2, 70), (1, 50)])
+        self.assertEqual([e.user_id for e in boards.board('daily', 'topic:3').top(5)], [1])
+
+
+class WindowedLeaderboardViewTestCase(TestCase):
+    def setUp(self):
+        reset_windowed_leaderboards()
+        self.addCleanup(reset_windowed_leaderboards)
+        from django.utils import timezone
+        from quizzes.models import GameSession, Quiz, Topic
+        topic = Topic.objects.create(name='Space')
+        self.users = [User.objects.create_user(username=f'window{i}', password='pass') for i in range(3)]
+        quiz = Quiz.objects.create(title='Planets', topic=topic, created_by=self.users[0])
+        for i, user in enumerate(self.users):
+            GameSession.objects.create(user=user, quiz=quiz, score=10 * (i + 1), mode='single', completed_at=timezone.now())
+        self.topic = topic
+        self.client.force_login(self.users[0])
+
+    def test_paginated_window_api(self):
+        url = reverse('gamification_api:windowed-leaderboard', args=['weekly'])
+        data = self.client.get(url, {'topic': self.topic.id, 'limit': 2}).json()
+        self.assertEqual(data['count'], 3)
+        self.assertEqual(data['next_offset'], 2)
+        self.assertEqual([row['username'] for row in data['results']], ['window2', 'window1'])
+        self.assertEqual(data['my_rank'], 3)
+
+        data = self.client.get(url, {'mode': 'single', 'offset': 2}).json()
+        self.assertEqual([row['rank'] for row in data['results']], [3])
+        self.assertIsNone(data['next_offset'])
+        self.assertEqual(self.client.get(url, {'mode': 'arcade'}).status_code, 400)
+        self.assertEqual(self.client.get(reverse('gamification_api:windowed-leaderboard', args=['yearly'])).status_code, 404)
+
+    def test_finished_rooms_warm_the_multiplayer_board(self):
+        from django.utils import timezone
+        from multiplayer.models import Player, Room
+        room = Room.objects.create(
+            name='Finals', topic=self.topic, host=self.users[0], quiz_state='finished', started_at=timezone.now()
+        )
+        Player.objects.create(room=room, user=self.users[0], score=70)
+        Player.objects.create(room=room, user=self.users[1], score=40)
+        data = self.client.get(reverse('gamification_api:windowed-leaderboard', args=['daily']), {'mode': 'multiplayer'}).json()
+        self.assertEqual([(row['username'], row['total_score']) for row in data['results']], [('window0', 70), ('window1', 40)])
+
+    def test_concurrent_first_requests_load_once(self):
+        barrier = threading.Barrier(4)
+        boards = []
+
+        def first_request():
+            barrier.wait()
+            boards.append(get_windowed_leaderboards())
+
+        events = [(user.id, 10, 'single', self.topic.id, None) for user in self.users]
+        with mock.patch('gamification.windows.recent_completions', return_value=events) as recent:
+            threads = [threading.Thread(target=first_request) for _ in range(4)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        self.assertEqual(recent.call_count, 1)
+        self.assertEqual(len({id(board) for board in boards}), 1)
+        self.assertEqual([entry.score for entry in boards[0].board('weekly').top(5)], [10, 10, 10])
+
+
+class AchievementRulesTestCase(TestCase):
+    def setUp(self):
+        from django.utils import timezone
+        from quizzes.models import GameSession, Quiz, Topic
+        self.user = User.objects.create_user(username='collector', password='pass')
+        self.badges = {
+            name: Badge.objects.create(name=name, description=name, criteria=criteria)
+            for name, criteria in [
+                ('first', {'quizzes_completed': 1}),
+                ('third', {'quizzes_completed': 3}),
+                ('perfect', {'perfect_score': True}),
+                ('streak', {'streak': 3}),
+                ('xp', {'xp': 500}),
+            ]
+        }
+        quiz = Quiz.objects.create(title='Rules', topic=Topic.objects.create(name='Logic'), created_by=self.user)
+        GameSession.objects.create(user=self.user, quiz=quiz, score=3, total_questions=5, mode='single', completed_at=timezone.now())
+        self.engine = AchievementEngine()
+
+    def earned(self):
+        return set(Achievement.objects.filter(user=self.user).values_list('badge__name', flat=True))
+
+    def test_first_event_seeds_counters_from_history(self):
+        awarded = self.engine.record(self.user.id, increments={'quizzes_completed': 1})
+        self.assertEqual({achievement.badge.name for achievement in awarded}, {'first'})
+
+    def test_only_crossed_thresholds_are_checked(self):
+        self.engine.record(self.user.id)
+        # Nothing crossed: lock the counters row and update it, no badge queries
+        with self.assertNumQueries(4):
+            self.assertEqual(self.engine.record(self.user.id, increments={'quizzes_completed': 1}), [])
+        awarded = self.engine.record(self.user.id, increments={'quizzes_completed': 1, 'perfect_scores': 1}, values={'xp': 600})
+        self.assertEqual({achievement.badge.name for achievement in awarded}, {'third', 'perfect', 'xp'})
+        self.assertEqual(self.engine.record(self.user.id, values={'xp': 700}), [])
+        self.assertEqual(self.earned(), {'first', 'third', 'perfect', 'xp'})
+
+    def test_streak_saves_award_streak_badges(self):
+        from .rules import get_achievement_engine
+        get_achievement_engine().forget(self.user.id)  # ids can repeat across tests
+        get_achievement_engine().record(self.user.id)
+        Streak.objects.create(user=self.user, current_streak=3)
+        self.assertIn('streak', self.earned())
+
+    def test_accepted_submissions_award_battle_badges(self):
+        from codebattle.models import Challenge, Submission
+        from .models import BadgeCounters
+        from .rules import get_achievement_engine, seed_counters
+        Badge.objects.create(name='coder', description='coder', criteria={'code_battles_completed': 2})
+        self.addCleanup(get_achievement_engine().invalidate_index)  # the badge is rolled back
+        get_achievement_engine().forget(self.user.id)
+        get_achievement_engine().record(self.user.id)  # counters exist, so only live events count
+        challenge = Challenge.objects.create(title='Sum', description='', problem_statement='', test_cases=[])
+
+        Submission.objects.create(user=self.user, challenge=challenge, code='', language='python', status='accepted')
+        pending = Submission.objects.create(user=self.user, challenge=challenge, code='', language='python')
+        Submission.objects.create(user=self.user, challenge=challenge, code='', language='python', status='wrong_answer')
+        self.assertNotIn('coder', self.earned())
+
+        pending.status = 'accepted'
+        pending.save()
+        pending.save()  # already counted
+        self.assertIn('coder', self.earned())
+        counters = BadgeCounters.objects.get(user=self.user)
+        self.assertEqual(counters.code_battles_completed, 2)
+        self.assertEqual(counters.code_battles_completed, seed_counters(self.user.id)['code_battles_completed'])
+
+
+class BackfillAchievementsTestCase(TestCase):
+    def test_backfill_is_chunked_and_idempotent(self):
+        import io
+        import os
+        import tempfile
+        from django.core.management import call_command
+        from django.utils import timezone
+        from quizzes.models import GameSession, Quiz, Topic
+        from .models import BadgeCounters
+
+        first = Badge.objects.create(name='first', description='', criteria={'quizzes_completed': 1})
+        Badge.objects.create(name='streaky', description='', criteria={'streak': 3})
+        users = [User.objects.create_user(username=f'backfill{i}', password='pass') for i in range(5)]
+        quiz = Quiz.objects.create(title='Backfill', topic=Topic.objects.create(name='History'), created_by=users[0])
+        for user in users[:3]:
+            GameSession.objects.create(user=user, quiz=quiz, score=1, total_questions=2, mode='single', completed_at=timezone.now())
+        Streak.objects.create(user=users[4], current_streak=5)
+        Achievement.objects.create(user=users[0], badge=first)
+
+        with tempfile.TemporaryDirectory() as directory:
+            checkpoint = os.path.join(directory, 'progress')
+            out = io.StringIO()
+            call_command('backfill_achievements', chunk_size=2, checkpoint=checkpoint, stdout=out)
+            self.assertIn('Backfill complete: 3 badges awarded to 5 users', out.getvalue())
+            with open(checkpoint) as progress:
+                self.assertEqual(int(progress.read()), users[-1].id)
+
+            out = io.StringIO()
+            call_command('backfill_achievements', checkpoint=checkpoint, stdout=out)
+            self.assertIn('0 badges awarded to 0 users', out.getvalue())
+
+        self.assertEqual(Achievement.objects.count(), 4)
+        self.assertEqual(BadgeCounters.objects.get(user=users[4]).streak, 5)
+        self.assertEqual(BadgeCounters.objects.get(user=users[1]).quizzes_completed, 1)
+
+
+class ProgressPipelineTestCase(TestCase):
+    def setUp(self):
+        from gamification.rules import get_achievement_engine
+        self.players = [User.objects.create_user(username=f'racer{i}', password='pass') for i in range(10)]
+        for player in self.players:
+            get_achievement_engine().forget(player.id)
+        reset_leaderboard()
+
+    def test_room_of_ten_in_a_fixed_number_of_queries(self):
+        from gamification.progress import GameResult, record_results
+        results = [GameResult(player.id, 10 * i, 'multiplayer', None) for i, player in enumerate(self.players)]
+        record_results(results)  # first event seeds every player's badge counters
+        # progress (2), streaks (1, none due again today), users (1), profile streaks (1), badge counters (1),
+        # savepoints (4)
+        with self.assertNumQueries(10):
+            record_results(results)
+
+        progress = UserProgress.objects.get(user=self.players[3])
+        self.assertEqual((progress.quizzes_completed, progress.total_score, progress.xp, progress.level), (2, 60, 600, 1))
+        self.assertEqual(progress.average_score, 30.0)
+        streak = Streak.objects.get(user=self.players[3])
+        self.assertEqual((streak.current_streak, streak.longest_streak), (1, 1))  # once a day
+
+    def test_first_completion_moves_the_leaderboard_and_streak_rolls_over(self):
+        from datetime import timedelta
+        from django.utils import timezone
+        from gamification.leaderboard import get_leaderboard
+        from gamification.progress import GameResult, record_results
+        leader, other = self.players[:2]
+        Streak.objects.create(user=leader, current_streak=4, longest_streak=4)
+        Streak.objects.filter(user=leader).update(last_activity=timezone.localdate() - timedelta(days=1))
+        board = get_leaderboard()
+
+        with self.captureOnCommitCallbacks(execute=True):
+            record_results([
+                GameResult(leader.id, 150, 'single', None, 150, first_completion=True),
+                GameResult(other.id, 90, 'single', None, 100),
+            ])
+        leader.refresh_from_db()
+        self.assertEqual((leader.total_score, leader.xp, leader.level), (150, 1500, 2))
+        self.assertEqual(User.objects.get(pk=other.pk).total_score, 0)
+        self.assertEqual(board.rank(leader.id), 1)
+        self.assertEqual(Streak.objects.get(user=leader).current_streak, 5)
+
+
+class PostGameJobTestCase(TestCase):
+    def setUp(self):
+        self.players = [User.objects.create_user(username=f'finisher{i}', password='pass') for i in range(2)]
+        self.results = [GameResult(player.id, 30, 'codebattle') for player in self.players]
+
+    def test_jobs_are_idempotent_and_applied_once(self):
+        job_id = enqueue('battle:1', self.results)
+        self.assertIsNone(enqueue('battle:1', self.results))
+        self.assertFalse(UserProgress.objects.exists())
+
+        self.assertEqual(run_pending(), 1)
+        self.assertEqual(run_pending(), 0)
+        self.assertFalse(run_job(job_id))
+        self.assertEqual(PostGameJob.objects.get(pk=job_id).status, 'done')
+        self.assertEqual(UserProgress.objects.get(user=self.players[0]).quizzes_completed, 1)
+
+    def test_failures_are_retried_then_given_up(self):
+        from unittest import mock
+        from datetime import timedelta
+        from django.utils import timezone
+        job_id = enqueue('battle:2', self.results)
+        with self.settings(POSTGAME_MAX_ATTEMPTS=2), mock.patch(
+            'gamification.jobs.record_results', side_effect=RuntimeError('db down')
+        ):
+            self.assertTrue(run_job(job_id))
+            job = PostGameJob.objects.get(pk=job_id)
+            self.assertEqual((job.status, job.attempts), ('pending', 1))
+            self.assertIn('db down', job.last_error)
+            self.assertEqual(run_pending(), 0)  # backing off
+
+            self.assertEqual(run_pending(now=timezone.now() + timedelta(seconds=5)), 1)
+            self.assertEqual(PostGameJob.objects.get(pk=job_id).status, 'failed')
+        self.assertFalse(UserProgress.objects.exists())
+
+    def test_retried_job_awards_badges(self):
+        from unittest import mock
+        from datetime import timedelta
+        from django.utils import timezone
+        from .rules import get_achievement_engine
+        Badge.objects.create(name='finisher', description='', criteria={'streak': 1})
+        self.addCleanup(get_achievement_engine().invalidate_index)  # the badge is rolled back
+        for player in self.players:
+            get_achievement_engine().forget(player.id)
+        job_id = enqueue('battle:3', self.results)
+        with mock.patch('gamification.jobs.rate_match', side_effect=[RuntimeError('deadlock'), {}]):
+            with self.captureOnCommitCallbacks(execute=True):
+                self.assertTrue(run_job(job_id))
+            self.assertEqual(PostGameJob.objects.get(pk=job_id).status, 'pending')
+            self.assertFalse(Achievement.objects.exists())
+
+            with self.captureOnCommitCallbacks(execute=True):
+                self.assertTrue(run_job(job_id, now=timezone.now() + timedelta(seconds=5)))
+        self.assertEqual(PostGameJob.objects.get(pk=job_id).status, 'done')
+        self.assertEqual(Achievement.objects.filter(badge__name='finisher').count(), 2)
+
+    def test_expired_lease_is_reclaimed(self):
+        from datetime import timedelta
+        from django.utils import timezone
+        job_id = enqueue('room:1:', self.results)
+        PostGameJob.objects.filter(pk=job_id).update(status='running', locked_until=timezone.now() - timedelta(seconds=1))
+        self.assertEqual(run_pending(), 1)
+        self.assertEqual(PostGameJob.objects.get(pk=job_id).status, 'done')
+
+
+class StreakCalendarTestCase(TestCase):
+    def setUp(self):
+        from datetime import date
+        self.user = User.objects.create_user(username='daily', password='pass')
+        self.day = date(2026, 3, 10)
+
+    def days(self, *offsets):
+        from datetime import timedelta
+        return [self.day + timedelta(days=offset) for offset in offsets]
+
+    def test_streak_follows_the_calendar(self):
+        from .streaks import ActivityCalendar, record_activity
+        streak = Streak(user=self.user)
+        for day in self.days(0, 1, 2, 2, 5, 6):
+            record_activity(streak, day)
+        self.assertEqual((streak.current_streak, streak.longest_streak, streak.last_activity), (2, 3, self.days(6)[0]))
+
+        # Late days fill the gap and join both runs
+        record_activity(streak, self.days(4)[0])
+        self.assertEqual(streak.current_streak, 3)
+        record_activity(streak, self.days(3)[0])
+        self.assertEqual((streak.current_streak, streak.longest_streak), (7, 7))
+
+        calendar = ActivityCalendar(streak.activity_since, streak.activity_days)
+        self.assertEqual(len(streak.activity_days), 1)
+        self.assertIn(self.days(3)[0], calendar)
+        self.assertNotIn(self.days(7)[0], calendar)
+
+    def test_nightly_rollover_resets_broken_streaks_only(self):
+        from accounts.models import UserStats
+        from .streaks import rollover
+        other = User.objects.create_user(username='nightly', password='pass')
+        Streak.objects.create(user=self.user, current_streak=4, longest_streak=4, last_activity=self.days(-2)[0])
+        Streak.objects.create(user=other, current_streak=2, longest_streak=2, last_activity=self.days(-1)[0])
+        UserStats.objects.create(user=self.user, current_streak=4)
+
+        with self.assertNumQueries(5):  # savepoint, three updates, release
+            self.assertEqual(rollover(self.day), 1)
+        self.assertEqual(Streak.objects.get(user=self.user).longest_streak, 4)
+        self.assertEqual(Streak.objects.get(user=self.user).current_streak, 0)
+        self.assertEqual(Streak.objects.get(user=other).current_streak, 2)
+        self.assertEqual(UserStats.objects.get(user=self.user).current_streak, 0)
+
+
+class PlayerRatingTestCase(TestCase):
+    def setUp(self):
+        self.users = [User.objects.create_user(username=f'rated{i}', password='pass') for i in range(3)]
+
+    def test_glicko2_matches_the_reference_example(self):
+        rating, deviation, volatility = glicko2(
+            1500, 200, 0.06, [(1400, 30, 1), (1550, 100, 0), (1700, 300, 0)], tau=0.5,
+        )
+        self.assertAlmostEqual(rating, 1464.06, places=1)
+        self.assertAlmostEqual(deviation, 151.52, places=1)
+        self.assertAlmostEqual(volatility, 0.05999, places=4)
+
+    def test_finished_room_rates_players_by_score(self):
+        first, second, third = self.users
+        job_id = enqueue('room:rated', [
+            GameResult(second.id, 40, 'multiplayer'), GameResult(first.id, 90, 'multiplayer'),
+            GameResult(third.id, 10, 'multiplayer'),
+        ])
+        run_job(job_id)
+
+        ratings = [get_rating(user.id, 'multiplayer') for user in self.users]
+        self.assertGreater(ratings[0], 1500)
+        self.assertAlmostEqual(ratings[1], 1500, places=6)
+        self.assertLess(ratings[2], 1500)
+        self.assertEqual(get_rating(first.id, 'codebattle'), 1500)
+        self.assertEqual(set(PlayerRating.objects.values_list('games', flat=True)), {1})
+        self.assertEqual([row.user_id for row in rating_range('multiplayer', 1400, 1600)], [second.id])
+
+    def test_rating_updates_refresh_updated_at(self):
+        first, second, _ = self.users
+        run_job(enqueue('battle:rated-1', [GameResult(first.id, 2, 'codebattle'), GameResult(second.id, 1, 'codebattle')]))
+        before = PlayerRating.objects.get(user=first, mode='codebattle').updated_at
+        run_job(enqueue('battle:rated-2', [GameResult(first.id, 2, 'codebattle'), GameResult(second.id, 1, 'codebattle')]))
+        self.assertGreater(PlayerRating.objects.get(user=first, mode='codebattle').updated_at, before)
+
+    def test_reaped_battles_are_not_rated(self):
+        from datetime import timedelta
+        from django.utils import timezone
+        from codebattle.models import Battle
+        from smartquizarena.reaper import reap
+        a, b, c = self.users
+        Battle.objects.create(
+            player1=a, player2=b, winner=a, status='completed', completed_at=timezone.now(), scores={'rated0': 1},
+        )
+        abandoned = Battle.objects.create(player1=b, player2=c, status='in_progress')
+        Battle.objects.filter(pk=abandoned.pk).update(started_at=timezone.now() - timedelta(days=1))
+        self.assertEqual(reap()['stale_battles'], 1)
+
+        self.assertEqual(recompute('codebattle'), 2)
+        self.assertFalse(PlayerRating.objects.filter(user=c).exists())
+        self.assertEqual(PlayerRating.objects.get(user=b, mode='codebattle').games, 1)
+
+    def test_recompute_command_reports_the_update_used(self):
+        import io
+        from django.core.management import call_command
+        out = io.StringIO()
+        call_command('recompute_ratings', mode=['codebattle'], no_numpy=True, stdout=out)
+        self.assertIn('Rated 0 players in codebattle (pure Python update)', out.getvalue())
+        out = io.StringIO()
+        call_command('recompute_ratings', mode=['codebattle'], stdout=out)
+        self.assertIn('(NumPy update)' if np is not None else 'NumPy is not installed', out.getvalue())
+
+    @unittest.skipIf(np is None, 'NumPy is not installed')
+    def test_numpy_recompute_matches_python(self):
+        from datetime import timedelta
+        from django.utils import timezone
+        from codebattle.models import Battle
+        now = timezone.now()
+        a, b, c = self.users
+        for days, (player1, player2, winner) in enumerate([(a, b, a), (b, c, None), (a, c, c), (a, b, a)]):
+            Battle.objects.create(
+                player1=player1, player2=player2, winner=winner, status='completed',
+                completed_at=now - timedelta(days=4 - days), scores={},
+            )
+
+        def snapshot():
+            return {
+                row.user_id: (row.rating, row.deviation, row.volatility, row.games)
+                for row in PlayerRating.objects.filter(mode='codebattle')
+            }
+
+        self.assertEqual(recompute('codebattle', use_numpy=False), 3)
+        expected = snapshot()
+        self.assertEqual(recompute('codebattle', use_numpy=True), 3)
+        for user_id, (rating, deviation, volatility, games) in snapshot().items():
+            self.assertAlmostEqual(rating, expected[user_id][0], places=6)
+            self.assertAlmostEqual(deviation, expected[user_id][1], places=6)
+            self.assertAlmostEqual(volatility, expected[user_id][2], places=8)
+            self.assertEqual(games, expected[user_id][3])
+        self.assertGreater(expected[a.id][0], expected[b.id][0])
@@ -7,4 +7,6 @@ urlpatterns = [
     path('progress/', views.UserProgressView.as_view(), name='user-progress'),
     path('streaks/', views.StreakView.as_view(), name='streak'),
     path('leaderboard/', views.LeaderboardView.as_view(), name='api_leaderboard'),
+    path('leaderboard/me/', views.LeaderboardRankView.as_view(), name='leaderboard-rank'),
+    path('leaderboard/<str:window>/', views.WindowedLeaderboardView.as_view(), name='windowed-leaderboard'),
 ]
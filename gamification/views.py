@@ -1,17 +1,23 @@
-from rest_framework import generics
+from rest_framework import generics, status
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
 from rest_framework.views import APIView
 from django.db.models import F
 from django.shortcuts import render
+from smartquizarena.cache import cached
+from .leaderboard import get_leaderboard, leaderboard_rows, top_rows
+from .windows import MODES, WINDOWS, get_windowed_leaderboards, scopes_for
 from .models import Badge, Achievement, UserProgress, Streak
 from .serializers import BadgeSerializer, AchievementSerializer, UserProgressSerializer, StreakSerializer, LeaderboardSerializer
 
 class BadgeListView(generics.ListAPIView):
-    queryset = Badge.objects.all()
     serializer_class = BadgeSerializer
     permission_classes = [IsAuthenticated]
 
+    def get_queryset(self):
+        # Invalidated on every badge change (gamification/rules.py)
+        return cached('badges', lambda: list(Badge.objects.all()))
+
 class AchievementListView(generics.ListAPIView):
     serializer_class = AchievementSerializer
     permission_classes = [IsAuthenticated]
@@ -43,17 +49,53 @@ class LeaderboardView(APIView):
         if request.path.startswith('/api/'):
             from django.shortcuts import redirect
             return redirect('/leaderboard/')
-        # Get top 10 users by total_score from User model
-        from accounts.models import User
-        top_users = User.objects.order_by('-total_score')[:10]
-        leaderboard_data = []
-        for user in top_users:
-            streak, _ = Streak.objects.get_or_create(user=user)
-            leaderboard_data.append({
-                'username': user.username,
-                'total_score': user.total_score,
-                'level': user.level,
-                'xp': user.xp,
-                'current_streak': streak.current_streak,
-            })
-        return Response(leaderboard_data)
+        # Top 10 users by total_score
+        return Response(top_rows())
+
+class LeaderboardRankView(APIView):
+    """The current user's global rank and the players just above and below them."""
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request):
+        leaderboard = get_leaderboard()
+        try:
+            radius = min(max(int(request.query_params.get('radius', 5)), 0), 50)
+        except ValueError:
+            radius = 5
+        return Response({
+            'rank': leaderboard.rank(request.user.id),
+            'total_users': len(leaderboard),
+            'around': leaderboard_rows(leaderboard.around(request.user.id, radius)),
+        })
+
+class WindowedLeaderboardView(APIView):
+    """A daily, weekly or monthly board, overall or for one topic (?topic=) or mode (?mode=)."""
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request, window):
+        if window not in WINDOWS:
+            return Response({'error': 'Unknown window'}, status=status.HTTP_404_NOT_FOUND)
+        mode = request.query_params.get('mode')
+        topic = request.query_params.get('topic')
+        if mode and topic:
+            return Response({'error': 'Filter by topic or by mode, not both'}, status=status.HTTP_400_BAD_REQUEST)
+        if mode and mode not in MODES:
+            return Response({'error': f'Mode must be one of {", ".join(MODES)}'}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            topic = int(topic) if topic else None
+            offset = max(int(request.query_params.get('offset', 0)), 0)
+            limit = min(max(int(request.query_params.get('limit', 20)), 1), 100)
+        except ValueError:
+            return Response({'error': 'topic, offset and limit must be numbers'}, status=status.HTTP_400_BAD_REQUEST)
+
+        scope = scopes_for(mode, topic)[-1]
+        board = get_windowed_leaderboards().board(window, scope)
+        total = len(board)
+        return Response({
+            'window': window,
+            'scope': scope,
+            'count': total,
+            'next_offset': offset + limit if offset + limit < total else None,
+            'my_rank': board.rank(request.user.id),
+            'results': leaderboard_rows(board.page(offset, limit)),
+        })
\ No newline at end of file
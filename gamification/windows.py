@@ -0,0 +1,268 @@
+"""
+Rolling-window leaderboards: daily, weekly and monthly, overall, per topic
+and per mode ("single", "multiplayer", "codebattle").
+
+Boards are never computed from ``GameSession``. Every completed game calls
+``record_completion`` and the score lands in time buckets:
+
+* ``daily`` is 24 hourly buckets, ``weekly`` 7 daily buckets and
+  ``monthly`` 30 daily buckets;
+* each board keeps a running total per user in an order-statistic
+  ``InMemoryLeaderboard``; when a bucket leaves the window its counts are
+  subtracted again, so rolling forward costs only the expired bucket.
+
+Each event touches at most three scopes ("all", its mode and its topic)
+times three windows. Queries go through the same ``page``/``rank``/
+``around`` interface as the global leaderboard.
+
+In memory the boards are per process and warm themselves from the last
+month of completed ``GameSession`` rows, battles and finished multiplayer
+rooms on first use. With
+``LEADERBOARD_REDIS_URL`` set, buckets are Redis sorted sets shared by all
+workers, and a window is their ``ZUNIONSTORE``, cached briefly.
+"""
+import threading
+import time
+from collections import Counter, OrderedDict
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.utils import timezone
+
+from .leaderboard import InMemoryLeaderboard, RedisLeaderboard
+
+HOUR = 3600
+DAY = 24 * HOUR
+
+# window -> (bucket length in seconds, number of buckets)
+WINDOWS = {
+    'daily': (HOUR, 24),
+    'weekly': (DAY, 7),
+    'monthly': (DAY, 30),
+}
+# bucket length -> how many buckets any window needs (Redis expiry)
+BUCKET_RETENTION = {HOUR: 24, DAY: 30}
+MODES = ('single', 'multiplayer', 'codebattle')
+
+
+def scopes_for(mode=None, topic_id=None):
+    """The boards an event counts towards."""
+    scopes = ['all']
+    if mode:
+        scopes.append(f'mode:{mode}')
+    if topic_id:
+        scopes.append(f'topic:{topic_id}')
+    return scopes
+
+
+def _timestamp(at):
+    if at is None:
+        return None
+    return at.timestamp() if hasattr(at, 'timestamp') else at
+
+
+class WindowedBoard:
+    """One rolling window: ``buckets`` counters of ``bucket_seconds`` each."""
+
+    def __init__(self, bucket_seconds, buckets):
+        self.bucket_seconds = bucket_seconds
+        self.buckets = buckets
+        self._counters = OrderedDict()  # bucket index -> Counter(user_id -> score), oldest first
+        self._totals = {}
+        self.board = InMemoryLeaderboard()
+        self.board.loaded = True
+
+    def _oldest(self, now):
+        return int(now // self.bucket_seconds) - self.buckets + 1
+
+    def advance(self, now):
+        """Drop buckets that have left the window ending at ``now``."""
+        oldest = self._oldest(now)
+        while self._counters:
+            index = next(iter(self._counters))
+            if index >= oldest:
+                break
+            for user_id, score in self._counters.pop(index).items():
+                total = self._totals[user_id] - score
+                if total:
+                    self._totals[user_id] = total
+                    self.board.update(user_id, total)
+                else:
+                    del self._totals[user_id]
+                    self.board.remove(user_id)
+
+    def add(self, user_id, score, at, now):
+        index = int(at // self.bucket_seconds)
+        if index < self._oldest(now) or not score:
+            return
+        counter = self._counters.get(index)
+        if counter is None:
+            counter = self._counters[index] = Counter()
+            if len(self._counters) > 1 and index < next(reversed(self._counters)):
+                # A late event opened an older bucket; keep oldest-first order
+                self._counters = OrderedDict(sorted(self._counters.items()))
+        counter[user_id] += score
+        total = self._totals.get(user_id, 0) + score
+        self._totals[user_id] = total
+        self.board.update(user_id, total)
+
+
+class InMemoryWindowedLeaderboards:
+    shared = False
+
+    def __init__(self, clock=time.time):
+        self.clock = clock
+        self._boards = {}
+        self._lock = threading.Lock()
+        self.loaded = False
+
+    def _board(self, window, scope):
+        board = self._boards.get((window, scope))
+        if board is None:
+            board = self._boards[(window, scope)] = WindowedBoard(*WINDOWS[window])
+        return board
+
+    def record(self, user_id, score, mode=None, topic_id=None, at=None):
+        now = self.clock()
+        at = _timestamp(at) or now
+        with self._lock:
+            for scope in scopes_for(mode, topic_id):
+                for window in WINDOWS:
+                    board = self._board(window, scope)
+                    board.advance(now)
+                    board.add(user_id, score, at, now)
+
+    def load(self, events):
+        """Fill the boards from ``(user_id, score, mode, topic_id, at)`` events."""
+        for event in events:
+            self.record(*event)
+        self.loaded = True
+
+    def board(self, window, scope='all'):
+        """The ``InMemoryLeaderboard`` for ``window``/``scope``, rolled forward to now."""
+        with self._lock:
+            board = self._board(window, scope)
+            board.advance(self.clock())
+            return board.board
+
+
+class RedisWindowedLeaderboards:
+    """Buckets as Redis sorted sets; a window is the union of its buckets."""
+    shared = True
+    loaded = True
+
+    def __init__(self, client, prefix='leaderboard:window', union_ttl=30, clock=time.time):
+        self.client = client
+        self.prefix = prefix
+        self.union_ttl = union_ttl
+        self.clock = clock
+
+    def _bucket_key(self, bucket_seconds, scope, index):
+        return f'{self.prefix}:{bucket_seconds}:{scope}:{index}'
+
+    def record(self, user_id, score, mode=None, topic_id=None, at=None):
+        if not score:
+            return
+        at = _timestamp(at) or self.clock()
+        pipe = self.client.pipeline(transaction=False)
+        # Hourly and daily buckets are shared by every window of that granularity
+        for bucket_seconds, buckets in BUCKET_RETENTION.items():
+            index = int(at // bucket_seconds)
+            for scope in scopes_for(mode, topic_id):
+                key = self._bucket_key(bucket_seconds, scope, index)
+                pipe.zincrby(key, score, user_id)
+                pipe.expireat(key, int((index + buckets + 1) * bucket_seconds))
+        pipe.execute()
+
+    def load(self, events):
+        for event in events:
+            self.record(*event)
+
+    def board(self, window, scope='all'):
+        bucket_seconds, buckets = WINDOWS[window]
+        newest = int(self.clock() // bucket_seconds)
+        key = f'{self.prefix}:union:{window}:{scope}:{newest}'
+        if not self.client.exists(key):
+            keys = [self._bucket_key(bucket_seconds, scope, index) for index in range(newest - buckets + 1, newest + 1)]
+            pipe = self.client.pipeline()
+            pipe.zunionstore(key, keys)
+            pipe.expire(key, self.union_ttl)
+            pipe.execute()
+        return RedisLeaderboard(self.client, key)
+
+
+def recent_completions(since):
+    """``(user_id, score, mode, topic_id, at)`` for games completed after ``since``."""
+    from codebattle.models import Battle
+    from multiplayer.models import Player
+    from quizzes.models import GameSession
+
+    sessions = GameSession.objects.filter(completed_at__gte=since).values_list(
+        'user_id', 'score', 'mode', 'quiz__topic_id', 'completed_at'
+    )
+    for user_id, score, mode, topic_id, at in sessions.iterator():
+        yield user_id, score, mode, topic_id, at
+    battles = Battle.objects.filter(status='completed', completed_at__gte=since).values_list(
+        'player1_id', 'player1__username', 'player2_id', 'player2__username', 'scores', 'completed_at'
+    )
+    for player1_id, username1, player2_id, username2, scores, at in battles.iterator():
+        scores = scores or {}
+        for user_id, username in ((player1_id, username1), (player2_id, username2)):
+            if user_id:
+                yield user_id, scores.get(username, 0), 'codebattle', None, at
+    # Multiplayer rooms keep their scores on Player rows; rooms record no end time
+    players = Player.objects.filter(room__quiz_state='finished', room__started_at__gte=since).values_list(
+        'user_id', 'score', 'room__topic_id', 'room__started_at'
+    )
+    for user_id, score, topic_id, at in players.iterator():
+        yield user_id, score or 0, 'multiplayer', topic_id, at
+
+
+_windows = None
+_windows_lock = threading.Lock()
+
+
+def get_windowed_leaderboards():
+    """Return the process-wide windowed leaderboards, warmed from the database on first use."""
+    global _windows
+    with _windows_lock:
+        if _windows is None:
+            url = getattr(settings, 'LEADERBOARD_REDIS_URL', '')
+            if url:
+                import redis
+
+                _windows = RedisWindowedLeaderboards(redis.Redis.from_url(url))
+            else:
+                _windows = InMemoryWindowedLeaderboards()
+        windows = _windows
+    if not windows.loaded:
+        # load() adds to the boards, so concurrent first requests must not both run it
+        with _windows_lock:
+            if not windows.loaded:
+                longest = max(seconds * count for seconds, count in WINDOWS.values())
+                windows.load(recent_completions(timezone.now() - timedelta(seconds=longest)))
+    return windows
+
+
+def record_completion(user_id, score, mode=None, topic_id=None, at=None):
+    """Count a finished game towards the windowed boards (a no-op until they are in use)."""
+    windows = _windows
+    if windows is None and getattr(settings, 'LEADERBOARD_REDIS_URL', ''):
+        windows = get_windowed_leaderboards()
+    if windows is not None and windows.loaded:
+        windows.record(user_id, score, mode, topic_id, at)
+
+
+def reset_windowed_leaderboards():
+    global _windows
+    with _windows_lock:
+        _windows = None
+
+
+def _reset_on_setting(setting, **kwargs):
+    if setting.startswith('LEADERBOARD_'):
+        reset_windowed_leaderboards()
+
+
+setting_changed.connect(_reset_on_setting)
@@ -7,9 +7,19 @@ from channels.db import database_sync_to_async
 from django.core.exceptions import ObjectDoesNotExist
 import asyncio
 from django.utils import timezone
-
-class QuizRoomConsumer(AsyncWebsocketConsumer):
+from smartquizarena.deadlines import (
+    clock_sync_reply,
+    deadline_after,
+    round_deadline_event,
+    round_timers,
+)
+from smartquizarena.encoding import EncodedEventsMixin
+from smartquizarena.reaper import ensure_reaper
+from gamification.jobs import enqueue, run_soon
+
+class QuizRoomConsumer(EncodedEventsMixin, AsyncWebsocketConsumer):
     async def connect(self):
+        ensure_reaper()
         self.room_code = self.scope['url_route']['kwargs']['room_code']
         self.room_group_name = f'quiz_room_{self.room_code}'
         self.user = self.scope['user']
@@ -25,19 +35,19 @@ class QuizRoomConsumer(AsyncWebsocketConsumer):
         # Load room
         self.room = await self.get_room_by_code(self.room_code)
         if not self.room:
-            await self.send(json.dumps({
+            await self.send_event({
                 "type": "error",
                 "message": "Room not found or inactive"
-            }))
+            })
             await self.close()
             return
 
         # Send current room state to the new client
         room_data = await self.get_room_data(self.room.id)
-        await self.send(json.dumps({
+        await self.send_event({
             "type": "room_state",
             "room": room_data
-        }))
+        })
 
     async def disconnect(self, close_code):
         # Leave room group
@@ -49,19 +59,16 @@ class QuizRoomConsumer(AsyncWebsocketConsumer):
     # Helper methods for reducing code duplication
     async def send_error(self, message):
         """Send error message to client"""
-        await self.send(json.dumps({"type": "error", "message": message}))
+        await self.send_event({"type": "error", "message": message})
 
     async def broadcast_to_group(self, event_type, **data):
         """Broadcast event to all clients in the room"""
-        await self.channel_layer.group_send(
-            self.room_group_name,
-            {'type': event_type, **data}
-        )
+        await self.broadcast(self.room_group_name, {'type': event_type, **data})
 
-    async def receive(self, text_data):
+    async def receive(self, text_data=None, bytes_data=None):
         try:
-            data = json.loads(text_data)
-        except json.JSONDecodeError:
+            data = self.decode_message(text_data, bytes_data)
+        except ValueError:
             await self.send_error("Invalid JSON")
             return
 
@@ -193,40 +200,11 @@ class QuizRoomConsumer(AsyncWebsocketConsumer):
                     room=await self.get_room_data(room_id)
                 )
 
-            await self.send(json.dumps({"type": "success", "message": "Left room successfully"}))
+            await self.send_event({"type": "success", "message": "Left room successfully"})
 
         except Exception as e:
             await self.send_error(str(e))
 
-    # Event handlers for group messages
-    async def player_joined(self, event):
-        await self.send(json.dumps({
-            'type': 'player_joined',
-            'message': event['message'],
-            'room': event['room']
-        }))
-
-    async def player_ready(self, event):
-        await self.send(json.dumps({
-            'type': 'player_ready',
-            'message': event['message'],
-            'room': event['room']
-        }))
-
-    async def player_left(self, event):
-        await self.send(json.dumps({
-            'type': 'player_left',
-            'message': event['message'],
-            'room': event['room']
-        }))
-
-    async def game_started(self, event):
-        await self.send(json.dumps({
-            'type': 'game_started',
-            'message': event['message'],
-            'quiz_id': event['quiz_id']
-        }))
-
     # Database helpers
     @database_sync_to_async
     def get_room_by_code(self, code):
@@ -296,7 +274,7 @@ class QuizRoomConsumer(AsyncWebsocketConsumer):
             callback=on_questions_added
         )
 
-class GeoGuessrQuizConsumer(AsyncWebsocketConsumer):
+class GeoGuessrQuizConsumer(EncodedEventsMixin, AsyncWebsocketConsumer):
     async def connect(self):
         self.room_code = self.scope['url_route']['kwargs']['room_code']
         self.quiz_group_name = f'quiz_room_{self.room_code}'
@@ -304,7 +282,6 @@ class GeoGuessrQuizConsumer(AsyncWebsocketConsumer):
 
         # Per-connection state
         self.answered_players = set()
-        self.timer_task = None
         self.current_timer_duration = None
         self.total_players = 0
 
@@ -319,10 +296,10 @@ class GeoGuessrQuizConsumer(AsyncWebsocketConsumer):
         # Load room
         self.room = await self.get_room_by_code(self.room_code)
         if not self.room:
-            await self.send(json.dumps({
+            await self.send_event({
                 "type": "error",
                 "message": "Room not found or inactive"
-            }))
+            })
             await self.close()
             return
 
@@ -335,27 +312,34 @@ class GeoGuessrQuizConsumer(AsyncWebsocketConsumer):
             current_q = self.room.current_question or 0
 
             # Initial payload to this client
-            await self.send(json.dumps({
+            await self.send_event({
                 "type": "quiz_start",
                 "quiz": quiz_data,
                 "total_players": self.total_players,
                 "current_question": current_q,
                 "timer_duration": self.room.timer_duration
-            }))
+            })
+
+            # Late joiners resync to the pending round deadline
+            deadline = round_timers.deadline_for(self.quiz_group_name)
+            if deadline:
+                await self.send_event(round_deadline_event(
+                    deadline, self.room.timer_duration, question_index=current_q
+                ))
 
             # If this is the first question and round not started yet -> start it
             if self.room.round_state in (None, "", "idle"):
                 await self.start_question_timer(current_q)
         else:
             # Game not started yet
-            await self.send(json.dumps({
+            await self.send_event({
                 "type": "waiting_for_game",
                 "message": "Waiting for the host to start the game..."
-            }))
+            })
 
         # Notify others that a player joined the quiz
         if self.user.is_authenticated:
-            await self.channel_layer.group_send(
+            await self.broadcast(
                 self.quiz_group_name,
                 {
                     "type": "player_joined_quiz",
@@ -365,9 +349,8 @@ class GeoGuessrQuizConsumer(AsyncWebsocketConsumer):
             )
 
     async def disconnect(self, close_code):
-        # Cancel timer task if running
-        if self.timer_task and not self.timer_task.done():
-            self.timer_task.cancel()
+        # The round expiry task is shared by the whole room, so it keeps
+        # running when a single player drops.
 
         # Leave quiz group
         await self.channel_layer.group_discard(
@@ -375,22 +358,24 @@ class GeoGuessrQuizConsumer(AsyncWebsocketConsumer):
             self.channel_name
         )
 
-    async def receive(self, text_data):
+    async def receive(self, text_data=None, bytes_data=None):
         try:
-            data = json.loads(text_data)
-        except json.JSONDecodeError:
-            await self.send(json.dumps({"type": "error", "message": "Invalid JSON"}))
+            data = self.decode_message(text_data, bytes_data)
+        except ValueError:
+            await self.send_event({"type": "error", "message": "Invalid JSON"})
             return
 
         user = self.scope["user"]
         if not user.is_authenticated:
-            await self.send(json.dumps({"type": "error", "message": "Authentication required"}))
+            await self.send_event({"type": "error", "message": "Authentication required"})
             return
 
         msg_type = data.get("type")
 
         if msg_type == "submit_answer":
             await self.handle_submit_answer(user, data)
+        elif msg_type == "clock_sync":
+            await self.send_event(clock_sync_reply(data.get("client_time")))
         elif msg_type == "time_up":
             # Client can signal when their local time hits zero,
             # but server remains authoritative.
@@ -404,7 +389,8 @@ class GeoGuessrQuizConsumer(AsyncWebsocketConsumer):
 
     async def start_question_timer(self, question_index: int):
         """
-        Start the timer and broadcast a new question to all players.
+        Broadcast a new question with its absolute deadline and schedule the
+        single expiry task for the round.
         """
         room = await self.get_room_by_code(self.room_code)
         if not room or not room.quiz_id:
@@ -427,49 +413,43 @@ class GeoGuessrQuizConsumer(AsyncWebsocketConsumer):
             return
 
         question = questions[question_index]
+        round_start_ms = int(room.round_start_time.timestamp() * 1000)
+        deadline = deadline_after(self.current_timer_duration, round_start_ms)
 
         # Tell everyone a new question started
-        await self.channel_layer.group_send(
+        await self.broadcast(
             self.quiz_group_name,
             {
                 "type": "new_question",
                 "question_index": question_index,
                 "question": question,
                 "timer_duration": self.current_timer_duration,
+                "deadline": deadline,
             }
         )
+        await self.schedule_round_deadline(room.id, question_index, deadline, self.current_timer_duration)
 
-        # Start a background timer
-        self.timer_task = asyncio.create_task(
-            self.broadcast_timer(room.id, question_index, self.current_timer_duration)
+    async def schedule_round_deadline(self, room_id: int, question_index: int, deadline: int, duration: int, **extra):
+        """
+        Announce the round deadline once and (re)arm the room's expiry task.
+        Clients count down locally; no per-second timer traffic is sent.
+        """
+        round_timers.schedule(
+            self.quiz_group_name, deadline, self.expire_round, room_id, question_index
+        )
+        await self.broadcast(
+            self.quiz_group_name,
+            round_deadline_event(deadline, duration, question_index=question_index, **extra)
         )
 
-    async def broadcast_timer(self, room_id: int, question_index: int, duration: int):
+    async def expire_round(self, room_id: int, question_index: int):
         """
-        Broadcast timer updates every second. When it hits 0, end the round
-        if it's still active.
+        Fired once when the round deadline passes. Ends the round if it is
+        still the active one.
         """
-        try:
-            for remaining in range(duration, -1, -1):
-                # Broadcast to all clients
-                await self.channel_layer.group_send(
-                    self.quiz_group_name,
-                    {
-                        "type": "timer",
-                        "remaining": remaining,
-                    }
-                )
-
-                if remaining == 0:
-                    room = await self.get_room_by_id(room_id)
-                    if room and room.round_state == "active":
-                        await self.end_round_normal(room_id, question_index)
-                    break
-
-                await asyncio.sleep(1)
-        except asyncio.CancelledError:
-            # Timer cancelled because round ended early
-            return
+        room = await self.get_room_by_id(room_id)
+        if room and room.round_state == "active" and (room.current_question or 0) == question_index:
+            await self.end_round_normal(room_id, question_index)
 
     async def handle_submit_answer(self, user, data: dict):
         """
@@ -482,15 +462,15 @@ class GeoGuessrQuizConsumer(AsyncWebsocketConsumer):
         answer = data.get("answer")
 
         if question_index is None or answer is None:
-            await self.send(json.dumps({
+            await self.send_event({
                 "type": "error",
                 "message": "Question index and answer required"
-            }))
+            })
             return
 
         room = await self.get_room_by_code(self.room_code)
         if not room or room.round_state != "active":
-            await self.send(json.dumps({"type": "error", "message": "Round has ended"}))
+            await self.send_event({"type": "error", "message": "Round has ended"})
             return
 
         # Calculate time used
@@ -508,19 +488,19 @@ class GeoGuessrQuizConsumer(AsyncWebsocketConsumer):
         if len(self.answered_players) == 1:
             # Effective max duration for everyone = time_used so far
             # e.g., if first player answered at 7 seconds, others effectively
-            # only have 7 seconds window from question start.
+            # only have 7 seconds window from the moment of the answer.
             effective_duration = max(0, time_used)
-            # Cancel previous timer and restart only for the remaining time
-            if self.timer_task and not self.timer_task.done():
-                self.timer_task.cancel()
-
             self.current_timer_duration = effective_duration or 1  # avoid 0
-            self.timer_task = asyncio.create_task(
-                self.broadcast_timer(room.id, question_index, self.current_timer_duration)
+
+            # Re-arm the expiry task with the shortened deadline
+            deadline = deadline_after(self.current_timer_duration)
+            await self.schedule_round_deadline(
+                room.id, question_index, deadline, self.current_timer_duration,
+                reason="timer_reduced",
             )
 
             # Inform all players that timer has been reduced
-            await self.channel_layer.group_send(
+            await self.broadcast(
                 self.quiz_group_name,
                 {
                     "type": "timer_reduced",
@@ -530,7 +510,7 @@ class GeoGuessrQuizConsumer(AsyncWebsocketConsumer):
             )
 
         # Notify all that someone answered
-        await self.channel_layer.group_send(
+        await self.broadcast(
             self.quiz_group_name,
             {
                 "type": "player_answered",
@@ -550,8 +530,9 @@ class GeoGuessrQuizConsumer(AsyncWebsocketConsumer):
         """
         Called when all players have answered early.
         """
-        if self.timer_task and not self.timer_task.done():
-            self.timer_task.cancel()
+        if not await self.close_round(room_id, question_index, "review"):
+            return  # The deadline already ended this round
+        round_timers.cancel(self.quiz_group_name)
 
         await self.end_round_common(room_id, question_index)
 
@@ -559,8 +540,9 @@ class GeoGuessrQuizConsumer(AsyncWebsocketConsumer):
         """
         Called when timer hits zero.
         """
-        # Set round state to complete in DB
-        await self.set_round_state(room_id, "complete")
+        # Set round state to complete in DB (only if nobody ended it first)
+        if not await self.close_round(room_id, question_index, "complete"):
+            return
         await self.end_round_common(room_id, question_index)
 
     async def end_round_common(self, room_id: int, question_index: int):
@@ -576,7 +558,7 @@ class GeoGuessrQuizConsumer(AsyncWebsocketConsumer):
         )
 
         # Broadcast round results (everyone sees answers + scores)
-        await self.channel_layer.group_send(
+        await self.broadcast(
             self.quiz_group_name,
             {
                 "type": "round_result",
@@ -596,7 +578,7 @@ class GeoGuessrQuizConsumer(AsyncWebsocketConsumer):
         5 seconds where players can see answers, then move to next question.
         """
         # Notify review start
-        await self.channel_layer.group_send(
+        await self.broadcast(
             self.quiz_group_name,
             {
                 "type": "review_start",
@@ -607,7 +589,7 @@ class GeoGuessrQuizConsumer(AsyncWebsocketConsumer):
         await asyncio.sleep(5)
 
         # Notify review end
-        await self.channel_layer.group_send(
+        await self.broadcast(
             self.quiz_group_name,
             {
                 "type": "review_end",
@@ -631,14 +613,10 @@ class GeoGuessrQuizConsumer(AsyncWebsocketConsumer):
             await self.set_quiz_finished(room_id)
             final_leaderboard = await self.get_final_leaderboard(room_id)
 
-            # Update user progress and streaks for all players
-            players = await self.get_room_players(room_id)
-            for player in players:
-                score = player.score or 0
-                await self.update_user_progress(player.user_id, score)
-                await self.update_streak(player.user_id)
+            # Progress, streaks and badges are applied by the post-game queue
+            job_id = await self.enqueue_results(room)
 
-            await self.channel_layer.group_send(
+            await self.broadcast(
                 self.quiz_group_name,
                 {
                     "type": "quiz_finished",
@@ -646,82 +624,13 @@ class GeoGuessrQuizConsumer(AsyncWebsocketConsumer):
                     "final_leaderboard": final_leaderboard,
                 }
             )
+            run_soon(job_id)
         else:
             # Update current question in DB
             await self.set_current_question(room_id, next_index)
             # Start next question
             await self.start_question_timer(next_index)
 
-    # -------------------------------------------------------------------------
-    #  EVENT HANDLERS (group messages -> client)
-    # -------------------------------------------------------------------------
-
-    async def player_joined_quiz(self, event):
-        await self.send(json.dumps({
-            "type": "player_joined_quiz",
-            "user": event["user"],
-            "total_players": event["total_players"],
-        }))
-
-    async def timer(self, event):
-        await self.send(json.dumps({
-            "type": "timer",
-            "remaining": event["remaining"],
-        }))
-
-    async def timer_reduced(self, event):
-        await self.send(json.dumps({
-            "type": "timer_reduced",
-            "new_duration": event["new_duration"],
-            "triggered_by": event["triggered_by"],
-        }))
-
-    async def new_question(self, event):
-        await self.send(json.dumps({
-            "type": "new_question",
-            "question_index": event["question_index"],
-            "question": event["question"],
-            "timer_duration": event["timer_duration"],
-        }))
-
-    async def player_answered(self, event):
-        await self.send(json.dumps({
-            "type": "player_answered",
-            "user": event["user"],
-            "question_index": event["question_index"],
-            "answered_count": event["answered_count"],
-            "total_players": event["total_players"],
-            "time_used": event["time_used"],
-        }))
-
-    async def round_result(self, event):
-        await self.send(json.dumps({
-            "type": "round_result",
-            "question_index": event["question_index"],
-            "correct_answer": event["correct_answer"],
-            "player_results": event["player_results"],
-            "leaderboard": event["leaderboard"],
-            "review_duration": event["review_duration"],
-        }))
-
-    async def review_start(self, event):
-        await self.send(json.dumps({
-            "type": "review_start",
-            "duration": event["duration"],
-        }))
-
-    async def review_end(self, event):
-        await self.send(json.dumps({
-            "type": "review_end",
-        }))
-
-    async def quiz_finished(self, event):
-        await self.send(json.dumps({
-            "type": "quiz_finished",
-            "message": event["message"],
-            "final_leaderboard": event.get("final_leaderboard", []),
-        }))
-
     # -------------------------------------------------------------------------
     #  DB HELPERS (ALL ORM WRAPPED)
     # -------------------------------------------------------------------------
@@ -760,6 +669,16 @@ class GeoGuessrQuizConsumer(AsyncWebsocketConsumer):
         room.round_state = state
         room.save()
 
+    @database_sync_to_async
+    def close_round(self, room_id, question_index: int, state: str):
+        """
+        Compare-and-set the active round to ``state`` with a conditional UPDATE.
+        Returns True for exactly one caller per round.
+        """
+        return Room.objects.filter(
+            id=room_id, round_state="active", current_question=question_index
+        ).update(round_state=state) == 1
+
     @database_sync_to_async
     def set_player_answer(self, room_id, user_id, answer, time_used: int):
         room = Room.objects.get(id=room_id)
@@ -881,24 +800,10 @@ class GeoGuessrQuizConsumer(AsyncWebsocketConsumer):
         return board
 
     @database_sync_to_async
-    def update_user_progress(self, user_id, score):
-        from accounts.models import User
-        from gamification.models import UserProgress
-        user = User.objects.get(id=user_id)
-        progress, created = UserProgress.objects.get_or_create(user=user)
-        progress.total_score += score
-        progress.quizzes_completed += 1
-        progress.xp += score * 10
-        progress.level = progress.total_score // 100 + 1
-        progress.save()
-
-    @database_sync_to_async
-    def update_streak(self, user_id):
-        from gamification.models import Streak
-        from django.utils import timezone
-        streak, created = Streak.objects.get_or_create(user_id=user_id)
-        streak.current_streak += 1
-        if streak.current_streak > streak.longest_streak:
-            streak.longest_streak = streak.current_streak
-        streak.last_activity = timezone.now()
-        streak.save()
+    def enqueue_results(self, room):
+        from gamification.progress import GameResult
+        started = room.started_at.isoformat() if room.started_at else ''
+        return enqueue(f'room:{room.id}:{started}', [
+            GameResult(player.user_id, player.score or 0, 'multiplayer', room.topic_id)
+            for player in room.player_set.all()
+        ])
@@ -0,0 +1,82 @@
+import asyncio
+import json
+import time
+
+from django.core.management.base import BaseCommand
+
+from smartquizarena.encoding import JSON, EncodedEventsMixin, encode_broadcast
+
+
+class _Socket(EncodedEventsMixin):
+    """Stands in for one connected consumer; only counts outgoing frames."""
+
+    def __init__(self):
+        self.scope = {}
+        self.encoding = JSON
+        self.frames = 0
+
+    async def send(self, text_data=None, bytes_data=None):
+        self.frames += 1
+
+    async def round_result(self, event):
+        # The old per-consumer path: every consumer serialises the event itself
+        await self.send(text_data=json.dumps({
+            "type": "round_result",
+            "question_index": event["question_index"],
+            "correct_answer": event["correct_answer"],
+            "player_results": event["player_results"],
+            "leaderboard": event["leaderboard"],
+            "review_duration": event["review_duration"],
+        }))
+
+
+def _round_result(room_size):
+    players = [f"player_{i}" for i in range(room_size)]
+    return {
+        "type": "round_result",
+        "question_index": 3,
+        "correct_answer": "Paris",
+        "player_results": [
+            {"user": name, "answer": "Paris", "correct": i % 2 == 0, "time_used": i % 20, "points": 100 - i % 20}
+            for i, name in enumerate(players)
+        ],
+        "leaderboard": [{"user": name, "score": 1000 - i} for i, name in enumerate(players)],
+        "review_duration": 5,
+    }
+
+
+class Command(BaseCommand):
+    help = 'Compare CPU per group broadcast: per-consumer json.dumps vs. pre-encoded frames'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', default='2,10,50,200', help='Comma-separated room sizes')
+        parser.add_argument('--rounds', type=int, default=200, help='Broadcasts per room size')
+
+    def handle(self, *args, **options):
+        sizes = [int(size) for size in options['sizes'].split(',')]
+        asyncio.run(self.run(sizes, options['rounds']))
+
+    async def run(self, sizes, rounds):
+        self.stdout.write(f"{'room size':>10} {'per-consumer (us)':>18} {'pre-encoded (us)':>17} {'speedup':>8}")
+        for size in sizes:
+            sockets = [_Socket() for _ in range(size)]
+            event = _round_result(size)
+
+            start = time.process_time()
+            for _ in range(rounds):
+                for socket in sockets:
+                    await socket.round_result(event)
+            per_consumer = (time.process_time() - start) / rounds
+
+            start = time.process_time()
+            for _ in range(rounds):
+                encoded = encode_broadcast(event)
+                for socket in sockets:
+                    await socket.encoded_broadcast(encoded)
+            pre_encoded = (time.process_time() - start) / rounds
+
+            self.stdout.write(
+                f"{size:>10} {per_consumer * 1e6:>18.1f} {pre_encoded * 1e6:>17.1f} "
+                f"{per_consumer / pre_encoded if pre_encoded else 0:>7.1f}x"
+            )
+        self.stdout.write("Channel-layer delivery is the same for both paths and is not included.")
@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+
+from smartquizarena.reaper import reap
+
+
+class Command(BaseCommand):
+    # Codes freed here are not recycled: the allocator's free list is per
+    # process. Set REAPER_INTERVAL to reap inside the workers instead.
+    help = 'Close idle multiplayer rooms and abandoned code battles (see smartquizarena/reaper.py)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, help='Rows per transaction (default REAPER_BATCH_SIZE)')
+        parser.add_argument('--max-batches', type=int, help='Batches per kind in this run (default REAPER_MAX_BATCHES)')
+
+    def handle(self, *args, **options):
+        counts = reap(batch_size=options['batch_size'], max_batches=options['max_batches'])
+        for kind, count in counts.items():
+            self.stdout.write(f"{kind}: {count}")
@@ -0,0 +1,30 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('multiplayer', '0006_remove_player_webrtc_offer_remove_room_timer_start'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CodeBlock',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('namespace', models.CharField(max_length=20)),
+                ('reserved_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        # Codes are recycled once a room is inactive, so they only need to be
+        # unique among active rooms
+        migrations.AlterField(
+            model_name='room',
+            name='room_code',
+            field=models.CharField(blank=True, db_index=True, max_length=6),
+        ),
+        migrations.AddConstraint(
+            model_name='room',
+            constraint=models.UniqueConstraint(condition=models.Q(('is_active', True)), fields=('room_code',), name='unique_active_room_code'),
+        ),
+    ]
@@ -0,0 +1,27 @@
+from django.db import migrations, models
+
+
+def count_players(apps, schema_editor):
+    Room = apps.get_model('multiplayer', 'Room')
+    for room in Room.objects.annotate(players=models.Count('player')).exclude(players=0).only('id').iterator():
+        Room.objects.filter(pk=room.pk).update(player_count=room.players)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('multiplayer', '0007_codeblock_room_code_active_unique'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='room',
+            name='player_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(count_players, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='room',
+            index=models.Index(fields=['is_active', '-created_at', '-id'], name='room_lobby_idx'),
+        ),
+    ]
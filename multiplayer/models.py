@@ -1,9 +1,10 @@
-from django.db import models
+from django.db import models, transaction
+from django.db.models import F
 from accounts.models import User
 from quizzes.models import Quiz
 from quizzes.models import Topic
-import secrets
-import string
+from django.db.models.signals import post_delete, post_init, post_save
+from smartquizarena.codes import get_code_allocator, save_with_code
 
 class Room(models.Model):
     name = models.CharField(max_length=100)
@@ -15,9 +16,10 @@ class Room(models.Model):
         ('medium', 'Medium'),
         ('hard', 'Hard'),
     ], default='medium')
-    room_code = models.CharField(max_length=6, unique=True, blank=True)
+    room_code = models.CharField(max_length=6, db_index=True, blank=True)  # Unique among active rooms; recycled afterwards
     host = models.ForeignKey(User, on_delete=models.CASCADE)
     max_players = models.IntegerField(default=10)
+    player_count = models.PositiveIntegerField(default=0)  # Kept in step with Player rows by the signals below
     is_active = models.BooleanField(default=True)
     created_at = models.DateTimeField(auto_now_add=True)
     started_at = models.DateTimeField(blank=True, null=True)
@@ -45,21 +47,32 @@ class Room(models.Model):
         ]
     )
 
-    def save(self, *args, **kwargs):
-        if not self.room_code:
-            self.room_code = self.generate_room_code()
-        super().save(*args, **kwargs)
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['room_code'], condition=models.Q(is_active=True), name='unique_active_room_code'
+            ),
+        ]
+        indexes = [
+            # Lobby listing: active rooms, newest first (keyset pagination)
+            models.Index(fields=['is_active', '-created_at', '-id'], name='room_lobby_idx'),
+        ]
 
-    def generate_room_code(self):
-        """Generate a unique 6-character room code"""
-        while True:
-            code = ''.join(secrets.choice(string.ascii_uppercase + string.digits) for _ in range(6))
-            if not Room.objects.filter(room_code=code, is_active=True).exists():
-                return code
+    def save(self, *args, **kwargs):
+        # New rooms get a code from the allocator (see smartquizarena/codes.py)
+        save_with_code(self, 'room_code', 'rooms', lambda: super(Room, self).save(*args, **kwargs))
 
     def __str__(self):
         return self.name
 
+class CodeBlock(models.Model):
+    """A reserved block of code sequence numbers (see smartquizarena/codes.py)."""
+    namespace = models.CharField(max_length=20)
+    reserved_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"{self.namespace} block {self.pk}"
+
 class Player(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE)
     room = models.ForeignKey(Room, on_delete=models.CASCADE)
@@ -76,3 +89,42 @@ class Player(models.Model):
 
     def __str__(self):
         return f"{self.user.username} in {self.room.name}"
+
+
+def _release_room_code(code):
+    if code:
+        # A rolled-back close or delete leaves the room holding its code
+        transaction.on_commit(lambda: get_code_allocator('rooms').release(code))
+
+
+def _room_loaded(sender, instance, **kwargs):
+    instance._active_at_load = instance.is_active
+
+
+def _room_saved(sender, instance, created=False, **kwargs):
+    # Rooms hold their code while active; release it once, when a room is closed
+    was_active = created or instance._active_at_load
+    instance._active_at_load = instance.is_active
+    if was_active and not instance.is_active:
+        _release_room_code(instance.room_code)
+
+
+def _room_deleted(sender, instance, **kwargs):
+    if instance.is_active:
+        _release_room_code(instance.room_code)
+
+
+def _player_added(sender, instance, created=False, **kwargs):
+    if created:
+        Room.objects.filter(pk=instance.room_id).update(player_count=F('player_count') + 1)
+
+
+def _player_removed(sender, instance, **kwargs):
+    Room.objects.filter(pk=instance.room_id, player_count__gt=0).update(player_count=F('player_count') - 1)
+
+
+post_init.connect(_room_loaded, sender=Room)
+post_save.connect(_room_saved, sender=Room)
+post_delete.connect(_room_deleted, sender=Room)
+post_save.connect(_player_added, sender=Player)
+post_delete.connect(_player_removed, sender=Player)
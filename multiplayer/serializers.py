@@ -25,10 +25,9 @@ class RoomSerializer(serializers.ModelSerializer):
         request = self.context.get('request')
         if not request or not request.user.is_authenticated:
             return False
-        player_count = obj.player_set.count()
         is_host = obj.host_id == request.user.id
         has_started = obj.started_at is not None
-        return is_host and player_count >= 2 and not has_started
+        return is_host and obj.player_count >= 2 and not has_started
 
     def get_game_started(self, obj):
         """Check if game has started"""
@@ -36,4 +35,18 @@ class RoomSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = Room
-        fields = ['id', 'name', 'room_code', 'quiz', 'topic', 'topic_name', 'num_questions', 'level', 'host', 'max_players', 'is_active', 'created_at', 'started_at', 'players', 'can_start', 'game_started']
+        fields = ['id', 'name', 'room_code', 'quiz', 'topic', 'topic_name', 'num_questions', 'level', 'host', 'max_players', 'player_count', 'is_active', 'created_at', 'started_at', 'players', 'can_start', 'game_started']
+        read_only_fields = ['player_count']
+
+class LobbyRoomSerializer(serializers.ModelSerializer):
+    """A room as listed in the lobby: no player list, just the cached count."""
+    host = serializers.CharField(source='host.username', read_only=True)
+    topic_name = serializers.CharField(source='topic.name', read_only=True, default=None)
+    is_full = serializers.SerializerMethodField()
+
+    def get_is_full(self, obj):
+        return obj.player_count >= obj.max_players
+
+    class Meta:
+        model = Room
+        fields = ['id', 'name', 'room_code', 'topic_name', 'num_questions', 'level', 'host', 'player_count', 'max_players', 'is_full', 'created_at']
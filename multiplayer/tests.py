@@ -8,6 +8,11 @@ from asgiref.sync import sync_to_async
 from django.test import TransactionTestCase
 from channels.layers import get_channel_layer
 import json
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from unittest import mock
+from smartquizarena.codes import get_code_allocator
 
 
 class GeoGuessrQuizConsumerTestCase(TransactionTestCase):
@@ -35,16 +40,11 @@ class GeoGuessrQuizConsumerTestCase(TransactionTestCase):
         self.streak2 = Streak.objects.create(user=self.user2, current_streak=0, longest_streak=0)
 
     async def test_update_user_progress_and_streak(self):
-        # Test the update methods directly
+        # Queue both players' results in one job, then let a worker apply it
+        from gamification.jobs import run_pending
         consumer = GeoGuessrQuizConsumer()
-
-        # Update progress for user1
-        await consumer.update_user_progress(self.user1.id, 40)
-        await consumer.update_streak(self.user1.id)
-
-        # Update progress for user2
-        await consumer.update_user_progress(self.user2.id, 60)
-        await consumer.update_streak(self.user2.id)
+        await consumer.enqueue_results(self.room)
+        await sync_to_async(run_pending)()
 
         # Refresh from database
         progress1 = await sync_to_async(UserProgress.objects.get)(user=self.user1)
@@ -69,3 +69,86 @@ class GeoGuessrQuizConsumerTestCase(TransactionTestCase):
 
         self.assertEqual(streak2.current_streak, 1)
         self.assertEqual(streak2.longest_streak, 1)
+
+    async def test_round_closes_once(self):
+        consumer = GeoGuessrQuizConsumer()
+        await sync_to_async(Room.objects.filter(id=self.room.id).update)(round_state='active', current_question=2)
+
+        # Timer expiry and "everyone answered" race for the same round
+        self.assertTrue(await consumer.close_round(self.room.id, 2, 'review'))
+        self.assertFalse(await consumer.close_round(self.room.id, 2, 'complete'))
+        self.assertFalse(await consumer.close_round(self.room.id, 1, 'complete'))
+
+        room = await sync_to_async(Room.objects.get)(id=self.room.id)
+        self.assertEqual(room.round_state, 'review')
+
+
+class LobbyTestCase(TestCase):
+    def setUp(self):
+        self.host = User.objects.create_user(username='host', password='pass')
+        self.guest = User.objects.create_user(username='guest', password='pass')
+        self.client.force_login(self.guest)
+
+    def make_rooms(self, count, **kwargs):
+        return [Room.objects.create(name=f'Room {i}', host=self.host, **kwargs) for i in range(count)]
+
+    def lobby_queries(self, url):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return response.json(), len(queries)
+
+    def test_player_count_follows_join_and_leave(self):
+        room = self.make_rooms(1, max_players=2)[0]
+        Player.objects.create(user=self.host, room=room)
+        response = self.client.post(reverse('multiplayer:join-room', args=[room.pk]))
+        self.assertEqual(response.status_code, 200)
+        room.refresh_from_db()
+        self.assertEqual(room.player_count, 2)
+
+        third = User.objects.create_user(username='third', password='pass')
+        self.client.force_login(third)
+        response = self.client.post(reverse('multiplayer:join-room', args=[room.pk]))
+        self.assertEqual(response.json()['message'], 'Room is full')
+
+        Player.objects.get(user=self.guest, room=room).delete()
+        room.refresh_from_db()
+        self.assertEqual(room.player_count, 1)
+
+    def test_room_code_is_released_once_after_commit(self):
+        room = self.make_rooms(1)[0]
+        with mock.patch.object(get_code_allocator('rooms'), 'release') as release:
+            with self.captureOnCommitCallbacks(execute=True) as callbacks:
+                room.is_active = False
+                room.save()
+                release.assert_not_called()
+            self.assertEqual(len(callbacks), 1)
+            with self.captureOnCommitCallbacks(execute=True):
+                room.name = 'Renamed'
+                room.save()
+                Room.objects.get(pk=room.pk).save()
+                room.delete()
+        release.assert_called_once_with(room.room_code)
+
+    def test_lobby_lists_active_rooms_in_constant_queries(self):
+        self.make_rooms(3)
+        _, few = self.lobby_queries(reverse('multiplayer:lobby'))
+        self.make_rooms(12)
+        self.make_rooms(2, is_active=False)
+        data, many = self.lobby_queries(reverse('multiplayer:lobby') + '?page_size=10')
+        self.assertEqual(few, many)
+        self.assertEqual(len(data['results']), 10)
+
+        data, _ = self.lobby_queries(data['next'])
+        self.assertEqual(len(data['results']), 5)
+        self.assertIsNone(data['next'])
+
+    def test_lobby_page_renders_in_constant_queries(self):
+        self.make_rooms(2)
+        with CaptureQueriesContext(connection) as few:
+            self.client.get(reverse('multiplayer:home'))
+        self.make_rooms(15)
+        with CaptureQueriesContext(connection) as many:
+            response = self.client.get(reverse('multiplayer:home'))
+        self.assertEqual(len(few), len(many))
+        self.assertContains(response, 'Room 14')
@@ -3,6 +3,7 @@ from . import views
 
 urlpatterns = [
     path('', views.multiplayer_home, name='home'),
+    path('lobby/', views.LobbyView.as_view(), name='lobby'),
     path('rooms/', views.RoomListCreateView.as_view(), name='room-list'),
     path('rooms/<int:pk>/join/', views.JoinRoomView.as_view(), name='join-room'),
     path('join-by-code/', views.JoinByCodeView.as_view(), name='join-by-code'),
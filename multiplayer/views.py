@@ -1,13 +1,18 @@
 from rest_framework import generics, status
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
+from rest_framework.pagination import CursorPagination
 from rest_framework.views import APIView
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Prefetch
 from django.shortcuts import render
 from django.contrib.auth.decorators import login_required
 from .models import Room, Player
-from .serializers import RoomSerializer, PlayerSerializer
+from .serializers import LobbyRoomSerializer, RoomSerializer, PlayerSerializer
 from channels.layers import get_channel_layer
 from asgiref.sync import async_to_sync
+from smartquizarena.encoding import encode_broadcast
 
 
 def _broadcast_room_event(room_code, event_type, message, room_data=None, extra_data=None):
@@ -21,20 +26,67 @@ def _broadcast_room_event(room_code, event_type, message, room_data=None, extra_
         event_data['room'] = room_data
     if extra_data is not None:
         event_data.update(extra_data)
+    # Encoded once here; consumers forward it to their sockets verbatim
     async_to_sync(channel_layer.group_send)(
         f'quiz_room_{room_code}',
-        event_data
+        encode_broadcast(event_data)
     )
 
+def _seat_player(user, **lookup):
+    """
+    Add ``user`` to the room matching ``lookup``.
+
+    Returns ``(room, created)``; ``created`` is None when the room is full.
+    The room row is locked while seating, so concurrent joins cannot
+    overfill it; ``player_count`` is bumped by the Player signals.
+    """
+    with transaction.atomic():
+        room = Room.objects.select_for_update().get(**lookup)
+        if room.player_count >= room.max_players:
+            return room, None
+        player, created = Player.objects.get_or_create(user=user, room=room)
+    if created:
+        room.player_count += 1
+    return room, created
+
+
+def lobby_rooms():
+    """Active rooms for the lobby, newest first, with what ``LobbyRoomSerializer`` needs."""
+    return Room.objects.filter(is_active=True).select_related('host', 'topic')
+
+
+class LobbyPagination(CursorPagination):
+    # Keyset pagination on (created_at, id): every page is an index range scan
+    ordering = ('-created_at', '-id')
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+
+    def __init__(self):
+        self.page_size = getattr(settings, 'LOBBY_PAGE_SIZE', 20)
+
+
 @login_required
 def multiplayer_home(request):
     from quizzes.models import Topic
     topics = Topic.objects.all()
-    return render(request, 'multiplayer.html', {'topics': topics})
+    open_rooms = lobby_rooms().order_by(*LobbyPagination.ordering)[:LobbyPagination().page_size]
+    return render(request, 'multiplayer.html', {'topics': topics, 'open_rooms': open_rooms})
+
+class LobbyView(generics.ListAPIView):
+    """Active rooms, newest first, one cursor page at a time."""
+    serializer_class = LobbyRoomSerializer
+    pagination_class = LobbyPagination
+    permission_classes = [IsAuthenticated]
+
+    def get_queryset(self):
+        return lobby_rooms()
 
 class RoomListCreateView(generics.ListCreateAPIView):
-    queryset = Room.objects.all()
+    queryset = Room.objects.filter(is_active=True).select_related('host', 'topic').prefetch_related(
+        Prefetch('player_set', queryset=Player.objects.select_related('user'))
+    )
     serializer_class = RoomSerializer
+    pagination_class = LobbyPagination
     permission_classes = [IsAuthenticated]
 
     def perform_create(self, serializer):
@@ -47,9 +99,8 @@ class JoinRoomView(APIView):
 
     def post(self, request, pk):
         try:
-            room = Room.objects.get(pk=pk)
-            if room.player_set.count() < room.max_players:
-                player, created = Player.objects.get_or_create(user=request.user, room=room)
+            room, created = _seat_player(request.user, pk=pk)
+            if created is not None:
                 if created:
                     return Response({'message': 'Joined room successfully'}, status=status.HTTP_200_OK)
                 else:
@@ -69,9 +120,8 @@ class JoinByCodeView(APIView):
             return Response({'error': 'Room code is required'}, status=status.HTTP_400_BAD_REQUEST)
 
         try:
-            room = Room.objects.get(room_code=room_code.upper())
-            if room.player_set.count() < room.max_players:
-                player, created = Player.objects.get_or_create(user=request.user, room=room)
+            room, created = _seat_player(request.user, room_code=room_code.upper(), is_active=True)
+            if created is not None:
                 if created:
                     # Broadcast player joined
                     _broadcast_room_event(
@@ -145,7 +195,7 @@ class StartGameView(APIView):
                 return Response({'error': 'All players must be ready to start'}, status=status.HTTP_400_BAD_REQUEST)
 
             # Check minimum players
-            if room.player_set.count() < 2:
+            if room.player_count < 2:
                 return Response({'error': 'Need at least 2 players to start'}, status=status.HTTP_400_BAD_REQUEST)
 
             # Check if topic is selected
@@ -213,15 +263,16 @@ class LeaveRoomView(APIView):
             player = Player.objects.get(user_id=user_id, room=room)
 
             # If player is host and there are other players, assign new host
-            if player.is_host and room.player_set.count() > 1:
+            if player.is_host and room.player_count > 1:
                 new_host = room.player_set.exclude(user=player.user).first()
                 new_host.is_host = True
                 new_host.save()
 
             player.delete()
+            room.refresh_from_db(fields=['player_count'])
 
             # If room is empty, delete it
-            if room.player_set.count() == 0:
+            if room.player_count == 0:
                 room.delete()
             else:
                 # Broadcast player left
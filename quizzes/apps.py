@@ -4,3 +4,10 @@ from django.apps import AppConfig
 class QuizzesConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'quizzes'
+
+    def ready(self):
+        from smartquizarena.cache import invalidate_on
+        from .models import Topic
+
+        # The home page lists every topic
+        invalidate_on('topics', Topic)
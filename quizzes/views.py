@@ -191,7 +191,7 @@ def submit_quiz(request, quiz_id):
             user=request.user,
             quiz=quiz,
             completed_at__isnull=True
-        ).order_by('-started_at').first()
+        ).select_related('quiz').order_by('-started_at').first()
         
         if not game_session:
             # Create game session if it doesn't exist (fallback)
@@ -211,35 +211,22 @@ def submit_quiz(request, quiz_id):
             game_session.total_questions = total_questions
             game_session.completed_at = timezone.now()
             game_session.user_answers = user_answers_dict  # Store user answers
-            game_session.save()
+            from django.db import transaction
+            from accounts.stats import record_game
+            with transaction.atomic():
+                game_session.save()
+                record_game(game_session)
 
-        # Update user progress only if this is the first completion of this quiz
+        # Only the first completion of a quiz adds to the user's total score
         user = request.user
-        previous_completions = GameSession.objects.filter(
+        first_completion = not GameSession.objects.filter(
             user=user,
             quiz=quiz,
             completed_at__isnull=False
-        ).exclude(id=game_session.id)
-
-        if not previous_completions.exists():
-            # First time completing this quiz, update score
-            user.total_score += score
-            user.xp += score * 10
-            user.level = user.total_score // 100 + 1
-            user.save()
-
-            # Update streak
-            from gamification.models import Streak
-            from datetime import date
-            streak, created = Streak.objects.get_or_create(user=user)
-            if streak.last_activity != date.today():
-                streak.current_streak += 1
-                if streak.current_streak > streak.longest_streak:
-                    streak.longest_streak = streak.current_streak
-            streak.save()
-
-        # Award achievements
-        AchievementService.award_achievement_on_quiz_completion(user, game_session, request)
+        ).exclude(id=game_session.id).exists()
+
+        # Update progress, streak and leaderboards, and award achievements
+        AchievementService.award_achievement_on_quiz_completion(user, game_session, request, first_completion)
 
         return JsonResponse({
             'success': True,
@@ -0,0 +1,87 @@
+"""
+Versioned, stale-while-revalidate caching for read-mostly data (the global
+leaderboard, the badge list, the topic list on the home page).
+
+``cached(resource, build)`` keeps ``build()``'s result in the Django cache
+under the resource's current version. ``invalidate(resource)`` bumps that
+version from the events that change the data (score, badge and topic
+saves), so the next read rebuilds.
+
+A value is fresh for ``RESPONSE_CACHE_FRESH`` seconds and may be served
+stale for ``RESPONSE_CACHE_STALE`` more. Once it is stale or its version is
+gone, one reader takes a short lock and rebuilds. Everyone else keeps
+getting the previous value meanwhile, so a burst of requests after a
+tournament costs one rebuild, not one per request.
+
+With the default local-memory cache, versions are per process: an event
+seen by another worker reaches this one when the fresh period ends. Set
+``CACHE_DIR`` to share a file-based cache between workers.
+"""
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models.signals import post_delete, post_save
+
+LOCK_TTL = 10
+_MISSING = object()
+
+
+def _ttls():
+    return getattr(settings, 'RESPONSE_CACHE_FRESH', 30), getattr(settings, 'RESPONSE_CACHE_STALE', 300)
+
+
+def _version_key(resource):
+    return f'swr:{resource}:version'
+
+
+def version(resource):
+    """The resource's current version, starting from a clock value so a lost version never reuses an old one."""
+    key = _version_key(resource)
+    current = cache.get(key)
+    if current is None:
+        cache.add(key, time.time_ns(), None)
+        current = cache.get(key, 1)
+    return current
+
+
+def invalidate(resource):
+    try:
+        cache.incr(_version_key(resource))
+    except ValueError:
+        pass  # no version yet, so nothing cached either
+
+
+def cached(resource, build):
+    """``build()``'s result for ``resource``, rebuilt by one caller at a time once stale or invalidated."""
+    fresh, stale = _ttls()
+    now = time.time()
+    key = f'swr:{resource}'
+    current = version(resource)
+    entry = cache.get(key, version=current)
+    if entry is not None and entry[1] > now:
+        return entry[0]
+    previous = entry[0] if entry is not None else cache.get(f'{key}:last', _MISSING)
+    lock = f'{key}:lock'
+    locked = cache.add(lock, 1, LOCK_TTL)
+    if not locked and previous is not _MISSING:
+        return previous  # someone else is rebuilding it
+    try:
+        value = build()
+        # Under the version read before building: an event during the build still forces a rebuild
+        cache.set(key, (value, now + fresh), fresh + stale, version=current)
+        cache.set(f'{key}:last', value, fresh + stale)
+    finally:
+        if locked:
+            cache.delete(lock)
+    return value
+
+
+def invalidate_on(resource, *models):
+    """Invalidate ``resource`` whenever one of ``models`` is saved or deleted."""
+    def handler(sender, **kwargs):
+        invalidate(resource)
+
+    for model in models:
+        post_save.connect(handler, sender=model, weak=False, dispatch_uid=f'swr:{resource}:{model._meta.label}')
+        post_delete.connect(handler, sender=model, weak=False, dispatch_uid=f'swr:{resource}:{model._meta.label}')
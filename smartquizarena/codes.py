@@ -0,0 +1,179 @@
+"""
+Allocation of the 6-character room and battle codes.
+
+Codes are not drawn at random and checked against the database any more.
+Each code is the image of a sequence number under a keyed Feistel
+permutation of the 36**6 possible codes, so distinct numbers always give
+distinct codes, and consecutive numbers give unrelated-looking codes.
+
+Sequence numbers are reserved in blocks: every ``CodeBlock`` row inserted
+hands this process ``BLOCK_SIZE`` numbers (the row's id times the block
+size onwards). Allocating a code is therefore O(1) with no lookups, and a
+database write happens once per block.
+
+Codes of finished rooms and battles are handed back with ``release`` and
+reused before new numbers are taken. The recycled list is per process and
+lives only as long as it: codes released by a short-lived process (such as
+the ``reap_stale`` management command) are simply never reused. That only
+costs sequence numbers, of which there are ``SPACE`` (about 2.2 billion).
+
+``ROOM_CODE_KEY`` picks the permutation. Changing it after codes have been
+issued can produce duplicates.
+"""
+import hashlib
+import string
+import threading
+
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.db import IntegrityError, transaction
+
+ALPHABET = string.ascii_uppercase + string.digits
+CODE_LENGTH = 6
+SPACE = len(ALPHABET) ** CODE_LENGTH
+BLOCK_SIZE = 100
+
+_HALF_BITS = 16
+_HALF_MASK = (1 << _HALF_BITS) - 1
+
+
+class FeistelPermutation:
+    """A keyed bijection of ``range(SPACE)`` (4-round Feistel on 32 bits, cycle-walked)."""
+
+    def __init__(self, key, rounds=4):
+        self.round_keys = [
+            hashlib.sha256(f"{key}:{index}".encode("utf8")).digest()[:16] for index in range(rounds)
+        ]
+
+    def _round(self, half, round_key):
+        digest = hashlib.blake2b(half.to_bytes(2, "big"), digest_size=2, key=round_key).digest()
+        return int.from_bytes(digest, "big")
+
+    def _forward_once(self, value):
+        left, right = value >> _HALF_BITS, value & _HALF_MASK
+        for round_key in self.round_keys:
+            left, right = right, left ^ self._round(right, round_key)
+        return (left << _HALF_BITS) | right
+
+    def _inverse_once(self, value):
+        left, right = value >> _HALF_BITS, value & _HALF_MASK
+        for round_key in reversed(self.round_keys):
+            left, right = right ^ self._round(left, round_key), left
+        return (left << _HALF_BITS) | right
+
+    def forward(self, value):
+        # Cycle walking: stay on the permutation's orbit until we land inside SPACE
+        value = self._forward_once(value)
+        while value >= SPACE:
+            value = self._forward_once(value)
+        return value
+
+    def inverse(self, value):
+        value = self._inverse_once(value)
+        while value >= SPACE:
+            value = self._inverse_once(value)
+        return value
+
+
+def encode(number):
+    chars = []
+    for _ in range(CODE_LENGTH):
+        number, digit = divmod(number, len(ALPHABET))
+        chars.append(ALPHABET[digit])
+    return "".join(reversed(chars))
+
+
+def decode(code):
+    number = 0
+    for char in code.upper():
+        number = number * len(ALPHABET) + ALPHABET.index(char)
+    return number
+
+
+def reserve_block(namespace):
+    """Reserve the next block of sequence numbers; returns its first number."""
+    from multiplayer.models import CodeBlock
+
+    return CodeBlock.objects.create(namespace=namespace).pk * BLOCK_SIZE
+
+
+class CodeAllocator:
+    def __init__(self, namespace, key, reserve=reserve_block, max_recycled=10000):
+        self.namespace = namespace
+        self.permutation = FeistelPermutation(f"{key}:{namespace}")
+        self.reserve = reserve
+        self.max_recycled = max_recycled
+        self._next = 0
+        self._end = 0
+        self._recycled = []
+        self._recycled_set = set()
+        self._lock = threading.Lock()
+
+    def allocate(self):
+        with self._lock:
+            if self._recycled:
+                code = self._recycled.pop()
+                self._recycled_set.discard(code)
+                return code
+            if self._next >= self._end:
+                self._next = self.reserve(self.namespace)
+                self._end = self._next + BLOCK_SIZE
+            number = self._next
+            self._next += 1
+        return encode(self.permutation.forward(number % SPACE))
+
+    def release(self, code):
+        """Make a finished room's or battle's code available again."""
+        with self._lock:
+            if code in self._recycled_set or len(self._recycled) >= self.max_recycled:
+                return
+            self._recycled.append(code)
+            self._recycled_set.add(code)
+
+    def sequence_number(self, code):
+        """The sequence number ``code`` was allocated for (modulo the code space)."""
+        return self.permutation.inverse(decode(code))
+
+
+def save_with_code(instance, field, namespace, save, attempts=5):
+    """
+    Fill ``instance.<field>`` with a new code if it is empty, then ``save()``.
+
+    A new code can still clash with a random code issued before this
+    allocator existed (or one recycled twice); the insert is then retried
+    with the next code.
+    """
+    if getattr(instance, field):
+        return save()
+    allocator = get_code_allocator(namespace)
+    for attempt in range(attempts):
+        setattr(instance, field, allocator.allocate())
+        try:
+            with transaction.atomic():
+                return save()
+        except IntegrityError:
+            if attempt == attempts - 1:
+                raise
+
+
+_allocators = {}
+_allocators_lock = threading.Lock()
+
+
+def get_code_allocator(namespace):
+    """Return the process-wide allocator for ``namespace`` ("rooms" or "battles")."""
+    with _allocators_lock:
+        allocator = _allocators.get(namespace)
+        if allocator is None:
+            key = getattr(settings, "ROOM_CODE_KEY", "smartquizarena-room-codes")
+            allocator = _allocators[namespace] = CodeAllocator(namespace, key)
+        return allocator
+
+
+def _reset_allocators(setting, **kwargs):
+    if setting == "ROOM_CODE_KEY":
+        with _allocators_lock:
+            _allocators.clear()
+
+
+setting_changed.connect(_reset_allocators)
@@ -8,112 +8,234 @@ from quizzes.models import Question
 # Adapt imports
 from codebattle.models import Challenge as CodingProblem
 from codebattle.services import Judge0Service
+from .deadlines import clock_sync_reply, deadline_after, round_deadline_event, round_timers
+from .encoding import EncodedEventsMixin
+from .ownership import get_room_ownership
+from .reaper import ensure_reaper
+from .rounds import RoundStateMachine
+from .state import RoomCapacityError, get_state_backend
 
 logger = logging.getLogger(__name__)
 
-# In-memory store for room state
+
+class RoomRoutingMixin:
+    """
+    Keeps each room's game loop on the worker that created it.
+
+    Actions for a room that lives on another worker are forwarded to the
+    owning consumer's channel; the owner replies to the player's own channel
+    and binds it to the room group. In a single process every room is local
+    and nothing is forwarded.
+    """
+    state_namespace = None  # "rooms" or "battles"
+
+    @property
+    def rooms(self):
+        return get_state_backend(self.state_namespace)
+
+    @property
+    def round_states(self):
+        return RoundStateMachine(self.rooms)
+
+    async def claim_new_room(self, prefix, state):
+        """Pick a fresh room name, claim it for this consumer and store ``state``."""
+        ownership = get_room_ownership()
+        while True:
+            room_name = f"{prefix}_{random.randint(1000, 9999)}"
+            if self.rooms.is_local(room_name) or not await ownership.claim(room_name, self.channel_name):
+                continue
+            try:
+                created = await self.rooms.create(room_name, state)
+            except RoomCapacityError:
+                await ownership.release(room_name, self.channel_name)
+                raise
+            if created:
+                return room_name
+            await ownership.release(room_name, self.channel_name)
+
+    async def route_to_owner(self, room_name, data):
+        """Forward ``data`` to the owner of ``room_name``. Returns True if forwarded."""
+        if not room_name or self.rooms.is_local(room_name):
+            return False
+        owner = await get_room_ownership().owner(room_name)
+        if not owner or owner == self.channel_name:
+            return False
+        await self.channel_layer.send(owner, {
+            "type": "room_action",
+            "data": data,
+            "reply_channel": self.channel_name
+        })
+        return True
+
+    async def leave_room(self):
+        """
+        Drop this player from a room that has not started yet.
+
+        Empty rooms are deleted and released straight away; rooms with a game
+        in progress are left to the backend's idle eviction.
+        """
+        room_name = getattr(self, "room_name", None)
+        if not room_name:
+            return
+        await self.channel_layer.group_discard(room_name, self.channel_name)
+        state = await self.rooms.get(room_name)
+        if state is not None and len(state["players"]) < 2 and self.player_name in state["players"]:
+            state["players"].remove(self.player_name)
+            if state["players"]:
+                await self.rooms.save(room_name, state)
+            else:
+                await self.rooms.delete(room_name)
+                round_timers.cancel(room_name)
+        await get_room_ownership().release(room_name, self.channel_name)
+        self.room_name = None
+
+    async def reply(self, payload, reply_channel=None):
+        """Send ``payload`` to the acting player, wherever their socket lives."""
+        if reply_channel is None or reply_channel == self.channel_name:
+            await self.send_event(payload)
+        else:
+            await self.channel_layer.send(reply_channel, {"type": "room_reply", "payload": payload})
+
+    async def bind_player(self, room_name, player, reply_channel=None):
+        """Add the acting player's channel to the room group and record room/player on it."""
+        channel = reply_channel or self.channel_name
+        await self.channel_layer.group_add(room_name, channel)
+        if channel == self.channel_name:
+            self.room_name = room_name
+            self.player_name = player
+        else:
+            await self.channel_layer.send(channel, {
+                "type": "room_bound",
+                "room": room_name,
+                "player": player
+            })
+
+    # --- Routing event handlers ---
+
+    async def room_action(self, event):
+        await self.dispatch_action(event["data"], event["reply_channel"])
+
+    async def room_reply(self, event):
+        await self.send_event(event["payload"])
+
+    async def room_bound(self, event):
+        self.room_name = event["room"]
+        self.player_name = event["player"]
+
+
+# Room state, stored in the "rooms" state backend
 # Structure:
 # {
 #   "room_name": {
 #       "players": ["p1", "p2"],
-#       "config": {"topic": "...", "difficulty": "...", "num_questions": 5},
+#       "config": {"topic": "...", "difficulty": "...", "num_questions": 5, "time_per_question": 20},
 #       "questions": [...], # List of question dicts
 #       "current_q_index": 0,
-#       "scores": {"p1": 0, "p2": 0},
-#       "current_answers": {}, # {"p1": idx, "p2": idx}
-#       "game_active": False
+#       "game_active": False,
+#       "results": {"scores": {...}, "answer_review": {...}} # Set when the game finishes
 #   }
 # }
-ROOMS = {}
+# Answers are recorded with rooms.record_answer(), which atomically keeps the
+# scores (rooms.scores()) and the answer history (rooms.answer_log()).
+
+class QuizConsumer(RoomRoutingMixin, EncodedEventsMixin, AsyncWebsocketConsumer):
+    state_namespace = "rooms"
 
-class QuizConsumer(AsyncWebsocketConsumer):
     async def connect(self):
+        ensure_reaper()
         await self.accept()
         logger.info("WebSocket connected")
 
     async def disconnect(self, close_code):
         logger.info(f"WebSocket disconnected: {close_code}")
-        # Logic to handle player leaving (cleanup room if empty)
-        # For now, we'll leave it simple.
+        await self.leave_room()
 
     async def receive(self, text_data=None, bytes_data=None):
         try:
-            data = json.loads(text_data)
+            data = self.decode_message(text_data, bytes_data)
         except Exception:
-            await self.send(text_data=json.dumps({"error": "invalid json"}))
+            await self.send_event({"error": "invalid json"})
             return
 
+        await self.dispatch_action(data)
+
+    async def dispatch_action(self, data, reply_channel=None):
         action = data.get("action")
+        if action in ("join", "answer") and await self.route_to_owner(data.get("room"), data):
+            return
+
         if action == "create":
             await self.handle_create(data)
         elif action == "join":
-            await self.handle_join(data)
+            await self.handle_join(data, reply_channel)
         elif action == "answer":
             await self.handle_answer(data)
+        elif action == "clock_sync":
+            reply = clock_sync_reply(data.get("client_time"))
+            reply["event"] = reply.pop("type")
+            await self.send_event(reply)
         elif action == "leave":
-            # Basic leave handling
-            pass
+            await self.leave_room()
 
     async def handle_create(self, data):
-        room_name = f"room_{random.randint(1000, 9999)}"
         player = data.get("player")
         
         config = {
             "topic": data.get("topic", "any"),
             "difficulty": data.get("difficulty", "any"),
-            "num_questions": int(data.get("num_questions", 5))
+            "num_questions": int(data.get("num_questions", 5)),
+            "time_per_question": int(data.get("time_per_question", 20))
         }
 
-        ROOMS[room_name] = {
+        room = {
             "players": [player],
             "config": config,
             "questions": [],
             "current_q_index": 0,
-            "scores": {player: 0},
-            "current_answers": {},
-            "game_active": False,
-            "answer_history": {}  # Track all answers: {player: [{q_idx, selected, correct, explanation}, ...]}
+            "game_active": False
         }
+        try:
+            room_name = await self.claim_new_room("room", room)
+        except RoomCapacityError:
+            await self.send_event({"error": "Server is full, try again later"})
+            return
 
         self.room_name = room_name
         self.player_name = player
         await self.channel_layer.group_add(room_name, self.channel_name)
 
-        await self.send(text_data=json.dumps({
+        await self.send_event({
             "event": "created",
             "room": room_name,
-            "players": ROOMS[room_name]["players"]
-        }))
+            "players": room["players"]
+        })
 
-    async def handle_join(self, data):
+    async def handle_join(self, data, reply_channel=None):
         room_name = data.get("room")
         player = data.get("player")
 
-        if not room_name or room_name not in ROOMS:
-            await self.send(text_data=json.dumps({"error": "Room not found"}))
+        room = await self.rooms.get(room_name) if room_name else None
+        if room is None:
+            await self.reply({"error": "Room not found"}, reply_channel)
             return
 
-        room = ROOMS[room_name]
         if len(room["players"]) >= 2:
-            await self.send(text_data=json.dumps({"error": "Room is full"}))
+            await self.reply({"error": "Room is full"}, reply_channel)
             return
 
         if player in room["players"]:
             player = f"{player}_{random.randint(1,99)}" # Handle duplicate names
 
         room["players"].append(player)
-        room["scores"][player] = 0
-        room["answer_history"][player] = []  # Initialize answer tracking
+        await self.rooms.save(room_name, room)
         
-        self.room_name = room_name
-        self.player_name = player
-        await self.channel_layer.group_add(room_name, self.channel_name)
+        await self.bind_player(room_name, player, reply_channel)
 
         # Notify everyone
-        await self.channel_layer.group_send(
+        await self.broadcast(
             room_name,
             {
-                "type": "player_joined_event",
+                "event": "player_joined",
                 "players": room["players"],
                 "player": player
             }
@@ -124,12 +246,13 @@ class QuizConsumer(AsyncWebsocketConsumer):
             await self.start_game(room_name)
 
     async def start_game(self, room_name):
-        room = ROOMS[room_name]
+        room = await self.rooms.get(room_name)
         room["game_active"] = True
         
         # Fetch questions
         questions = await self.fetch_questions(room["config"])
         room["questions"] = questions
+        await self.rooms.save(room_name, room)
         
         # Send first question
         await self.send_question(room_name)
@@ -239,7 +362,7 @@ class QuizConsumer(AsyncWebsocketConsumer):
         return result
 
     async def send_question(self, room_name):
-        room = ROOMS[room_name]
+        room = await self.rooms.get(room_name)
         idx = room["current_q_index"]
         
         if idx >= len(room["questions"]):
@@ -247,47 +370,68 @@ class QuizConsumer(AsyncWebsocketConsumer):
             return
 
         q = room["questions"][idx]
-        room["current_answers"] = {} # Reset for new question
+        if not await self.round_states.open(room_name, idx):
+            return  # Already sent
+
+        duration = room["config"].get("time_per_question", 20)
+        deadline = deadline_after(duration)
 
-        await self.channel_layer.group_send(
+        await self.broadcast(
             room_name,
             {
-                "type": "question_event",
+                "event": "question",
                 "question_text": q["question_text"],
                 "options": q["options"],
                 "order": idx + 1,
-                "total": len(room["questions"])
+                "total": len(room["questions"]),
+                "deadline": deadline
             }
         )
 
+        # One expiry task per question; clients count down to the deadline locally
+        round_timers.schedule(room_name, deadline, self.expire_question, room_name, idx)
+        deadline_event = round_deadline_event(deadline, duration, order=idx + 1)
+        deadline_event["event"] = deadline_event.pop("type")
+        await self.broadcast(room_name, deadline_event)
+
+    async def expire_question(self, room_name, idx):
+        """Advance past a question nobody finished answering before its deadline."""
+        if not await self.round_states.close(room_name, idx):
+            return  # Everyone answered first
+        await self.advance_question(room_name, idx)
+
+    async def advance_question(self, room_name, closed_idx):
+        """Move to the question after ``closed_idx``; only the closer of a round calls this."""
+        room = await self.rooms.get(room_name)
+        if not room or not room["game_active"]:
+            return
+        room["current_q_index"] = closed_idx + 1
+        await self.rooms.save(room_name, room)
+        await self.send_question(room_name)
+
     async def handle_answer(self, data):
         room_name = data.get("room")
         player = data.get("player")
         selected_idx = data.get("selected")
         
-        if not room_name or room_name not in ROOMS:
-            return
-
-        room = ROOMS[room_name]
-        if not room["game_active"]:
+        room = await self.rooms.get(room_name) if room_name else None
+        if not room or not room["game_active"]:
             return
             
-        # Record answer
-        if player in room["current_answers"]:
-            return # Already answered
-            
-        room["current_answers"][player] = selected_idx
-        
-        # Check correctness
+        # Record answer (atomic; the first answer per player and question wins)
         q_idx = room["current_q_index"]
+        order = data.get("order")  # Optional: the question ("order") being answered
+        if order is not None and order != q_idx + 1:
+            return # Late answer for a previous question
+        if not await self.round_states.is_open(room_name, q_idx):
+            return # Round already closed
+
+        # Check correctness
         q = room["questions"][q_idx]
         is_correct = (selected_idx == q["correct_option"])
-        
-        # Track answer in history
-        if player not in room["answer_history"]:
-            room["answer_history"][player] = []
-            
-        room["answer_history"][player].append({
+
+        # The history entry and score are stored with the answer in one atomic step
+        entry = {
             "question_index": q_idx,
             "question_text": q["question_text"],
             "selected": selected_idx,
@@ -295,117 +439,108 @@ class QuizConsumer(AsyncWebsocketConsumer):
             "is_correct": is_correct,
             "options": q["options"],
             "explanation": q.get("explanation", "No explanation available")
-        })
-        
-        if is_correct:
-            room["scores"][player] += 10 # Simple scoring
+        }
+        points = 10 if is_correct else 0 # Simple scoring
+        recorded, answer_count = await self.rooms.record_answer(room_name, q_idx, player, entry, points)
+        if not recorded:
+            return # Already answered
 
         # Penalty Logic: If this is the FIRST answer, penalize the OTHER player
-        if len(room["current_answers"]) == 1:
-            await self.channel_layer.group_send(
+        if answer_count == 1:
+            await self.broadcast(
                 room_name,
                 {
-                    "type": "time_penalty_event",
+                    "event": "time_penalty",
                     "player": player # The player who answered (so client knows who triggered it)
                 }
             )
 
         # Check if all players answered
-        if len(room["current_answers"]) == len(room["players"]):
-            # Move to next question after short delay
-            room["current_q_index"] += 1
-            await self.send_question(room_name)
+        if answer_count == len(room["players"]) and await self.round_states.close(room_name, q_idx):
+            round_timers.cancel(room_name)
+            await self.advance_question(room_name, q_idx)
 
     async def finish_game(self, room_name):
-        room = ROOMS[room_name]
-        room["game_active"] = False
-        
+        room = await self.rooms.get(room_name)
+
         # Prepare detailed results
+        scores = {player: 0 for player in room["players"]}
+        scores.update(await self.rooms.scores(room_name))
+        answer_review = {player: [] for player in room["players"]}
+        for player, entry in await self.rooms.answer_log(room_name):
+            answer_review.setdefault(player, []).append(entry)
         results = {
-            "scores": room["scores"],
-            "answer_review": room["answer_history"]
+            "scores": scores,
+            "answer_review": answer_review
         }
+
+        room["game_active"] = False
+        room["results"] = results
+        await self.rooms.save(room_name, room)
+        await self.rooms.finish(room_name)
+        round_timers.cancel(room_name)
         
-        await self.channel_layer.group_send(
+        await self.broadcast(
             room_name,
             {
-                "type": "finished_event",
+                "event": "finished",
                 "results": results
             }
         )
 
-    # --- Event Handlers ---
-
-    async def player_joined_event(self, event):
-        await self.send(text_data=json.dumps({
-            "event": "player_joined",
-            "players": event["players"],
-            "player": event["player"]
-        }))
-
-    async def question_event(self, event):
-        await self.send(text_data=json.dumps({
-            "event": "question",
-            "question_text": event["question_text"],
-            "options": event["options"],
-            "order": event["order"],
-            "total": event["total"]
-        }))
-
-    async def time_penalty_event(self, event):
-        await self.send(text_data=json.dumps({
-            "event": "time_penalty",
-            "player": event["player"]
-        }))
-
-    async def finished_event(self, event):
-        await self.send(text_data=json.dumps({
-            "event": "finished",
-            "results": event["results"]
-        }))
-
 
 # --- Coding Battle Consumer ---
 
-# In-memory store for coding battle rooms
+# Coding battle state, stored in the "battles" state backend
 # Structure:
 # {
 #   "room_name": {
 #       "players": ["p1", "p2"],
-#       "problem": {...}, # CodingProblem object or dict
+#       "problem": {...}, # serialize_problem() output
 #       "submissions": {"p1": {...}, "p2": {...}},
 #       "game_active": False,
 #       "start_time": timestamp,
 #       "difficulty": "mixed"
 #   }
 # }
-BATTLES = {}
 
-class CodingBattleConsumer(AsyncWebsocketConsumer):
+class CodingBattleConsumer(RoomRoutingMixin, EncodedEventsMixin, AsyncWebsocketConsumer):
+    state_namespace = "battles"
+
     async def connect(self):
+        ensure_reaper()
         await self.accept()
         logger.info("CodingBattle WebSocket connected")
 
     async def disconnect(self, close_code):
         logger.info(f"CodingBattle WebSocket disconnected: {close_code}")
-        # Cleanup logic could go here
+        await self.leave_room()
 
     async def receive(self, text_data=None, bytes_data=None):
         try:
-            data = json.loads(text_data)
+            data = self.decode_message(text_data, bytes_data)
         except Exception:
             return
 
+        if data.get("action") == "submit":
+            # The owning worker only knows the player through the message
+            data["room"] = getattr(self, "room_name", None)
+            data["player"] = getattr(self, "player_name", None)
+        await self.dispatch_action(data)
+
+    async def dispatch_action(self, data, reply_channel=None):
         action = data.get("action")
+        if action in ("join", "submit") and await self.route_to_owner(data.get("room"), data):
+            return
+
         if action == "create":
             await self.handle_create(data)
         elif action == "join":
-            await self.handle_join(data)
+            await self.handle_join(data, reply_channel)
         elif action == "submit":
-            await self.handle_submit(data)
+            await self.handle_submit(data, reply_channel)
 
     async def handle_create(self, data):
-        room_name = f"battle_{random.randint(1000, 9999)}"
         player = data.get("player")
         difficulty = data.get("difficulty", "mixed")
         
@@ -416,60 +551,64 @@ class CodingBattleConsumer(AsyncWebsocketConsumer):
             # Fallback if no problem found (should not happen if seeded)
             problem = await self.get_random_problem("mixed")
 
-        BATTLES[room_name] = {
+        battle = {
             "players": [player],
-            "problem": problem,
+            "problem": self.serialize_problem(problem),
             "submissions": {},
             "game_active": False,
             "start_time": None,
             "difficulty": difficulty
         }
+        try:
+            room_name = await self.claim_new_room("battle", battle)
+        except RoomCapacityError:
+            await self.send_event({"error": "Server is full, try again later"})
+            return
         
         self.room_name = room_name
         self.player_name = player
         await self.channel_layer.group_add(room_name, self.channel_name)
         
-        await self.send(text_data=json.dumps({
+        await self.send_event({
             "event": "created",
             "room": room_name,
-            "players": BATTLES[room_name]["players"],
-            "problem": self.serialize_problem(problem)
-        }))
+            "players": battle["players"],
+            "problem": battle["problem"]
+        })
 
-    async def handle_join(self, data):
+    async def handle_join(self, data, reply_channel=None):
         room_name = data.get("room")
         player = data.get("player")
         
-        if not room_name or room_name not in BATTLES:
-            await self.send(text_data=json.dumps({"error": "Room not found"}))
+        battle = await self.rooms.get(room_name) if room_name else None
+        if battle is None:
+            await self.reply({"error": "Room not found"}, reply_channel)
             return
             
-        battle = BATTLES[room_name]
         if len(battle["players"]) >= 2:
-            await self.send(text_data=json.dumps({"error": "Room is full"}))
+            await self.reply({"error": "Room is full"}, reply_channel)
             return
             
         if player in battle["players"]:
             player = f"{player}_{random.randint(1,99)}"
             
         battle["players"].append(player)
+        await self.rooms.save(room_name, battle)
         
-        self.room_name = room_name
-        self.player_name = player
-        await self.channel_layer.group_add(room_name, self.channel_name)
+        await self.bind_player(room_name, player, reply_channel)
         
         # Send acknowledgment to the joining player
-        await self.send(text_data=json.dumps({
+        await self.reply({
             "event": "joined",
             "room": room_name,
             "player": player
-        }))
+        }, reply_channel)
         
         # Notify everyone
-        await self.channel_layer.group_send(
+        await self.broadcast(
             room_name,
             {
-                "type": "player_joined_event",
+                "event": "player_joined",
                 "players": battle["players"],
                 "player": player
             }
@@ -480,47 +619,48 @@ class CodingBattleConsumer(AsyncWebsocketConsumer):
             await self.start_battle(room_name)
 
     async def start_battle(self, room_name):
-        battle = BATTLES[room_name]
+        battle = await self.rooms.get(room_name)
         battle["game_active"] = True
         battle["start_time"] = timezone.now().timestamp()
+        await self.rooms.save(room_name, battle)
         
         # Send problem to everyone (ensure joiner gets it too)
-        await self.channel_layer.group_send(
+        await self.broadcast(
             room_name,
             {
-                "type": "battle_started_event",
-                "problem": self.serialize_problem(battle["problem"])
+                "event": "battle_started",
+                "problem": battle["problem"]
             }
         )
 
-    async def handle_submit(self, data):
-        room_name = self.room_name
-        player = self.player_name
+    async def handle_submit(self, data, reply_channel=None):
+        room_name = data.get("room")
+        player = data.get("player")
         source_code = data.get("source_code")
         language_id = data.get("language_id")
         
-        if room_name not in BATTLES:
+        battle = await self.rooms.get(room_name) if room_name else None
+        if battle is None:
             return
             
-        battle = BATTLES[room_name]
         problem = battle["problem"]
         
         # Run tests via Judge0 (using utils)
         from asgiref.sync import sync_to_async
         
-        test_cases = problem.test_cases if isinstance(problem.test_cases, list) else json.loads(problem.test_cases)
+        test_cases = problem["test_cases"] if isinstance(problem["test_cases"], list) else json.loads(problem["test_cases"])
         results = []
         passed_count = 0
         total_runtime = 0.0
         
         # Notify room that player is running tests
-        await self.channel_layer.group_send(
+        await self.broadcast(
             room_name,
             {
-                "type": "submission_event",
-                "player": player,
-                "status": "running"
-            }
+                "event": "opponent_running",
+                "player": player
+            },
+            exclude=player
         )
         
         # Use Judge0Service
@@ -554,8 +694,11 @@ class CodingBattleConsumer(AsyncWebsocketConsumer):
         # Judge0Service.execute_with_test_cases returns details list.
         # It doesn't seem to return time in details explicitly in the simulated version, but real one does.
 
-        # Store submission
+        # Store submission (reload: the opponent may have submitted while we were judging)
         submission_time = timezone.now().timestamp()
+        battle = await self.rooms.get(room_name)
+        if battle is None:
+            return
         battle["submissions"][player] = {
             "passed": passed_count,
             "total": len(test_cases),
@@ -564,25 +707,27 @@ class CodingBattleConsumer(AsyncWebsocketConsumer):
             "runtime": total_runtime,
             "submission_time": submission_time
         }
+        await self.rooms.save(room_name, battle)
         
         # Send results back to submitter
-        await self.send(text_data=json.dumps({
+        await self.reply({
             "event": "submission_result",
             "passed": passed_count,
             "total": len(test_cases),
             "results": results
-        }))
+        }, reply_channel)
         
         # Notify opponent
-        await self.channel_layer.group_send(
+        await self.broadcast(
             room_name,
             {
-                "type": "opponent_submission_event",
+                "event": "opponent_result",
                 "player": player,
                 "passed": passed_count,
                 "total": len(test_cases),
                 "code": source_code # Show code as requested
-            }
+            },
+            exclude=player
         )
         
         # Check for winner (if all players submitted)
@@ -590,7 +735,7 @@ class CodingBattleConsumer(AsyncWebsocketConsumer):
             await self.determine_winner(room_name)
 
     async def determine_winner(self, room_name):
-        battle = BATTLES[room_name]
+        battle = await self.rooms.get(room_name)
         p1, p2 = battle["players"]
         
         if p1 not in battle["submissions"] or p2 not in battle["submissions"]:
@@ -630,13 +775,15 @@ class CodingBattleConsumer(AsyncWebsocketConsumer):
         await self.declare_winner(room_name, winner, reason)
 
     async def declare_winner(self, room_name, winner, reason):
-        battle = BATTLES[room_name]
+        battle = await self.rooms.get(room_name)
         battle["game_active"] = False
+        await self.rooms.save(room_name, battle)
+        await self.rooms.finish(room_name)
         
-        await self.channel_layer.group_send(
+        await self.broadcast(
             room_name,
             {
-                "type": "game_over_event",
+                "event": "game_over",
                 "winner": winner,
                 "reason": reason,
                 "submissions": battle["submissions"]
@@ -664,44 +811,3 @@ class CodingBattleConsumer(AsyncWebsocketConsumer):
             "starter_code": "", # problem.starter_code, # Not in Challenge model?
             "test_cases": problem.test_cases
         }
-
-    # --- Event Handlers ---
-
-    async def player_joined_event(self, event):
-        await self.send(text_data=json.dumps({
-            "event": "player_joined",
-            "players": event["players"],
-            "player": event["player"]
-        }))
-
-    async def battle_started_event(self, event):
-        await self.send(text_data=json.dumps({
-            "event": "battle_started",
-            "problem": event["problem"]
-        }))
-
-    async def submission_event(self, event):
-        # Notify that someone is running code
-        if event["player"] != self.player_name:
-            await self.send(text_data=json.dumps({
-                "event": "opponent_running",
-                "player": event["player"]
-            }))
-
-    async def opponent_submission_event(self, event):
-        if event["player"] != self.player_name:
-            await self.send(text_data=json.dumps({
-                "event": "opponent_result",
-                "player": event["player"],
-                "passed": event["passed"],
-                "total": event["total"],
-                "code": event["code"]
-            }))
-
-    async def game_over_event(self, event):
-        await self.send(text_data=json.dumps({
-            "event": "game_over",
-            "winner": event["winner"],
-            "reason": event["reason"],
-            "submissions": event["submissions"]
-        }))
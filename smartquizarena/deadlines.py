@@ -0,0 +1,128 @@
+"""
+Deadline-based round timers shared by the realtime consumers.
+
+Instead of broadcasting a ``timer`` event every second, the server sends a
+single ``round_deadline`` event carrying an absolute server timestamp and the
+clients render the countdown locally. Clients correct for clock skew with a
+``clock_sync`` handshake: they send their local time, the server echoes it
+back together with its own time, and the client derives the offset from the
+round trip.
+
+Exactly one expiry task runs per round. Tasks are keyed (usually by room and
+round index) in a process-wide scheduler so several consumers connected to
+the same room never start duplicate timers.
+"""
+import asyncio
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+
+def server_now_ms():
+    """Current server time as integer milliseconds since the epoch."""
+    return int(time.time() * 1000)
+
+
+def deadline_after(seconds, start_ms=None):
+    """Absolute deadline (ms) ``seconds`` after ``start_ms`` (defaults to now)."""
+    if start_ms is None:
+        start_ms = server_now_ms()
+    return int(start_ms + seconds * 1000)
+
+
+def round_deadline_event(deadline_ms, duration, **extra):
+    """
+    Build a ``round_deadline`` payload.
+
+    ``duration`` is informational (the full length of the round in seconds);
+    clients should always count down to ``deadline`` adjusted by their clock
+    offset rather than trusting their own start time.
+    """
+    payload = {
+        "type": "round_deadline",
+        "deadline": deadline_ms,
+        "server_time": server_now_ms(),
+        "duration": duration,
+    }
+    payload.update(extra)
+    return payload
+
+
+def clock_sync_reply(client_time):
+    """
+    Reply to a client ``clock_sync`` request.
+
+    The client computes ``offset = server_time - (sent + received) / 2`` from
+    the echoed ``client_time`` and its receive time.
+    """
+    return {
+        "type": "clock_sync",
+        "client_time": client_time,
+        "server_time": server_now_ms(),
+    }
+
+
+class DeadlineScheduler:
+    """
+    Keeps at most one pending expiry task per key.
+
+    Scheduling a key that already has a pending task replaces it, which is how
+    a round deadline gets shortened (e.g. the GeoGuessr first-answer clamp).
+    """
+
+    def __init__(self):
+        self._tasks = {}
+        self._deadlines = {}
+
+    def schedule(self, key, deadline_ms, callback, *args):
+        """Run ``await callback(*args)`` once ``deadline_ms`` has passed."""
+        self.cancel(key)
+        task = asyncio.create_task(self._run(key, deadline_ms, callback, args))
+        self._tasks[key] = task
+        self._deadlines[key] = deadline_ms
+        return task
+
+    def cancel(self, key):
+        """Cancel the pending task for ``key``. Returns True if one was pending."""
+        task = self._tasks.pop(key, None)
+        self._deadlines.pop(key, None)
+        if task is None or task.done():
+            return False
+        if task is asyncio.current_task():
+            # A callback cancelling its own round must not cancel itself
+            return False
+        task.cancel()
+        return True
+
+    def is_scheduled(self, key):
+        task = self._tasks.get(key)
+        return task is not None and not task.done()
+
+    def deadline_for(self, key):
+        """Pending deadline (ms) for ``key``, used to resync late joiners."""
+        if not self.is_scheduled(key):
+            return None
+        return self._deadlines.get(key)
+
+    def pending_count(self):
+        return sum(1 for task in self._tasks.values() if not task.done())
+
+    async def _run(self, key, deadline_ms, callback, args):
+        try:
+            delay = max(0.0, (deadline_ms - server_now_ms()) / 1000.0)
+            await asyncio.sleep(delay)
+            # Drop the bookkeeping before firing so the callback can schedule
+            # the next round under the same key.
+            if self._tasks.get(key) is asyncio.current_task():
+                del self._tasks[key]
+                self._deadlines.pop(key, None)
+            await callback(*args)
+        except asyncio.CancelledError:
+            return
+        except Exception:
+            logger.exception("Round expiry callback failed for %s", key)
+
+
+# Process-wide scheduler shared by all consumers
+round_timers = DeadlineScheduler()
@@ -0,0 +1,163 @@
+"""
+Negotiated wire encoding for the websocket consumers.
+
+Clients pick an encoding with the websocket subprotocol list, in order of
+preference:
+
+* ``json`` (default when nothing is offered): text frames, as before.
+* ``msgpack``: binary frames packed with MessagePack (``bytes_data``).
+* ``json.delta`` / ``msgpack.delta``: as above, and large state objects such
+  as the battle snapshot are sent as ``<field>_delta`` holding only the keys
+  that changed since the last message. Nested dicts (scores, ready flags) are
+  diffed recursively; clients deep-merge the delta into their copy.
+
+MessagePack is optional; without the ``msgpack`` package every client gets
+JSON. Incoming frames are decoded the same way, so clients may send either.
+
+Group broadcasts are encoded once by the sender (``encode_broadcast``) and
+every consumer in the group forwards the ready-made frame verbatim, instead
+of each of N consumers re-serialising the same payload.
+"""
+import json
+
+try:
+    import msgpack
+except ImportError:  # JSON only
+    msgpack = None
+
+JSON = "json"
+MSGPACK = "msgpack"
+DELTA_SUFFIX = ".delta"
+
+
+def supported_subprotocols():
+    encodings = [MSGPACK, JSON] if msgpack is not None else [JSON]
+    return [name + suffix for name in encodings for suffix in (DELTA_SUFFIX, "")]
+
+
+def negotiate(subprotocols):
+    """
+    Pick the first offered subprotocol we support.
+
+    Returns ``(subprotocol, encoding, deltas)``; ``subprotocol`` is None when
+    the client offered nothing we know, in which case plain JSON is used.
+    """
+    supported = supported_subprotocols()
+    for offered in subprotocols or []:
+        if offered in supported:
+            encoding = offered[:-len(DELTA_SUFFIX)] if offered.endswith(DELTA_SUFFIX) else offered
+            return offered, encoding, offered.endswith(DELTA_SUFFIX)
+    return None, JSON, False
+
+
+def encode(payload, encoding=JSON):
+    """Encode ``payload`` as ``(text_data, bytes_data)`` for ``send``."""
+    if encoding == MSGPACK:
+        return None, msgpack.packb(payload, use_bin_type=True)
+    return json.dumps(payload), None
+
+
+def encode_broadcast(payload, exclude=None):
+    """
+    Channel-layer event carrying ``payload`` pre-encoded in every supported
+    encoding. ``exclude`` names a player whose consumers should skip it.
+    """
+    event = {"type": "encoded.broadcast", "text": json.dumps(payload)}
+    if msgpack is not None:
+        event["bytes"] = msgpack.packb(payload, use_bin_type=True)
+    if exclude is not None:
+        event["exclude"] = exclude
+    return event
+
+
+def decode(text_data=None, bytes_data=None):
+    """Decode an incoming frame. Raises ValueError if it cannot be parsed."""
+    if bytes_data is not None:
+        if msgpack is None:
+            raise ValueError("Binary frames need msgpack")
+        try:
+            return msgpack.unpackb(bytes_data, raw=False)
+        except Exception as exc:
+            raise ValueError(str(exc)) from exc
+    return json.loads(text_data)
+
+
+def diff_state(previous, current):
+    """
+    Changes needed to turn ``previous`` into ``current``.
+
+    Returns None if a key was removed (deep-merge cannot express that, so the
+    caller should send the full state instead).
+    """
+    if any(key not in current for key in previous):
+        return None
+    changes = {}
+    for key, value in current.items():
+        old = previous.get(key)
+        if key not in previous or old != value:
+            if isinstance(value, dict) and isinstance(old, dict):
+                nested = diff_state(old, value)
+                if nested is None:
+                    return None
+                changes[key] = nested
+            else:
+                changes[key] = value
+    return changes
+
+
+class EncodedEventsMixin:
+    """
+    Adds ``send_event`` / ``decode_message`` and encoding negotiation to a
+    websocket consumer. ``accept`` picks the encoding from the subprotocols
+    the client offered.
+    """
+    encoding = JSON
+    deltas = False
+
+    async def accept(self, subprotocol=None, headers=None):
+        offered, self.encoding, self.deltas = negotiate(self.scope.get("subprotocols"))
+        self._sent_state = {}
+        await super().accept(subprotocol=subprotocol or offered, headers=headers)
+
+    async def send_event(self, payload):
+        text_data, bytes_data = encode(payload, self.encoding)
+        await self.send(text_data=text_data, bytes_data=bytes_data)
+
+    def decode_message(self, text_data=None, bytes_data=None):
+        return decode(text_data, bytes_data)
+
+    async def broadcast(self, group, payload, exclude=None):
+        """Encode ``payload`` once and deliver it to every consumer in ``group``."""
+        await self.channel_layer.group_send(group, encode_broadcast(payload, exclude))
+
+    def broadcast_identity(self):
+        """Name compared against a broadcast's ``exclude``."""
+        user = self.scope.get("user")
+        return getattr(self, "player_name", None) or getattr(user, "username", None)
+
+    async def encoded_broadcast(self, event):
+        exclude = event.get("exclude")
+        if exclude is not None and exclude == self.broadcast_identity():
+            return
+        if self.encoding == MSGPACK and "bytes" in event:
+            await self.send(bytes_data=event["bytes"])
+        else:
+            await self.send(text_data=event["text"])
+
+    def state_field(self, name, state):
+        """
+        ``{name: state}``, or ``{name + "_delta": changes}`` for delta clients
+        that already received an earlier version of ``state``.
+        """
+        if not self.deltas:
+            return {name: state}
+        sent = getattr(self, "_sent_state", None)
+        if sent is None:
+            sent = self._sent_state = {}
+        previous = sent.get(name)
+        sent[name] = state
+        if previous is not None:
+            changes = diff_state(previous, state)
+            if changes is not None:
+                return {name + "_delta": changes}
+        return {name: state}
@@ -0,0 +1,111 @@
+"""
+Room ownership routing for multi-worker deployments.
+
+The quick-play consumers in ``smartquizarena/consumers.py`` keep each room's
+game loop on a single worker: the consumer that creates a room claims it, and
+any other worker that receives an action for that room forwards it to the
+owner's channel over the channel layer instead of touching the state itself.
+
+With the in-memory channel layer everything runs in one process, so the
+registry is a plain dict. With the Redis layer the claims live in Redis
+(``SET NX`` with a TTL), sharded across the same hosts as the channel layer.
+"""
+from django.conf import settings
+from django.core.signals import setting_changed
+
+from .redis_shards import ShardedRedis
+
+KEY_PREFIX = "room_owner:"
+
+# Only delete a claim if it still belongs to the caller
+RELEASE_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+
+class InMemoryRoomOwnership:
+    """Ownership registry for single-process deployments."""
+
+    def __init__(self):
+        self._owners = {}
+
+    async def claim(self, room, channel_name):
+        """Claim ``room`` for ``channel_name``. Returns True if it is now owned by it."""
+        owner = self._owners.setdefault(room, channel_name)
+        return owner == channel_name
+
+    async def owner(self, room):
+        return self._owners.get(room)
+
+    async def refresh(self, room, channel_name):
+        return self._owners.get(room) == channel_name
+
+    async def release(self, room, channel_name):
+        if self._owners.get(room) == channel_name:
+            del self._owners[room]
+            return True
+        return False
+
+
+class RedisRoomOwnership:
+    """
+    Ownership registry shared by every worker through Redis.
+
+    ``hosts`` uses the same format as the channels_redis ``hosts`` option and
+    rooms are sharded across them by CRC32 of the room name.
+    """
+
+    def __init__(self, hosts, ttl):
+        self.redis = ShardedRedis(hosts)
+        self.ttl = ttl
+
+    def _client(self, room):
+        return self.redis.for_key(room)
+
+    async def claim(self, room, channel_name):
+        client = self._client(room)
+        key = KEY_PREFIX + room
+        if await client.set(key, channel_name, nx=True, ex=self.ttl):
+            return True
+        owner = await client.get(key)
+        return owner is not None and owner.decode("utf8") == channel_name
+
+    async def owner(self, room):
+        owner = await self._client(room).get(KEY_PREFIX + room)
+        return owner.decode("utf8") if owner is not None else None
+
+    async def refresh(self, room, channel_name):
+        if await self.owner(room) != channel_name:
+            return False
+        return bool(await self._client(room).expire(KEY_PREFIX + room, self.ttl))
+
+    async def release(self, room, channel_name):
+        client = self._client(room)
+        return bool(await client.eval(RELEASE_SCRIPT, 1, KEY_PREFIX + room, channel_name))
+
+
+_registry = None
+
+
+def get_room_ownership():
+    """Return the process-wide ownership registry configured in settings."""
+    global _registry
+    if _registry is None:
+        hosts = getattr(settings, "ROOM_OWNERSHIP_HOSTS", None)
+        if hosts:
+            _registry = RedisRoomOwnership(hosts, getattr(settings, "ROOM_OWNERSHIP_TTL", 6 * 3600))
+        else:
+            _registry = InMemoryRoomOwnership()
+    return _registry
+
+
+def _reset_registry(setting, **kwargs):
+    global _registry
+    if setting in ("ROOM_OWNERSHIP_HOSTS", "ROOM_OWNERSHIP_TTL"):
+        _registry = None
+
+
+setting_changed.connect(_reset_registry)
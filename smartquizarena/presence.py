@@ -0,0 +1,143 @@
+"""
+Coalesced presence signals (typing, ready, online, tab warnings).
+
+Clients can send presence signals as often as they like (a ``typing`` message
+per keystroke, say). The hub keeps the latest state per player in memory and
+publishes at most one ``presence`` event per player every ``interval``
+seconds. The first change after a quiet period goes out right away; changes
+made during the interval are merged and sent once at its end (trailing
+edge), and nothing is sent if the state ended up where it started.
+
+``typing`` is debounced on the server: it clears itself ``typing_timeout``
+seconds after the last keystroke, so clients do not need to send
+``stop_typing``.
+"""
+import asyncio
+import logging
+import time
+
+from django.conf import settings
+from django.core.signals import setting_changed
+
+from .encoding import encode_broadcast
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_STATE = {"online": True, "typing": False, "ready": False, "tab_warnings": 0}
+
+
+async def publish_to_group(group, payload):
+    from channels.layers import get_channel_layer
+
+    await get_channel_layer().group_send(group, encode_broadcast(payload))
+
+
+class PresenceHub:
+    def __init__(self, interval=0.5, typing_timeout=3.0, publish=publish_to_group, clock=time.monotonic):
+        self.interval = interval
+        self.typing_timeout = typing_timeout
+        self.publish = publish
+        self.clock = clock
+        self._states = {}      # group -> {username: state}
+        self._published = {}   # (group, username) -> last published state
+        self._last_sent = {}   # (group, username) -> clock() of last publish
+        self._pending = {}     # (group, username) -> flush task
+        self._typing = {}      # (group, username) -> typing expiry task
+
+    def state(self, group):
+        """Current presence of everyone in ``group``."""
+        return {username: dict(state) for username, state in self._states.get(group, {}).items()}
+
+    def update(self, group, username, **changes):
+        """Apply ``changes`` to a player's presence and schedule a coalesced publish."""
+        players = self._states.setdefault(group, {})
+        state = players.setdefault(username, dict(DEFAULT_STATE))
+        state.update(changes)
+        key = (group, username)
+        if key not in self._pending:
+            delay = max(0.0, self._last_sent.get(key, float("-inf")) + self.interval - self.clock())
+            self._pending[key] = asyncio.create_task(self._flush(key, delay))
+
+    def typing(self, group, username):
+        """Record a keystroke; typing clears after ``typing_timeout`` of silence."""
+        key = (group, username)
+        expiry = self._typing.pop(key, None)
+        if expiry is not None:
+            expiry.cancel()
+        self._typing[key] = asyncio.create_task(self._expire_typing(key))
+        self.update(group, username, typing=True)
+
+    def stop_typing(self, group, username):
+        expiry = self._typing.pop((group, username), None)
+        if expiry is not None:
+            expiry.cancel()
+        self.update(group, username, typing=False)
+
+    def tab_warning(self, group, username):
+        state = self._states.get(group, {}).get(username, DEFAULT_STATE)
+        self.update(group, username, tab_warnings=state["tab_warnings"] + 1)
+
+    def leave(self, group, username):
+        """Mark a player offline; their state is dropped once that is published."""
+        self.stop_typing(group, username)
+        self.update(group, username, online=False)
+
+    async def _expire_typing(self, key):
+        await asyncio.sleep(self.typing_timeout)
+        if self._typing.get(key) is asyncio.current_task():
+            del self._typing[key]
+            self.update(*key, typing=False)
+
+    async def _flush(self, key, delay):
+        try:
+            if delay:
+                await asyncio.sleep(delay)
+        finally:
+            self._pending.pop(key, None)
+        group, username = key
+        state = self._states.get(group, {}).get(username)
+        if state is None:
+            return
+        previous = self._published.get(key, {})
+        changed = [field for field, value in state.items() if previous.get(field) != value]
+        if changed:
+            self._published[key] = dict(state)
+            self._last_sent[key] = self.clock()
+            try:
+                await self.publish(group, {"type": "presence", "username": username, "changed": changed, **state})
+            except Exception:
+                logger.exception("Failed to publish presence for %s in %s", username, group)
+        if not state["online"] and key not in self._pending:
+            self._forget(key)
+
+    def _forget(self, key):
+        group, username = key
+        players = self._states.get(group, {})
+        players.pop(username, None)
+        if not players:
+            self._states.pop(group, None)
+        self._published.pop(key, None)
+        self._last_sent.pop(key, None)
+
+
+_hub = None
+
+
+def get_presence_hub():
+    """Return the process-wide presence hub configured in settings."""
+    global _hub
+    if _hub is None:
+        _hub = PresenceHub(
+            interval=getattr(settings, "PRESENCE_INTERVAL", 0.5),
+            typing_timeout=getattr(settings, "PRESENCE_TYPING_TIMEOUT", 3.0),
+        )
+    return _hub
+
+
+def _reset_hub(setting, **kwargs):
+    global _hub
+    if setting.startswith("PRESENCE_"):
+        _hub = None
+
+
+setting_changed.connect(_reset_hub)
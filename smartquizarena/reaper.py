@@ -0,0 +1,175 @@
+"""
+Expiry of abandoned rooms and battles.
+
+Nothing else ever closes a room whose players just walked away, or a battle
+nobody joined, so ``reap`` does it:
+
+* multiplayer rooms that are still active but saw no activity (creation,
+  start or round start) for ``REAPER_ROOM_TTL`` seconds are closed
+  (``is_active=False``, ``quiz_state='finished'``) and their codes recycled
+  (see below);
+* code battles still waiting for players after ``REAPER_WAITING_BATTLE_TTL``
+  seconds are deleted, which recycles their codes;
+* code battles in progress for longer than ``REAPER_BATTLE_TTL`` seconds are
+  marked completed without a winner or final scores (so they are never
+  rated) and dropped from the finish ledger.
+
+Rows are handled ``batch_size`` at a time, each batch in its own short
+transaction, so a large backlog never holds locks for long.
+
+``reap_memory`` evicts idle quick-play rooms and battles from this worker's
+state backends. ``ensure_reaper`` starts a task in the running event loop
+that does both every ``REAPER_INTERVAL`` seconds (0 disables it); the
+``reap_stale`` management command runs the database part from cron.
+
+Freed codes go to the calling process's ``CodeAllocator`` free list, so they
+are only reused when the reaper runs inside a worker (``REAPER_INTERVAL``).
+The management command exits right after its run and its released codes are
+dropped; rooms and battles are still closed, only fewer codes get recycled.
+"""
+import asyncio
+import logging
+from datetime import timedelta
+
+from channels.db import database_sync_to_async
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from .codes import get_code_allocator
+from .state import get_state_backend
+
+logger = logging.getLogger(__name__)
+
+REAPED_KINDS = ('rooms', 'waiting_battles', 'stale_battles')
+
+
+def _ttl(name, default):
+    return timedelta(seconds=getattr(settings, name, default))
+
+
+def _batches(queryset, fields, batch_size, max_batches):
+    for _ in range(max_batches):
+        rows = list(queryset.values_list(*fields)[:batch_size])
+        if not rows:
+            return
+        yield rows
+
+
+def reap_rooms(now, batch_size, max_batches):
+    from multiplayer.models import Room
+
+    cutoff = now - _ttl('REAPER_ROOM_TTL', 6 * 3600)
+    idle = Room.objects.filter(
+        Q(started_at__isnull=True) | Q(started_at__lt=cutoff),
+        Q(round_start_time__isnull=True) | Q(round_start_time__lt=cutoff),
+        is_active=True, created_at__lt=cutoff,
+    ).order_by('pk')
+    allocator = get_code_allocator('rooms')
+    reaped = 0
+    for rows in _batches(idle, ('pk', 'room_code'), batch_size, max_batches):
+        with transaction.atomic():
+            # update() sends no post_save, so codes are released below
+            reaped += Room.objects.filter(pk__in=[pk for pk, _ in rows], is_active=True).update(
+                is_active=False, quiz_state='finished'
+            )
+        for _, code in rows:
+            if code:
+                allocator.release(code)
+    return reaped
+
+
+def reap_waiting_battles(now, batch_size, max_batches):
+    from codebattle.models import Battle
+
+    cutoff = now - _ttl('REAPER_WAITING_BATTLE_TTL', 3600)
+    waiting = Battle.objects.filter(status='waiting', started_at__lt=cutoff).order_by('pk')
+    reaped = 0
+    for rows in _batches(waiting, ('pk',), batch_size, max_batches):
+        with transaction.atomic():
+            # Per-row post_delete recycles the code and drops cached snapshots
+            reaped += Battle.objects.filter(pk__in=[pk for pk, in rows], status='waiting').delete()[1].get(
+                Battle._meta.label, 0
+            )
+    return reaped
+
+
+def reap_stale_battles(now, batch_size, max_batches):
+    from accounts.stats import record_battle
+    from codebattle.finishes import finish_ledger
+    from codebattle.models import Battle
+    from codebattle.snapshots import invalidate_battle
+
+    cutoff = now - _ttl('REAPER_BATTLE_TTL', 6 * 3600)
+    stale = Battle.objects.filter(status='in_progress', started_at__lt=cutoff).order_by('pk')
+    reaped = 0
+    for rows in _batches(stale, ('pk',), batch_size, max_batches):
+        ids = [pk for pk, in rows]
+        with transaction.atomic():
+            closing = list(Battle.objects.select_for_update().filter(pk__in=ids, status='in_progress').only(
+                'player1_id', 'player2_id'
+            ))
+            reaped += Battle.objects.filter(pk__in=[battle.pk for battle in closing]).update(
+                status='completed', completed_at=now, winner=None, scores=None
+            )
+            for battle in closing:
+                record_battle(battle)
+        for battle_id in ids:
+            invalidate_battle(battle_id)
+            finish_ledger.forget(battle_id)
+    return reaped
+
+
+def reap(now=None, batch_size=None, max_batches=None):
+    """Close idle rooms and battles. Returns ``{kind: count}`` for ``REAPED_KINDS``."""
+    now = now or timezone.now()
+    batch_size = batch_size or getattr(settings, 'REAPER_BATCH_SIZE', 500)
+    max_batches = max_batches or getattr(settings, 'REAPER_MAX_BATCHES', 20)
+    counts = {
+        'rooms': reap_rooms(now, batch_size, max_batches),
+        'waiting_battles': reap_waiting_battles(now, batch_size, max_batches),
+        'stale_battles': reap_stale_battles(now, batch_size, max_batches),
+    }
+    if any(counts.values()):
+        logger.info("Reaped %s", ", ".join(f"{count} {kind}" for kind, count in counts.items()))
+    return counts
+
+
+async def reap_memory():
+    """Evict idle quick-play rooms and battles held by this worker. Returns ``{namespace: count}``."""
+    return {namespace: await get_state_backend(namespace).evict_idle() for namespace in ('rooms', 'battles')}
+
+
+async def _reap_loop(interval):
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            await database_sync_to_async(reap)()
+            await reap_memory()
+        except Exception:
+            logger.exception("Reaper run failed")
+
+
+_task = None
+
+
+def ensure_reaper():
+    """Start the in-process reaper in the running event loop, once, if ``REAPER_INTERVAL`` is set."""
+    global _task
+    interval = getattr(settings, 'REAPER_INTERVAL', 0)
+    if not interval or (_task is not None and not _task.done()):
+        return _task
+    _task = asyncio.get_running_loop().create_task(_reap_loop(interval))
+    return _task
+
+
+def _reset_reaper(setting, **kwargs):
+    global _task
+    if setting == 'REAPER_INTERVAL' and _task is not None:
+        _task.cancel()
+        _task = None
+
+
+setting_changed.connect(_reset_reaper)
@@ -0,0 +1,48 @@
+"""
+Redis connections shared by the realtime helpers (room ownership, room state).
+
+Keys are spread over the configured hosts by CRC32, the same way
+channels_redis spreads channels, so adding a host to ``REDIS_URL`` scales all
+of them together.
+"""
+import asyncio
+import binascii
+import weakref
+
+
+class ShardedRedis:
+    """Per-event-loop Redis clients for a list of channels_redis style hosts."""
+
+    def __init__(self, hosts):
+        self.hosts = list(hosts)
+        # Redis connections are bound to an event loop
+        self._clients = weakref.WeakKeyDictionary()
+
+    @staticmethod
+    def _pool(host):
+        from channels_redis.utils import create_pool
+        from redis import asyncio as aioredis
+
+        if "master_name" in host:
+            return create_pool(host)
+        # Bursts (e.g. a whole room answering at once) wait for a free
+        # connection instead of failing with MaxConnectionsError.
+        host = host.copy()
+        if "address" in host:
+            return aioredis.BlockingConnectionPool.from_url(host.pop("address"), **host)
+        return aioredis.BlockingConnectionPool(**host)
+
+    def all_clients(self):
+        from channels_redis.utils import decode_hosts
+        from redis import asyncio as aioredis
+
+        loop = asyncio.get_running_loop()
+        clients = self._clients.get(loop)
+        if clients is None:
+            clients = [aioredis.Redis(connection_pool=self._pool(host)) for host in decode_hosts(self.hosts)]
+            self._clients[loop] = clients
+        return clients
+
+    def for_key(self, key):
+        clients = self.all_clients()
+        return clients[binascii.crc32(key.encode("utf8")) % len(clients)]
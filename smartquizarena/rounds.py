@@ -0,0 +1,32 @@
+"""
+Round state machine for the quick-play quiz rooms.
+
+Each round moves ``open -> closed`` exactly once. A round can be closed by
+the last player answering or by its deadline expiring, and both can happen
+at the same moment; only the caller whose compare-and-set succeeds advances
+the room, so a question is never skipped and never sent twice.
+
+The state is stored as ``[round_index, "open" | "closed"]`` in the room's
+state backend, which makes the transition atomic (a per-room asyncio lock in
+process, a Lua script in Redis).
+"""
+
+OPEN = "open"
+CLOSED = "closed"
+
+
+class RoundStateMachine:
+    def __init__(self, backend):
+        self.backend = backend
+
+    async def open(self, room, index):
+        """Open round ``index``; the previous round must have been closed."""
+        previous = [index - 1, CLOSED] if index > 0 else None
+        return await self.backend.compare_and_set_round(room, previous, [index, OPEN])
+
+    async def close(self, room, index):
+        """Close round ``index``. Returns True for exactly one caller."""
+        return await self.backend.compare_and_set_round(room, [index, OPEN], [index, CLOSED])
+
+    async def is_open(self, room, index):
+        return await self.backend.get_round(room) == [index, OPEN]
@@ -11,7 +11,7 @@ https://docs.djangoproject.com/en/5.2/ref/settings/
 """
 
 from pathlib import Path
-from decouple import config
+from decouple import config, Csv
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
@@ -153,11 +153,118 @@ STATIC_ROOT = BASE_DIR / 'staticfiles'
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 # Channels
-CHANNEL_LAYERS = {
+# 'memory' keeps everything in one daphne process. 'redis' supports several
+# processes/nodes; list more than one REDIS_URL (comma separated) to shard
+# channels and groups across Redis instances.
+CHANNEL_LAYER_BACKEND = config('CHANNEL_LAYER_BACKEND', default='memory')
+REDIS_URLS = config('REDIS_URL', default='redis://127.0.0.1:6379/0', cast=Csv())
+
+if CHANNEL_LAYER_BACKEND == 'redis':
+    CHANNEL_LAYERS = {
+        'default': {
+            'BACKEND': 'channels_redis.core.RedisChannelLayer',
+            'CONFIG': {
+                'hosts': REDIS_URLS,
+                'prefix': config('CHANNEL_LAYER_PREFIX', default='sqa'),
+                'capacity': config('CHANNEL_LAYER_CAPACITY', default=1500, cast=int),
+                'group_expiry': config('CHANNEL_LAYER_GROUP_EXPIRY', default=86400, cast=int),
+            },
+        },
+    }
+    # Room ownership claims and room state live next to the channel layer
+    ROOM_OWNERSHIP_HOSTS = REDIS_URLS
+    ROOM_STATE_HOSTS = REDIS_URLS
+else:
+    CHANNEL_LAYERS = {
+        'default': {
+            'BACKEND': 'channels.layers.InMemoryChannelLayer',
+        },
+    }
+    ROOM_OWNERSHIP_HOSTS = []
+    ROOM_STATE_HOSTS = []
+
+ROOM_OWNERSHIP_TTL = config('ROOM_OWNERSHIP_TTL', default=6 * 3600, cast=int)
+
+# Quick-play room state (smartquizarena/state.py)
+ROOM_STATE_IDLE_TTL = config('ROOM_STATE_IDLE_TTL', default=3600, cast=int)
+ROOM_STATE_MAX_ROOMS = config('ROOM_STATE_MAX_ROOMS', default=5000, cast=int)
+ROOM_STATE_FINISHED_CAPACITY = config('ROOM_STATE_FINISHED_CAPACITY', default=200, cast=int)
+ROOM_STATE_FINISHED_TTL = config('ROOM_STATE_FINISHED_TTL', default=600, cast=int)
+
+# Presence (typing/ready/online/tab warnings) is published at most once per
+# player every PRESENCE_INTERVAL seconds; typing clears after a quiet period
+PRESENCE_INTERVAL = config('PRESENCE_INTERVAL', default=0.5, cast=float)
+PRESENCE_TYPING_TIMEOUT = config('PRESENCE_TYPING_TIMEOUT', default=3.0, cast=float)
+
+# Coding battle snapshots are cached (and invalidated on every save) for this long;
+# the parts that change during play only when CACHE_DIR shares the cache
+BATTLE_SNAPSHOT_TTL = config('BATTLE_SNAPSHOT_TTL', default=300, cast=int)
+
+# Rooms per page in the multiplayer lobby (cursor paginated)
+LOBBY_PAGE_SIZE = config('LOBBY_PAGE_SIZE', default=20, cast=int)
+
+# Stale room and battle reaper (smartquizarena/reaper.py); TTLs in seconds.
+# REAPER_INTERVAL > 0 also runs it inside every ASGI worker, which is the only
+# place freed room/battle codes are recycled (the free list is per process).
+REAPER_ROOM_TTL = config('REAPER_ROOM_TTL', default=6 * 3600, cast=int)
+REAPER_WAITING_BATTLE_TTL = config('REAPER_WAITING_BATTLE_TTL', default=3600, cast=int)
+REAPER_BATTLE_TTL = config('REAPER_BATTLE_TTL', default=6 * 3600, cast=int)
+REAPER_BATCH_SIZE = config('REAPER_BATCH_SIZE', default=500, cast=int)
+REAPER_MAX_BATCHES = config('REAPER_MAX_BATCHES', default=20, cast=int)
+REAPER_INTERVAL = config('REAPER_INTERVAL', default=0, cast=int)
+
+# Global leaderboard (gamification/leaderboard.py): in-process skip list by
+# default, or a Redis sorted set shared by all workers when a URL is given.
+# The in-process list only sees its own workers' score changes and is reloaded
+# from the database every LEADERBOARD_RELOAD_INTERVAL seconds (0 = never); set
+# the URL when run_postgame_worker applies results (POSTGAME_INLINE off) or
+# several ASGI workers serve the leaderboard.
+LEADERBOARD_REDIS_URL = config('LEADERBOARD_REDIS_URL', default='')
+LEADERBOARD_RELOAD_INTERVAL = config('LEADERBOARD_RELOAD_INTERVAL', default=60, cast=int)
+
+# Badge rules engine (gamification/rules.py): earned-badge sets cached per
+# worker, badge index rebuilt at least every BADGE_INDEX_TTL seconds
+ACHIEVEMENT_CACHE_USERS = config('ACHIEVEMENT_CACHE_USERS', default=10000, cast=int)
+BADGE_INDEX_TTL = config('BADGE_INDEX_TTL', default=300, cast=int)
+
+# Cached total user count shown on profiles (adjusted on signup and deletion)
+USER_COUNT_TTL = config('USER_COUNT_TTL', default=300, cast=int)
+
+# Read-mostly pages (leaderboard, badges, topics) are cached with versioned
+# keys and served stale for a while during a rebuild (smartquizarena/cache.py).
+# Memory is per process; CACHE_DIR switches to a file cache shared by workers.
+CACHE_DIR = config('CACHE_DIR', default='')
+CACHES = {
     'default': {
-        'BACKEND': 'channels.layers.InMemoryChannelLayer',
-    },
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': CACHE_DIR,
+    } if CACHE_DIR else {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    }
 }
+RESPONSE_CACHE_FRESH = config('RESPONSE_CACHE_FRESH', default=30, cast=int)
+RESPONSE_CACHE_STALE = config('RESPONSE_CACHE_STALE', default=300, cast=int)
+
+# Post-game accounting queue (gamification/jobs.py). POSTGAME_INLINE runs
+# each job in the ASGI worker right after the results are broadcast; the
+# run_postgame_worker command drains the rest (retries, leases expired).
+POSTGAME_INLINE = config('POSTGAME_INLINE', default=True, cast=bool)
+POSTGAME_MAX_ATTEMPTS = config('POSTGAME_MAX_ATTEMPTS', default=5, cast=int)
+POSTGAME_LEASE = config('POSTGAME_LEASE', default=60, cast=int)
+
+# Glicko-2 skill ratings (gamification/ratings.py): how fast volatility may change
+RATING_TAU = config('RATING_TAU', default=0.5, cast=float)
+
+# Code battle matchmaking: players match within MATCHMAKING_RATING_BAND rating
+# points, widened by MATCHMAKING_BAND_GROWTH per second waited (0 = ignore ratings)
+MATCHMAKING_RATING_BAND = config('MATCHMAKING_RATING_BAND', default=200, cast=int)
+MATCHMAKING_BAND_GROWTH = config('MATCHMAKING_BAND_GROWTH', default=25, cast=float)
+MATCHMAKING_MAX_BAND = config('MATCHMAKING_MAX_BAND', default=1000, cast=int)
+MATCHMAKING_SWEEP_INTERVAL = config('MATCHMAKING_SWEEP_INTERVAL', default=1.0, cast=float)
+
+# Key of the permutation that turns sequence numbers into room/battle codes.
+# Do not change it once codes have been handed out.
+ROOM_CODE_KEY = config('ROOM_CODE_KEY', default='smartquizarena-room-codes')
 
 # CORS settings
 CORS_ALLOWED_ORIGINS = [
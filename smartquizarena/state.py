@@ -0,0 +1,390 @@
+"""
+Storage for the quick-play room state used by ``smartquizarena/consumers.py``.
+
+Every room (``QuizConsumer``) and battle (``CodingBattleConsumer``) is a plain
+JSON-serialisable dict. Consumers load it with ``get``, mutate it and write it
+back with ``save``, which only writes the top-level keys that changed. Answers
+are recorded separately with ``record_answer``, which also adds the answer's
+points to the player's score and appends it to the room's answer log in the
+same atomic step, so two players answering at once can never overwrite each
+other. The round state (see ``rounds.py``) only changes through
+``compare_and_set_round``.
+
+Two backends implement the same interface:
+
+* ``InMemoryStateBackend`` keeps rooms in the worker process. Idle rooms are
+  evicted after ``idle_ttl`` seconds, the number of live rooms is capped, and
+  finished games are kept in a small LRU so late result requests still work.
+* ``RedisStateBackend`` stores each room as a Redis hash (one JSON-encoded
+  field per top-level key) with a TTL, and records answers with a Lua script
+  that also increments the player's score (``HINCRBY``) and appends to the
+  answer log (``RPUSH``).
+
+``get_state_backend(namespace)`` returns the backend configured in settings.
+"""
+import asyncio
+import json
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.signals import setting_changed
+
+from .redis_shards import ShardedRedis
+
+
+class RoomCapacityError(Exception):
+    """Raised when no more rooms can be created on this worker."""
+
+
+class LoadedState(dict):
+    """A room state read from a shared store; remembers the encoded fields it was loaded with."""
+    __slots__ = ("loaded",)
+
+    def __init__(self, state, loaded):
+        super().__init__(state)
+        self.loaded = loaded
+
+
+class InMemoryStateBackend:
+    """Room state held in the worker's memory."""
+
+    def __init__(self, idle_ttl=3600, max_rooms=5000, finished_capacity=200, clock=time.monotonic):
+        self.idle_ttl = idle_ttl
+        self.max_rooms = max_rooms
+        self.finished_capacity = finished_capacity
+        self.clock = clock
+        self._rooms = {}
+        self._touched = {}
+        self._answers = {}
+        self._scores = {}
+        self._log = {}
+        self._rounds = {}
+        self._locks = {}
+        self._finished = OrderedDict()
+
+    def is_local(self, room):
+        """True if ``room`` lives in this process (always False for shared stores)."""
+        return room in self._rooms or room in self._finished
+
+    async def create(self, room, state):
+        """Store a new room. Returns False if the name is already taken."""
+        if self.is_local(room):
+            return False
+        if len(self._rooms) >= self.max_rooms:
+            await self.evict_idle()
+            if len(self._rooms) >= self.max_rooms:
+                raise RoomCapacityError(f"Room limit of {self.max_rooms} reached")
+        self._rooms[room] = state
+        self._touched[room] = self.clock()
+        return True
+
+    async def get(self, room):
+        if room in self._rooms:
+            self._touched[room] = self.clock()
+            return self._rooms[room]
+        if room in self._finished:
+            self._finished.move_to_end(room)
+            return self._finished[room]
+        return None
+
+    async def save(self, room, state):
+        if room in self._finished:
+            self._finished[room] = state
+            return
+        self._rooms[room] = state
+        self._touched[room] = self.clock()
+
+    async def delete(self, room):
+        self._rooms.pop(room, None)
+        self._touched.pop(room, None)
+        self._answers.pop(room, None)
+        self._scores.pop(room, None)
+        self._log.pop(room, None)
+        self._rounds.pop(room, None)
+        self._locks.pop(room, None)
+        self._finished.pop(room, None)
+
+    async def finish(self, room):
+        """Move a game to the finished LRU, freeing its live slot."""
+        state = self._rooms.pop(room, None)
+        self._touched.pop(room, None)
+        self._answers.pop(room, None)
+        self._scores.pop(room, None)
+        self._log.pop(room, None)
+        self._rounds.pop(room, None)
+        self._locks.pop(room, None)
+        if state is None:
+            return
+        self._finished[room] = state
+        while len(self._finished) > self.finished_capacity:
+            self._finished.popitem(last=False)
+
+    async def record_answer(self, room, round_index, player, answer, points=0):
+        """
+        Record ``player``'s answer for a round unless they already answered.
+
+        A recorded answer adds ``points`` to the player's score and is
+        appended to the room's answer log. Returns ``(recorded, answer_count)``.
+        """
+        answers = self._answers.setdefault(room, {}).setdefault(round_index, {})
+        if player in answers:
+            return False, len(answers)
+        answers[player] = answer
+        scores = self._scores.setdefault(room, {})
+        scores[player] = scores.get(player, 0) + points
+        self._log.setdefault(room, []).append((player, answer))
+        return True, len(answers)
+
+    async def answers(self, room, round_index):
+        return dict(self._answers.get(room, {}).get(round_index, {}))
+
+    async def scores(self, room):
+        """Points scored through ``record_answer``, by player."""
+        return dict(self._scores.get(room, {}))
+
+    async def answer_log(self, room):
+        """Every recorded answer as ``(player, answer)``, in recording order."""
+        return list(self._log.get(room, []))
+
+    async def get_round(self, room):
+        return self._rounds.get(room)
+
+    async def compare_and_set_round(self, room, expected, new):
+        """Set the round state to ``new`` only if it is currently ``expected``."""
+        lock = self._locks.setdefault(room, asyncio.Lock())
+        async with lock:
+            if self._rounds.get(room) != expected:
+                return False
+            self._rounds[room] = new
+            return True
+
+    async def evict_idle(self):
+        """Drop rooms nobody touched for ``idle_ttl`` seconds. Returns how many."""
+        cutoff = self.clock() - self.idle_ttl
+        stale = [room for room, touched in self._touched.items() if touched < cutoff]
+        for room in stale:
+            await self.delete(room)
+        return len(stale)
+
+    async def count(self):
+        """Number of live (not finished) rooms."""
+        return len(self._rooms)
+
+
+# Create the room hash only if it does not exist yet
+CREATE_SCRIPT = """
+if redis.call('EXISTS', KEYS[1]) == 1 then
+    return 0
+end
+redis.call('HSET', KEYS[1], unpack(ARGV, 2))
+redis.call('EXPIRE', KEYS[1], ARGV[1])
+return 1
+"""
+
+# Write the changed fields of an existing room and refresh its TTL.
+# ARGV: idle TTL, finished TTL, finished marker, number of removed fields,
+# the removed fields, then field/value pairs
+SAVE_SCRIPT = """
+if redis.call('EXISTS', KEYS[1]) == 0 then
+    return 0
+end
+local removed = tonumber(ARGV[4])
+if removed > 0 then
+    redis.call('HDEL', KEYS[1], unpack(ARGV, 5, 4 + removed))
+end
+if #ARGV > 4 + removed then
+    redis.call('HSET', KEYS[1], unpack(ARGV, 5 + removed))
+end
+if redis.call('HEXISTS', KEYS[1], ARGV[3]) == 1 then
+    redis.call('EXPIRE', KEYS[1], ARGV[2])
+else
+    redis.call('EXPIRE', KEYS[1], ARGV[1])
+end
+return 1
+"""
+
+# First answer wins; a recorded answer is added to the player's score and
+# appended to the answer log. Returns {recorded, answer_count}
+RECORD_ANSWER_SCRIPT = """
+local recorded = redis.call('HSETNX', KEYS[1], ARGV[1], ARGV[2])
+if recorded == 1 then
+    redis.call('HINCRBY', KEYS[2], ARGV[1], ARGV[4])
+    redis.call('RPUSH', KEYS[3], ARGV[5])
+    redis.call('EXPIRE', KEYS[2], ARGV[3])
+    redis.call('EXPIRE', KEYS[3], ARGV[3])
+end
+redis.call('EXPIRE', KEYS[1], ARGV[3])
+return {recorded, redis.call('HLEN', KEYS[1])}
+"""
+
+# Compare-and-set on the round key; an empty expected value means "unset"
+ROUND_CAS_SCRIPT = """
+local current = redis.call('GET', KEYS[1])
+if (current == false and ARGV[1] == '') or current == ARGV[1] then
+    redis.call('SET', KEYS[1], ARGV[2], 'EX', ARGV[3])
+    return 1
+end
+return 0
+"""
+
+FINISHED_FIELD = "__finished"
+
+
+class RedisStateBackend:
+    """
+    Room state shared by every worker through Redis.
+
+    Redis enforces the memory limits itself: live rooms expire ``idle_ttl``
+    seconds after their last save and finished games after ``finished_ttl``.
+    """
+
+    def __init__(self, hosts, namespace, idle_ttl=3600, finished_ttl=600):
+        self.redis = ShardedRedis(hosts)
+        self.prefix = f"room_state:{namespace}:"
+        self.idle_ttl = idle_ttl
+        self.finished_ttl = finished_ttl
+
+    def is_local(self, room):
+        return False
+
+    def _key(self, room):
+        return self.prefix + room
+
+    def _client(self, room):
+        # All keys of a room live on the same shard
+        return self.redis.for_key(room)
+
+    @staticmethod
+    def _encode(state):
+        return {field: json.dumps(value) for field, value in state.items()}
+
+    async def create(self, room, state):
+        args = [self.idle_ttl]
+        for field, value in self._encode(state).items():
+            args.extend((field, value))
+        return bool(await self._client(room).eval(CREATE_SCRIPT, 1, self._key(room), *args))
+
+    async def get(self, room):
+        raw = await self._client(room).hgetall(self._key(room))
+        if not raw:
+            return None
+        loaded = {
+            field.decode("utf8"): value.decode("utf8")
+            for field, value in raw.items()
+            if field.decode("utf8") != FINISHED_FIELD
+        }
+        return LoadedState({field: json.loads(value) for field, value in loaded.items()}, loaded)
+
+    async def save(self, room, state):
+        """
+        Write the top-level keys of ``state`` that changed since ``get``.
+
+        Keys written by other workers in the meantime are left alone, and a
+        room that expired or was deleted is not brought back.
+        """
+        encoded = self._encode(state)
+        loaded = getattr(state, "loaded", {})
+        removed = [field for field in loaded if field not in encoded]
+        args = [self.idle_ttl, self.finished_ttl, FINISHED_FIELD, len(removed), *removed]
+        for field, value in encoded.items():
+            if loaded.get(field) != value:
+                args.extend((field, value))
+        await self._client(room).eval(SAVE_SCRIPT, 1, self._key(room), *args)
+        if isinstance(state, LoadedState):
+            state.loaded = encoded
+
+    async def delete(self, room):
+        client = self._client(room)
+        keys = [self._key(room), self._key(room) + ":round", self._key(room) + ":scores", self._key(room) + ":log"]
+        async for key in client.scan_iter(match=self._key(room) + ":answers:*"):
+            keys.append(key)
+        await client.delete(*keys)
+
+    async def finish(self, room):
+        client = self._client(room)
+        key = self._key(room)
+        if not await client.exists(key):
+            return
+        async with client.pipeline(transaction=True) as pipe:
+            pipe.hset(key, FINISHED_FIELD, 1)
+            pipe.expire(key, self.finished_ttl)
+            await pipe.execute()
+
+    async def record_answer(self, room, round_index, player, answer, points=0):
+        key = self._key(room)
+        recorded, count = await self._client(room).eval(
+            RECORD_ANSWER_SCRIPT, 3, f"{key}:answers:{round_index}", f"{key}:scores", f"{key}:log",
+            player, json.dumps(answer), self.idle_ttl, points, json.dumps([player, answer])
+        )
+        return bool(recorded), count
+
+    async def answers(self, room, round_index):
+        raw = await self._client(room).hgetall(f"{self._key(room)}:answers:{round_index}")
+        return {player.decode("utf8"): json.loads(value) for player, value in raw.items()}
+
+    async def scores(self, room):
+        raw = await self._client(room).hgetall(self._key(room) + ":scores")
+        return {player.decode("utf8"): int(points) for player, points in raw.items()}
+
+    async def answer_log(self, room):
+        raw = await self._client(room).lrange(self._key(room) + ":log", 0, -1)
+        return [tuple(json.loads(entry)) for entry in raw]
+
+    async def get_round(self, room):
+        raw = await self._client(room).get(self._key(room) + ":round")
+        return json.loads(raw) if raw is not None else None
+
+    async def compare_and_set_round(self, room, expected, new):
+        # Round states are small lists, so their JSON encoding is canonical
+        expected = json.dumps(expected) if expected is not None else ""
+        return bool(await self._client(room).eval(
+            ROUND_CAS_SCRIPT, 1, self._key(room) + ":round", expected, json.dumps(new), self.idle_ttl
+        ))
+
+    async def evict_idle(self):
+        # Keys expire on their own
+        return 0
+
+    async def count(self):
+        total = 0
+        for client in self.redis.all_clients():
+            async for key in client.scan_iter(match=self.prefix + "*"):
+                # Skip the per-room ":answers:<n>", ":round", ":scores" and ":log" keys
+                if key.count(b":") > 2 or await client.hexists(key, FINISHED_FIELD):
+                    continue
+                total += 1
+        return total
+
+
+_backends = {}
+
+
+def get_state_backend(namespace):
+    """Return the process-wide state backend for ``namespace`` ("rooms" or "battles")."""
+    backend = _backends.get(namespace)
+    if backend is None:
+        hosts = getattr(settings, "ROOM_STATE_HOSTS", None)
+        idle_ttl = getattr(settings, "ROOM_STATE_IDLE_TTL", 3600)
+        if hosts:
+            backend = RedisStateBackend(
+                hosts, namespace,
+                idle_ttl=idle_ttl,
+                finished_ttl=getattr(settings, "ROOM_STATE_FINISHED_TTL", 600),
+            )
+        else:
+            backend = InMemoryStateBackend(
+                idle_ttl=idle_ttl,
+                max_rooms=getattr(settings, "ROOM_STATE_MAX_ROOMS", 5000),
+                finished_capacity=getattr(settings, "ROOM_STATE_FINISHED_CAPACITY", 200),
+            )
+        _backends[namespace] = backend
+    return backend
+
+
+def _reset_backends(setting, **kwargs):
+    if setting.startswith("ROOM_STATE_"):
+        _backends.clear()
+
+
+setting_changed.connect(_reset_backends)
@@ -0,0 +1,547 @@
+import asyncio
+import json
+import unittest
+from channels.testing import WebsocketCommunicator
+from django.test import SimpleTestCase, TestCase, override_settings
+from .consumers import QuizConsumer
+from .encoding import EncodedEventsMixin, diff_state, encode_broadcast, msgpack, negotiate
+from .codes import SPACE, CodeAllocator, FeistelPermutation, decode, encode
+from .deadlines import DeadlineScheduler, deadline_after, round_deadline_event, round_timers, server_now_ms
+from .ownership import get_room_ownership
+from .presence import PresenceHub
+from .reaper import reap
+from .rounds import RoundStateMachine
+from .state import InMemoryStateBackend, RedisStateBackend, RoomCapacityError
+
+try:
+    import fakeredis
+    import lupa  # noqa: F401  (fakeredis needs it for EVAL)
+except ImportError:
+    fakeredis = None
+
+
+class DeadlineSchedulerTestCase(SimpleTestCase):
+    async def test_fires_once_per_key(self):
+        scheduler = DeadlineScheduler()
+        fired = []
+
+        async def expire(tag):
+            fired.append(tag)
+
+        scheduler.schedule('room', deadline_after(0.05), expire, 'first')
+        # Re-arming the same round replaces the pending expiry
+        scheduler.schedule('room', deadline_after(0.02), expire, 'second')
+        self.assertEqual(scheduler.pending_count(), 1)
+
+        await asyncio.sleep(0.1)
+        self.assertEqual(fired, ['second'])
+        self.assertFalse(scheduler.is_scheduled('room'))
+
+    async def test_cancel(self):
+        scheduler = DeadlineScheduler()
+        fired = []
+
+        async def expire():
+            fired.append(True)
+
+        scheduler.schedule('room', deadline_after(0.02), expire)
+        self.assertIsNotNone(scheduler.deadline_for('room'))
+        self.assertTrue(scheduler.cancel('room'))
+        await asyncio.sleep(0.05)
+        self.assertEqual(fired, [])
+        self.assertIsNone(scheduler.deadline_for('room'))
+
+    def test_round_deadline_event(self):
+        before = server_now_ms()
+        event = round_deadline_event(before + 20000, 20, question_index=3)
+        self.assertEqual(event['type'], 'round_deadline')
+        self.assertEqual(event['deadline'] - before, 20000)
+        self.assertGreaterEqual(event['server_time'], before)
+        self.assertEqual(event['question_index'], 3)
+
+
+class WorkerQuizConsumer(QuizConsumer):
+    channel_layer_alias = "worker_a"
+
+
+class OtherWorkerQuizConsumer(QuizConsumer):
+    # A second worker process has its own, empty room store
+    channel_layer_alias = "worker_b"
+    rooms = InMemoryStateBackend()
+
+
+def two_worker_settings():
+    """Two channel-layer aliases backed by one fake Redis, as two workers would be."""
+    host = {
+        "connection_class": fakeredis.aioredis.FakeConnection,
+        "server": fakeredis.FakeServer(),
+    }
+    layer = {
+        "BACKEND": "channels_redis.core.RedisChannelLayer",
+        "CONFIG": {"hosts": [host], "prefix": "sqa-test"},
+    }
+    return {
+        "CHANNEL_LAYERS": {"worker_a": layer, "worker_b": layer},
+        "ROOM_OWNERSHIP_HOSTS": [host],
+    }
+
+
+@unittest.skipIf(fakeredis is None, "fakeredis and lupa are required for the multi-worker harness")
+class MultiWorkerRoutingTestCase(TestCase):
+    async def test_join_is_routed_to_owning_worker(self):
+        with override_settings(**two_worker_settings()):
+            worker_a = WebsocketCommunicator(WorkerQuizConsumer.as_asgi(), "/ws/quiz/")
+            worker_b = WebsocketCommunicator(OtherWorkerQuizConsumer.as_asgi(), "/ws/quiz/")
+            await worker_a.connect()
+            await worker_b.connect()
+            try:
+                await worker_a.send_to(text_data=json.dumps({"action": "create", "player": "alice"}))
+                created = json.loads(await worker_a.receive_from())
+                room = created["room"]
+                self.assertIsNotNone(await get_room_ownership().owner(room))
+
+                await worker_b.send_to(text_data=json.dumps({"action": "join", "room": room, "player": "bob"}))
+                # The joiner's socket is subscribed to the room group by the owner
+                joined = json.loads(await worker_b.receive_from(timeout=5))
+                self.assertEqual(joined["event"], "player_joined")
+                self.assertEqual(joined["players"], ["alice", "bob"])
+                self.assertFalse(OtherWorkerQuizConsumer.rooms.is_local(room))
+
+                await worker_b.send_to(text_data=json.dumps({"action": "join", "room": room, "player": "carol"}))
+                rejected = None
+                while rejected is None:
+                    message = json.loads(await worker_b.receive_from(timeout=5))
+                    if "error" in message:
+                        rejected = message
+                self.assertEqual(rejected["error"], "Room is full")
+            finally:
+                await worker_a.disconnect()
+                await worker_b.disconnect()
+
+
+class StateBackendConformance:
+    """Behaviour every room state backend must share."""
+
+    def make_backend(self):
+        raise NotImplementedError
+
+    async def test_create_get_save(self):
+        backend = self.make_backend()
+        self.assertTrue(await backend.create('room_1', {'players': ['alice'], 'scores': {'alice': 0}}))
+        self.assertFalse(await backend.create('room_1', {'players': []}))
+
+        state = await backend.get('room_1')
+        state['players'].append('bob')
+        state['scores']['bob'] = 10
+        await backend.save('room_1', state)
+
+        state = await backend.get('room_1')
+        self.assertEqual(state['players'], ['alice', 'bob'])
+        self.assertEqual(state['scores'], {'alice': 0, 'bob': 10})
+        self.assertIsNone(await backend.get('missing'))
+
+    async def test_record_answer_first_wins(self):
+        backend = self.make_backend()
+        await backend.create('room_1', {'players': ['alice', 'bob']})
+        self.assertEqual(await backend.record_answer('room_1', 0, 'alice', 2), (True, 1))
+        self.assertEqual(await backend.record_answer('room_1', 0, 'alice', 3), (False, 1))
+        self.assertEqual(await backend.record_answer('room_1', 0, 'bob', 1), (True, 2))
+        # A new round starts from scratch
+        self.assertEqual(await backend.record_answer('room_1', 1, 'alice', 0), (True, 1))
+        self.assertEqual(await backend.answers('room_1', 0), {'alice': 2, 'bob': 1})
+
+    async def test_answers_keep_scores_and_log(self):
+        backend = self.make_backend()
+        await backend.create('room_1', {'players': ['alice', 'bob']})
+        await backend.record_answer('room_1', 0, 'alice', {'selected': 0}, 10)
+        await backend.record_answer('room_1', 0, 'alice', {'selected': 1}, 10)
+        await backend.record_answer('room_1', 0, 'bob', {'selected': 1}, 0)
+        await backend.record_answer('room_1', 1, 'alice', {'selected': 2}, 10)
+        self.assertEqual(await backend.scores('room_1'), {'alice': 20, 'bob': 0})
+        self.assertEqual(await backend.answer_log('room_1'), [
+            ('alice', {'selected': 0}), ('bob', {'selected': 1}), ('alice', {'selected': 2}),
+        ])
+
+    async def test_save_keeps_concurrent_changes(self):
+        backend = self.make_backend()
+        await backend.create('room_1', {'players': ['alice'], 'current_q_index': 0, 'game_active': False})
+        first = await backend.get('room_1')
+        second = await backend.get('room_1')
+        first['current_q_index'] = 1
+        second['game_active'] = True
+        await backend.save('room_1', first)
+        await backend.save('room_1', second)
+
+        state = await backend.get('room_1')
+        self.assertEqual(state['current_q_index'], 1)
+        self.assertTrue(state['game_active'])
+
+    async def test_concurrent_answers_are_counted_once(self):
+        backend = self.make_backend()
+        await backend.create('room_1', {'players': []})
+        results = await asyncio.gather(*[
+            backend.record_answer('room_1', 0, f'player_{i % 50}', i) for i in range(200)
+        ])
+        self.assertEqual(sum(1 for recorded, _ in results if recorded), 50)
+        self.assertEqual(max(count for _, count in results), 50)
+
+    async def test_round_closes_exactly_once(self):
+        backend = self.make_backend()
+        rounds = RoundStateMachine(backend)
+        await backend.create('room_1', {'players': []})
+        self.assertFalse(await rounds.open('room_1', 1))
+        self.assertTrue(await rounds.open('room_1', 0))
+        self.assertTrue(await rounds.is_open('room_1', 0))
+
+        closed = await asyncio.gather(*[rounds.close('room_1', 0) for _ in range(100)])
+        self.assertEqual(closed.count(True), 1)
+        self.assertFalse(await rounds.is_open('room_1', 0))
+        self.assertTrue(await rounds.open('room_1', 1))
+        self.assertFalse(await rounds.open('room_1', 1))
+
+    async def test_finish_and_delete(self):
+        backend = self.make_backend()
+        await backend.create('room_1', {'players': ['alice']})
+        await backend.create('room_2', {'players': ['bob']})
+        await backend.record_answer('room_2', 0, 'bob', 1)
+        await backend.finish('room_1')
+        # Finished games stay readable but no longer count as live rooms
+        self.assertEqual((await backend.get('room_1'))['players'], ['alice'])
+        self.assertEqual(await backend.count(), 1)
+
+        await backend.delete('room_2')
+        self.assertIsNone(await backend.get('room_2'))
+        self.assertEqual(await backend.answers('room_2', 0), {})
+
+
+class InMemoryStateBackendTestCase(StateBackendConformance, SimpleTestCase):
+    def make_backend(self, **kwargs):
+        self.now = 0
+        return InMemoryStateBackend(clock=lambda: self.now, **kwargs)
+
+    async def test_idle_rooms_are_evicted(self):
+        backend = self.make_backend(idle_ttl=60)
+        await backend.create('room_1', {'players': []})
+        self.now = 30
+        await backend.create('room_2', {'players': []})
+        self.now = 75
+        self.assertEqual(await backend.evict_idle(), 1)
+        self.assertIsNone(await backend.get('room_1'))
+        self.assertIsNotNone(await backend.get('room_2'))
+
+    async def test_capacity_limits(self):
+        backend = self.make_backend(idle_ttl=60, max_rooms=2, finished_capacity=1)
+        await backend.create('room_1', {'players': []})
+        await backend.create('room_2', {'players': []})
+        with self.assertRaises(RoomCapacityError):
+            await backend.create('room_3', {'players': []})
+
+        # Finishing frees a live slot; only the most recent finished game is kept
+        await backend.finish('room_1')
+        await backend.finish('room_2')
+        self.assertTrue(await backend.create('room_3', {'players': []}))
+        self.assertIsNone(await backend.get('room_1'))
+        self.assertIsNotNone(await backend.get('room_2'))
+
+
+@unittest.skipIf(fakeredis is None, "fakeredis and lupa are required for the Redis backend tests")
+class RedisStateBackendTestCase(StateBackendConformance, SimpleTestCase):
+    def make_backend(self):
+        host = {
+            "connection_class": fakeredis.aioredis.FakeConnection,
+            "server": fakeredis.FakeServer(),
+        }
+        return RedisStateBackend([host], 'rooms')
+
+
+
+class StressQuizConsumer(QuizConsumer):
+    def __init__(self, backend):
+        super().__init__()
+        self.backend = backend
+        self.sent = []
+
+    @property
+    def rooms(self):
+        return self.backend
+
+    async def send_question(self, room_name):
+        self.sent.append((await self.rooms.get(room_name))["current_q_index"])
+        await super().send_question(room_name)
+
+
+class YieldingStateBackend:
+    """
+    Wraps a backend so reading a room yields to the event loop before and after.
+
+    Neither the in-memory backend nor fakeredis ever suspend inside ``get``,
+    which hides lost updates between a read and the following write.
+    """
+
+    def __init__(self, backend):
+        self.backend = backend
+
+    def __getattr__(self, name):
+        return getattr(self.backend, name)
+
+    async def get(self, room):
+        await asyncio.sleep(0)
+        state = await self.backend.get(room)
+        await asyncio.sleep(0)
+        return state
+
+
+class RoundCloseStressTestCase(SimpleTestCase):
+    async def fire_simultaneous_answers(self, backend):
+        from channels.layers import InMemoryChannelLayer
+
+        consumer = StressQuizConsumer(backend)
+        consumer.channel_layer = InMemoryChannelLayer()
+        players = [f'player_{i}' for i in range(300)]
+        question = {'question_text': 'Q', 'options': ['a', 'b'], 'correct_option': 0}
+        await backend.create('room_stress', {
+            'players': players,
+            'config': {'time_per_question': 20},
+            'questions': [question, question, question],
+            'current_q_index': 0,
+            'game_active': True,
+        })
+        await consumer.round_states.open('room_stress', 0)
+
+        answers = [
+            consumer.handle_answer({'room': 'room_stress', 'player': player, 'selected': i % 2, 'order': 1})
+            for i, player in enumerate(players)
+        ]
+        # Duplicate answers race with the first ones
+        answers[:-1] += [
+            consumer.handle_answer({'room': 'room_stress', 'player': player, 'selected': 0, 'order': 1})
+            for player in players[:50]
+        ]
+        # The round deadline races with the last answer
+        last_answer = [answers.pop(), *[consumer.expire_question('room_stress', 0) for _ in range(20)]]
+        try:
+            await asyncio.gather(*answers)
+            await asyncio.gather(*last_answer)
+        finally:
+            round_timers.cancel('room_stress')
+
+        room = await backend.get('room_stress')
+        self.assertEqual(room['current_q_index'], 1)
+        self.assertEqual(consumer.sent, [1])
+        self.assertTrue(await consumer.round_states.is_open('room_stress', 1))
+        self.assertEqual(await backend.answers('room_stress', 1), {})
+
+        # Every first answer was scored and logged exactly once
+        recorded = await backend.answers('room_stress', 0)
+        self.assertGreaterEqual(len(recorded), len(players) - 1)
+        expected_scores = {player: 10 if players.index(player) % 2 == 0 else 0 for player in recorded}
+        self.assertEqual(await backend.scores('room_stress'), expected_scores)
+        await consumer.finish_game('room_stress')
+        results = (await backend.get('room_stress'))['results']
+        self.assertEqual(results['scores'], {player: expected_scores.get(player, 0) for player in players})
+        for i, player in enumerate(players):
+            review = results['answer_review'][player]
+            if player not in recorded:
+                self.assertEqual(review, [])
+                continue
+            self.assertEqual(review, [recorded[player]])
+            self.assertEqual(review[0]['selected'], i % 2)
+            self.assertEqual(review[0]['is_correct'], i % 2 == 0)
+
+    async def test_in_memory_backend(self):
+        await self.fire_simultaneous_answers(InMemoryStateBackend())
+
+    async def test_yielding_in_memory_backend(self):
+        await self.fire_simultaneous_answers(YieldingStateBackend(InMemoryStateBackend()))
+
+    @unittest.skipIf(fakeredis is None, "fakeredis and lupa are required for the Redis backend tests")
+    async def test_redis_backend(self):
+        host = {
+            "connection_class": fakeredis.aioredis.FakeConnection,
+            "server": fakeredis.FakeServer(),
+        }
+        await self.fire_simultaneous_answers(RedisStateBackend([host], 'rooms'))
+
+    @unittest.skipIf(fakeredis is None, "fakeredis and lupa are required for the Redis backend tests")
+    async def test_yielding_redis_backend(self):
+        host = {
+            "connection_class": fakeredis.aioredis.FakeConnection,
+            "server": fakeredis.FakeServer(),
+        }
+        await self.fire_simultaneous_answers(YieldingStateBackend(RedisStateBackend([host], 'rooms')))
+
+
+class EncodingTestCase(SimpleTestCase):
+    def test_negotiate(self):
+        self.assertEqual(negotiate([]), (None, 'json', False))
+        self.assertEqual(negotiate(['graphql-ws', 'json.delta']), ('json.delta', 'json', True))
+        if msgpack is not None:
+            self.assertEqual(negotiate(['msgpack', 'json']), ('msgpack', 'msgpack', False))
+
+    def test_diff_state(self):
+        previous = {'id': 1, 'challenges': [{'id': 1}], 'scores': {'a': 0, 'b': 0}, 'player2_ready': False}
+        current = {'id': 1, 'challenges': [{'id': 1}], 'scores': {'a': 10, 'b': 0}, 'player2_ready': True}
+        self.assertEqual(diff_state(previous, current), {'scores': {'a': 10}, 'player2_ready': True})
+        self.assertEqual(diff_state(current, current), {})
+        # Removed keys cannot be expressed as a merge
+        self.assertIsNone(diff_state(previous, {'id': 1}))
+
+    async def test_broadcast_is_forwarded_verbatim(self):
+        class Socket(EncodedEventsMixin):
+            def __init__(self, player_name):
+                self.scope = {}
+                self.player_name = player_name
+                self.frames = []
+
+            async def send(self, text_data=None, bytes_data=None):
+                self.frames.append(text_data)
+
+        alice, bob = Socket('alice'), Socket('bob')
+        event = encode_broadcast({'event': 'opponent_running', 'player': 'alice'}, exclude='alice')
+        for socket in (alice, bob):
+            await socket.encoded_broadcast(event)
+        self.assertEqual(alice.frames, [])
+        self.assertIs(bob.frames[0], event['text'])
+
+    @unittest.skipIf(msgpack is None, "msgpack is not installed")
+    async def test_msgpack_frames(self):
+        communicator = WebsocketCommunicator(QuizConsumer.as_asgi(), "/ws/quiz/", subprotocols=['msgpack', 'json'])
+        connected, subprotocol = await communicator.connect()
+        self.assertTrue(connected)
+        self.assertEqual(subprotocol, 'msgpack')
+        await communicator.send_to(bytes_data=msgpack.packb({'action': 'clock_sync', 'client_time': 123}))
+        reply = msgpack.unpackb(await communicator.receive_from())
+        self.assertEqual(reply['event'], 'clock_sync')
+        self.assertEqual(reply['client_time'], 123)
+        await communicator.disconnect()
+
+
+class PresenceHubTestCase(SimpleTestCase):
+    def setUp(self):
+        self.published = []
+
+        async def publish(group, payload):
+            self.published.append(payload)
+
+        self.hub = PresenceHub(interval=0.05, typing_timeout=0.1, publish=publish)
+
+    async def test_typing_storm_is_coalesced(self):
+        for _ in range(200):
+            self.hub.typing('battle_ABC', 'alice')
+        self.hub.update('battle_ABC', 'alice', ready=True)
+        await asyncio.sleep(0.02)
+        self.assertEqual(len(self.published), 1)
+        self.assertEqual(self.published[0]['changed'], ['online', 'typing', 'ready', 'tab_warnings'])
+        self.assertTrue(self.published[0]['typing'])
+
+        self.hub.tab_warning('battle_ABC', 'alice')
+        self.hub.tab_warning('battle_ABC', 'alice')
+        await asyncio.sleep(0.06)
+        # The trailing edge delivers the merged change once
+        self.assertEqual(len(self.published), 2)
+        self.assertEqual(self.published[1]['changed'], ['tab_warnings'])
+        self.assertEqual(self.published[1]['tab_warnings'], 2)
+
+    async def test_typing_expires_and_leave_drops_state(self):
+        self.hub.typing('battle_ABC', 'alice')
+        await asyncio.sleep(0.2)
+        self.assertEqual([event['typing'] for event in self.published], [True, False])
+
+        self.hub.leave('battle_ABC', 'alice')
+        await asyncio.sleep(0.06)
+        self.assertFalse(self.published[-1]['online'])
+        self.assertEqual(self.hub.state('battle_ABC'), {})
+
+
+class CodeAllocatorTestCase(SimpleTestCase):
+    def test_permutation_is_a_bijection(self):
+        permutation = FeistelPermutation('test')
+        samples = list(range(2000)) + [SPACE - 1 - i for i in range(2000)]
+        images = [permutation.forward(n) for n in samples]
+        self.assertEqual(len(set(images)), len(samples))
+        self.assertTrue(all(0 <= image < SPACE for image in images))
+        self.assertEqual([permutation.inverse(image) for image in images], samples)
+        self.assertEqual(decode(encode(SPACE - 1)), SPACE - 1)
+
+    def test_blocks_are_reserved_once_per_block_and_codes_recycled(self):
+        blocks = iter(range(0, 10**6, 100))
+        reserved = []
+
+        def reserve(namespace):
+            reserved.append(next(blocks))
+            return reserved[-1]
+
+        allocator = CodeAllocator('rooms', 'test', reserve=reserve)
+        codes = [allocator.allocate() for _ in range(250)]
+        self.assertEqual(len(set(codes)), 250)
+        self.assertEqual(len(reserved), 3)
+        self.assertTrue(all(len(code) == 6 for code in codes))
+        self.assertEqual(allocator.sequence_number(codes[42]), 42)
+
+        allocator.release(codes[0])
+        allocator.release(codes[0])
+        self.assertEqual(allocator.allocate(), codes[0])
+        self.assertNotEqual(allocator.allocate(), codes[0])
+
+
+class ReaperTestCase(TestCase):
+    def setUp(self):
+        from accounts.models import User
+        self.user = User.objects.create_user(username='reaped', password='pass')
+
+    def test_reaps_idle_rooms_and_battles_in_batches(self):
+        from datetime import timedelta
+        from django.utils import timezone
+        from codebattle.models import Battle
+        from multiplayer.models import Room
+
+        old = timezone.now() - timedelta(days=2)
+        idle_rooms = [Room.objects.create(name=f'idle {i}', host=self.user) for i in range(3)]
+        fresh_room = Room.objects.create(name='fresh', host=self.user)
+        Room.objects.filter(pk__in=[room.pk for room in idle_rooms]).update(created_at=old)
+        waiting = Battle.objects.create(player1=self.user)
+        playing = Battle.objects.create(player1=self.user, player2=self.user, status='in_progress')
+        Battle.objects.create(player1=self.user)
+        Battle.objects.filter(pk__in=[waiting.pk, playing.pk]).update(started_at=old)
+
+        counts = reap(batch_size=2, max_batches=1)
+        self.assertEqual(counts, {'rooms': 2, 'waiting_battles': 1, 'stale_battles': 1})
+        counts = reap(batch_size=2)
+        self.assertEqual(counts, {'rooms': 1, 'waiting_battles': 0, 'stale_battles': 0})
+
+        self.assertEqual(list(Room.objects.filter(is_active=True)), [fresh_room])
+        self.assertFalse(Battle.objects.filter(pk=waiting.pk).exists())
+        self.assertEqual(Battle.objects.get(pk=playing.pk).status, 'completed')
+        self.assertEqual(Battle.objects.count(), 2)
+
+
+class ResponseCacheTestCase(SimpleTestCase):
+    def setUp(self):
+        from django.core.cache import cache
+        cache.clear()
+        self.builds = 0
+
+    def build(self):
+        self.builds += 1
+        return self.builds
+
+    def test_versioned_invalidation(self):
+        from .cache import cached, invalidate
+        self.assertEqual(cached('things', self.build), 1)
+        self.assertEqual(cached('things', self.build), 1)
+        invalidate('things')
+        self.assertEqual(cached('things', self.build), 2)
+
+    def test_stale_value_served_while_another_caller_rebuilds(self):
+        from django.core.cache import cache
+        from .cache import cached, invalidate
+        cached('things', self.build)
+        invalidate('things')
+        cache.add('swr:things:lock', 1)  # a rebuild is under way elsewhere
+        self.assertEqual(cached('things', self.build), 1)
+        self.assertEqual(self.builds, 1)
+
+        cache.delete('swr:things:lock')
+        with override_settings(RESPONSE_CACHE_FRESH=0):
+            self.assertEqual(cached('things', self.build), 2)
+            self.assertEqual(cached('things', self.build), 3)  # never fresh
@@ -25,26 +25,16 @@ def health_check(request):
 
 def home(request):
     from quizzes.models import Topic
+    from smartquizarena.cache import cached
     try:
-        topics = Topic.objects.all()
+        topics = cached('topics', lambda: list(Topic.objects.all()))
     except Exception as e:
         topics = []
     return render(request, 'home.html', {'topics': topics})
 
 def leaderboard(request):
-    from accounts.models import User
-    from gamification.models import Streak
-    top_users = User.objects.order_by('-total_score')[:10]
-    leaderboard_data = []
-    for user in top_users:
-        streak, _ = Streak.objects.get_or_create(user=user)
-        leaderboard_data.append({
-            'username': user.username,
-            'total_score': user.total_score,
-            'level': user.level,
-            'xp': user.xp,
-            'current_streak': streak.current_streak,
-        })
+    from gamification.leaderboard import top_rows
+    leaderboard_data = top_rows()
     return render(request, 'leaderboard.html', {'leaderboard': leaderboard_data})
 
 def achievements(request):